@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Stand-in for rpicam-vid, for running the runtime without a camera
+
+    python3 fake_camera.py -t 0 -n --codec mjpeg --width 640 --height 480 --framerate 30 -o -
+
+Takes the rpicam-vid arguments FrameSource passes and writes a synthetic
+stream to stdout: a gradient with a moving bar (JPEG-encoded with OpenCV
+for mjpeg), or the frames of a recorded stream with --input=FILE, in a
+loop. FrameSource(command="python3 fake_camera.py") uses it.
+"""
+import sys
+import time
+
+import numpy as np
+
+def synthetic_frame(width, height, n):
+    """BGR gradient with a bar that moves one step per frame"""
+    image = np.empty((height, width, 3), np.uint8)
+    image[:, :, 0] = np.linspace(0, 255, width, dtype=np.uint8)[None, :]
+    image[:, :, 1] = np.linspace(0, 255, height, dtype=np.uint8)[:, None]
+    image[:, :, 2] = 128
+    x = (n * 8) % width
+    image[:, x:x + 16] = 255
+    return image
+
+def encode(image, codec):
+    import cv2
+    if codec == 'mjpeg':
+        return cv2.imencode('.jpg', image)[1].tobytes()
+    return cv2.cvtColor(image, cv2.COLOR_BGR2YUV_I420).tobytes()
+
+def recorded_frames(file, codec, width, height):
+    """The frames of a recorded .mjpeg or .yuv stream"""
+    with open(file, 'rb') as f:
+        data = f.read()
+    if codec == 'yuv420':
+        size = width * height * 3 // 2
+        return [data[i:i + size] for i in range(0, len(data) - size + 1, size)]
+    frames = []
+    start = data.find(b'\xff\xd8')
+    while start >= 0:
+        end = data.find(b'\xff\xd9', start)
+        if end < 0:
+            break
+        frames.append(data[start:end + 2])
+        start = data.find(b'\xff\xd8', end)
+    return frames
+
+def get_arg(argv, name, default):
+    """Value of "name value" or "name=value" in argv"""
+    for i, arg in enumerate(argv):
+        if arg == name and i + 1 < len(argv):
+            return argv[i + 1]
+        if arg.startswith(name + '='):
+            return arg.split('=', 1)[1]
+    return default
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    codec = get_arg(argv, '--codec', 'yuv420')
+    width = int(get_arg(argv, '--width', 640))
+    height = int(get_arg(argv, '--height', 480))
+    framerate = float(get_arg(argv, '--framerate', 30))
+    frames = int(get_arg(argv, '--frames', 0))  # 0: forever
+    recorded = None
+    if get_arg(argv, '--input', None) is not None:
+        recorded = recorded_frames(get_arg(argv, '--input', None), codec, width, height)
+    else:
+        # a few distinct frames, encoding every frame would load the CPU
+        # more than the camera does
+        recorded = [encode(synthetic_frame(width, height, n), codec) for n in range(30)]
+
+    out = sys.stdout.buffer
+    period = 1 / framerate
+    next_time = time.monotonic()
+    n = 0
+    try:
+        while frames == 0 or n < frames:
+            out.write(recorded[n % len(recorded)])
+            out.flush()
+            n += 1
+            next_time += period
+            time.sleep(max(next_time - time.monotonic(), 0))
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
@@ -0,0 +1,170 @@
+"""
+Stand-in for smbus2.SMBus, for running the runtime without the robot
+
+    bus = FakeSMBus([FakeICM20948(), FakeVL53L0X(), FakeRobotHat()])
+    sampler = Sampler(bus, [ICM20948(), VL53L0X()])
+    writer = ServoWriter(bus)
+
+The devices are register models: writes land in their registers, reads
+return them, and the sensors fill their data registers with synthetic
+motion when they are read. Every transaction is counted in bus.stats and,
+with record=True, kept in bus.transactions, so the number of transactions
+and bytes per sample can be compared without hardware. byte_time makes
+each transaction take as long as it would on the wire (about 22us per
+byte at 400kHz).
+"""
+import math
+import struct
+import time
+
+class FakeDevice:
+    """256 registers at address, written and read as they are"""
+
+    def __init__(self, address):
+        self.address = address
+        self.registers = bytearray(256)
+
+    def read(self, register, length):
+        return list(self.registers[register:register + length])
+
+    def write(self, register, data):
+        self.registers[register:register + len(data)] = bytes(data)
+
+class FakeSMBus:
+    """The smbus2.SMBus calls the runtime uses, on a set of FakeDevices"""
+
+    def __init__(self, devices=(), byte_time=0.0, record=False):
+        self.devices = {device.address: device for device in devices}
+        self.byte_time = byte_time
+        self.record = record
+        self.transactions = []  # (time, 'r' or 'w', address, register, length)
+        self.stats = {'transactions': 0, 'bytes': 0}
+
+    def device(self, address):
+        if address not in self.devices:
+            raise OSError(121, "Remote I/O error")  # what the kernel says for no ACK
+        return self.devices[address]
+
+    def transaction(self, kind, address, register, length):
+        self.stats['transactions'] += 1
+        self.stats['bytes'] += length + 2  # address and register byte
+        if self.record:
+            self.transactions.append((time.monotonic(), kind, address, register, length))
+        if self.byte_time > 0:
+            time.sleep((length + 2) * self.byte_time)
+
+    def read_byte_data(self, address, register):
+        self.transaction('r', address, register, 1)
+        return self.device(address).read(register, 1)[0]
+
+    def read_i2c_block_data(self, address, register, length):
+        self.transaction('r', address, register, length)
+        return self.device(address).read(register, length)
+
+    def write_byte_data(self, address, register, value):
+        self.transaction('w', address, register, 1)
+        self.device(address).write(register, [value])
+
+    def write_i2c_block_data(self, address, register, data):
+        self.transaction('w', address, register, len(data))
+        self.device(address).write(register, data)
+
+    def write_word_data(self, address, register, value):
+        self.transaction('w', address, register, 2)
+        self.device(address).write(register, [value & 0xff, value >> 8])
+
+    def close(self):
+        pass
+
+class FakeICM20948(FakeDevice):
+    """ICM-20948 with its magnetometer behind the I2C master, standing still with a slow wobble"""
+
+    def __init__(self, address=0x68):
+        super().__init__(address)
+        self.banks = [bytearray(128) for _ in range(4)]
+        self.banks[0][0x00] = 0xEA  # WHO_AM_I
+        self.start = time.monotonic()
+
+    def read(self, register, length):
+        bank = self.banks[(self.banks[0][0x7F] >> 4) & 3]
+        if bank is self.banks[0] and register <= 0x43 < register + length:
+            self.update()
+        return list(bank[register:register + length])
+
+    def write(self, register, data):
+        if register == 0x7F:  # REG_BANK_SEL is in every bank
+            self.banks[0][0x7F] = data[0]
+            return
+        bank = self.banks[(self.banks[0][0x7F] >> 4) & 3]
+        bank[register:register + len(data)] = bytes(data)
+
+    def update(self):
+        t = time.monotonic() - self.start
+        wobble = math.sin(2 * math.pi * 0.5 * t)
+        # +-4g and +-500dps, see ICM20948.setup()
+        accel = (0.05 * wobble, -0.05 * wobble, 1.0)
+        gyro = (20 * wobble, 5 * wobble, -10 * wobble)
+        raw = [int(a * 8192) for a in accel] + [int(g * 65.5) for g in gyro]
+        raw.append(int((25.0 - 21) * 333.87))
+        self.banks[0][0x2D:0x3B] = struct.pack('>7h', *raw)
+        # the AK09916 registers ST1 .. ST2 as the I2C master copies them
+        mag = (int(20 / 0.15), int(-5 / 0.15), int((40 + wobble) / 0.15))
+        self.banks[0][0x3B:0x44] = bytes([0x01]) + struct.pack('<3h', *mag) + bytes([0, 0x10])
+
+class FakeVL53L0X(FakeDevice):
+    """
+    VL53L0X measuring a wall moving between 20cm and 60cm, a new range every period
+
+    Answers the steps of VL53L0X.setup() that wait for the chip: the SPAD
+    info read from the NVM and the reference calibrations.
+    """
+
+    def __init__(self, address=0x29, period=0.033):
+        super().__init__(address)
+        self.registers[0xC0] = 0xEE  # IDENTIFICATION_MODEL_ID
+        self.registers[0x91] = 0x3C  # the stop variable
+        self.registers[0x92] = 0x80 | 5  # 5 aperture reference SPADs
+        self.registers[0xB0:0xB6] = bytes([0xFF] * 6)  # GLOBAL_CONFIG_SPAD_ENABLES_REF
+        self.registers[0x50] = 0x06  # PRE_RANGE_CONFIG_VCSEL_PERIOD, 14 PCLKs
+        self.registers[0x70] = 0x04  # FINAL_RANGE_CONFIG_VCSEL_PERIOD, 10 PCLKs
+        self.period = period
+        self.start = time.monotonic()
+        self.ranges = 0  # ranges handed out
+
+    def read(self, register, length):
+        t = time.monotonic() - self.start
+        if self.registers[0x00] & 0x02 and t // self.period > self.ranges:
+            self.ranges = int(t // self.period)
+            self.registers[0x13] = 0x04  # new sample ready
+            self.registers[0x14] = 11 << 3  # range valid
+            self.registers[0x1E:0x20] = struct.pack('>H', int(400 + 200 * math.sin(t)))
+        return super().read(register, length)
+
+    def write(self, register, data):
+        super().write(register, data)
+        page = self.registers[0xFF]
+        if register == 0x0B and data[0] & 0x01:  # SYSTEM_INTERRUPT_CLEAR
+            self.registers[0x13] = 0
+        elif register == 0x00 and page == 0x00 and data[0] & 0x01:  # SYSRANGE_START, single
+            self.registers[0x13] = 0x01  # done at once
+        elif register == 0x83 and page == 0x07 and data[0] == 0x00:
+            self.registers[0x83] = 0x10  # the NVM read is done
+
+class FakeRobotHat(FakeDevice):
+    """
+    The Robot HAT's PWM controller: 16-bit registers, high byte first
+
+    A write of several values steps to the next register after each one,
+    which is what ServoWriter(block=True) relies on.
+    """
+
+    def __init__(self, address=0x14):
+        super().__init__(address)
+        self.values = {}  # register -> last 16-bit value written
+
+    def write(self, register, data):
+        for i in range(0, len(data) - 1, 2):
+            self.values[register + i // 2] = (data[i] << 8) | data[i + 1]
+
+    def read(self, register, length):
+        raise OSError(121, "Remote I/O error")  # the HAT's PWM registers aren't read back
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Camera frames for several processes, through shared memory
+
+Only one process can own the camera. It publishes every frame to the
+bus, and the vision processes (QR codes, pose, obstacles) read them from
+shared memory without copies or pickling:
+
+    bus = FrameBus.create('camera', (720, 640))       # the camera process
+    bus.publish(frame)
+
+    bus = FrameBus.attach('camera')                   # every consumer
+    seq, frame = bus.wait()
+    ... use frame ...
+    if bus.valid(seq): ...                            # not overwritten meanwhile
+
+The bus is a file in /dev/shm with a header, a table of slots and the
+frame data. The producer writes frame n into slot n % slots and never
+waits for anyone: the oldest frame is overwritten. Consumers always take
+the newest frame, so a slow one (mediapipe) skips frames without
+holding back the fast ones; bus.stats counts what it skipped. Each slot
+carries the sequence number of its frame, cleared while the frame is
+written, so a consumer can tell whether the frame it used was
+overwritten under it.
+
+Python has no memory barriers, so nothing orders the producer's stores
+(seq cleared, frame, seq set) for a consumer on another core, and ARM
+(the Pi) may make them visible out of order. The sequence checks before
+and after a read catch a frame overwritten while it is used, but they
+can't rule out a torn frame on ARM entirely. read() copies the frame and
+checks again; a consumer that must never act on a torn frame should
+check its content as well (e.g. the JPEG end marker).
+
+    python3 frame_bus.py --publish [--fake] [option]  # camera -> bus
+    python3 frame_bus.py --watch [option]             # frame rate of a consumer
+"""
+import mmap
+import os
+import sys
+import time
+
+import numpy as np
+
+MAGIC = 0x50434642  # "PCFB"
+VERSION = 1
+SHM_DIR = "/dev/shm"
+
+HEADER = np.dtype([('magic', '<u4'), ('version', '<u4'), ('slots', '<u4'), ('ndim', '<u4'),
+                   ('shape', '<u8', (4,)), ('dtype', 'S8'), ('slot_size', '<u8'),
+                   ('latest', '<u8'), ('producer', '<u8'), ('closed', '<u4'), ('pad', '<u4')])
+SLOT = np.dtype([('seq', '<u8'), ('length', '<u8'), ('timestamp', '<f8'), ('pad', '<u8')])
+ALIGN = 4096  # frame data starts on a page
+
+def bus_path(name):
+    return os.path.join(SHM_DIR, name)
+
+def layout(slots, slot_size):
+    """Offsets of the slot table and the data, and the size of the bus"""
+    table = HEADER.itemsize
+    data = -(-(table + SLOT.itemsize * slots) // ALIGN) * ALIGN
+    slot_size = -(-slot_size // ALIGN) * ALIGN
+    return table, data, slot_size, data + slot_size * slots
+
+class FrameBus:
+    """One bus, from the producer's or a consumer's side"""
+
+    def __init__(self, name, buf, writable):
+        self.name = name
+        self.buf = buf
+        self.writable = writable
+        self.header = np.ndarray((), HEADER, buf, 0)
+        slots = int(self.header['slots'])
+        self.shape = tuple(int(n) for n in self.header['shape'][:int(self.header['ndim'])])
+        self.dtype = np.dtype(self.header['dtype'].item().decode())
+        table, data, slot_size, _ = layout(slots, int(self.header['slot_size']))
+        self.table = np.ndarray((slots,), SLOT, buf, table)
+        count = int(np.prod(self.shape))
+        self.frames = [np.ndarray(self.shape, self.dtype, buf, data + i * slot_size)
+                       for i in range(slots)]
+        self.flat = [np.ndarray((count,), self.dtype, buf, data + i * slot_size)
+                     for i in range(slots)]
+        self.variable = len(self.shape) == 1  # e.g. JPEGs, up to shape[0] long
+        self.stats = {'frames': 0, 'skipped': 0, 'overwritten': 0}
+        self.last = 0
+
+    @classmethod
+    def create(cls, name, shape, dtype='uint8', slots=4):
+        """
+        Create the bus name for frames of shape, as the producer
+
+        A 1-D shape is the capacity for frames of variable length, e.g.
+        JPEGs. An old bus of the same name is replaced.
+        """
+        shape = tuple(shape)
+        dtype = np.dtype(dtype)
+        if slots < 2 or not 1 <= len(shape) <= 4:
+            raise ValueError("a bus needs at least 2 slots and frames of 1 to 4 dimensions")
+        slot_size = int(np.prod(shape)) * dtype.itemsize
+        _, _, _, size = layout(slots, slot_size)
+        path = bus_path(name)
+        # a new file, consumers of the old one keep their mapping until they reattach
+        tmp = f"{path}.{os.getpid()}.tmp"
+        fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            buf = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        header = np.ndarray((), HEADER, buf, 0)
+        header['slots'], header['ndim'] = slots, len(shape)
+        header['shape'][:len(shape)] = shape
+        header['dtype'] = dtype.str.encode()
+        header['slot_size'] = slot_size
+        header['producer'] = os.getpid()
+        header['version'] = VERSION
+        header['magic'] = MAGIC  # last, the bus is complete
+        os.replace(tmp, path)
+        return cls(name, buf, writable=True)
+
+    @classmethod
+    def attach(cls, name, timeout=None):
+        """Attach to the bus name as a consumer, waiting up to timeout seconds for it to appear"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                fd = os.open(bus_path(name), os.O_RDONLY)
+                break
+            except FileNotFoundError:
+                if deadline is not None and time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+        try:
+            buf = mmap.mmap(fd, 0, prot=mmap.PROT_READ)
+        finally:
+            os.close(fd)
+        header = np.ndarray((), HEADER, buf, 0)
+        if header['magic'] != MAGIC or header['version'] != VERSION:
+            raise ValueError(f"{bus_path(name)} is not a frame bus of version {VERSION}")
+        return cls(name, buf, writable=False)
+
+    def close(self, unlink=None):
+        """Detach; the producer marks the bus closed and removes it (unless unlink=False)"""
+        if self.writable:
+            self.header['closed'] = 1
+            if unlink is not False:
+                try:
+                    os.remove(bus_path(self.name))
+                except FileNotFoundError:
+                    pass
+        # the numpy views keep the mapping alive until they are gone
+        self.header = self.table = self.frames = self.flat = None
+
+    @property
+    def closed(self):
+        """Whether the producer closed the bus or this side detached"""
+        return self.header is None or bool(self.header['closed'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # producer
+    # ========
+    def publish(self, frame, timestamp=None):
+        """Copy frame into the next slot and make it the latest, returns its sequence number"""
+        self.check_open()
+        seq = int(self.header['latest']) + 1
+        slot = self.table[(seq - 1) % len(self.table)]
+        slot['seq'] = 0  # being written
+        if self.variable:
+            length = len(frame)
+            if length > self.shape[0]:
+                raise ValueError(f"frame of {length} is larger than the bus ({self.shape[0]})")
+            self.flat[(seq - 1) % len(self.table)][:length] = frame
+        else:
+            length = self.shape[0]
+            np.copyto(self.frames[(seq - 1) % len(self.table)], frame, casting='no')
+        slot['length'] = length
+        slot['timestamp'] = time.time() if timestamp is None else timestamp
+        slot['seq'] = seq
+        self.header['latest'] = seq
+        return seq
+
+    # consumers
+    # =========
+    def check_open(self):
+        if self.header is None:
+            raise ValueError(f"bus {self.name} closed")
+
+    def latest(self):
+        """(seq, frame) of the newest frame, (0, None) before the first one"""
+        self.check_open()
+        while True:
+            seq = int(self.header['latest'])
+            if seq == 0:
+                return 0, None
+            index = (seq - 1) % len(self.table)
+            length = int(self.table[index]['length'])
+            if int(self.table[index]['seq']) != seq:
+                continue  # overwritten right now, take the newer one
+            if self.variable:
+                return seq, self.frames[index][:length]
+            return seq, self.frames[index]
+
+    def wait(self, after=None, timeout=None, poll=0.001):
+        """
+        (seq, frame) of the newest frame after seq after
+
+        after defaults to the last frame this consumer got. The frames
+        in between are skipped and counted. Returns (seq, None) on
+        timeout or when the producer closed the bus.
+        """
+        self.check_open()
+        if after is None:
+            after = self.last
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while int(self.header['latest']) <= after:
+            if self.header['closed'] or (deadline is not None and time.monotonic() > deadline):
+                return int(self.header['latest']), None
+            time.sleep(poll)
+        seq, frame = self.latest()
+        self.stats['frames'] += 1
+        self.stats['skipped'] += max(seq - after - 1, 0) if after > 0 else 0
+        self.last = seq
+        return seq, frame
+
+    def valid(self, seq):
+        """Whether the frame seq is still intact, check after using a frame"""
+        self.check_open()
+        intact = int(self.table[(seq - 1) % len(self.table)]['seq']) == seq
+        if not intact:
+            self.stats['overwritten'] += 1
+        return intact
+
+    def read(self, out, after=None, timeout=None):
+        """
+        Copy the newest frame after seq after into out, returns its seq
+
+        Retries until the copy is intact, for consumers that keep a
+        frame longer than the bus keeps it. 0 on timeout.
+        """
+        while True:
+            seq, frame = self.wait(after, timeout)
+            if frame is None:
+                return 0
+            if self.variable:
+                out[:len(frame)] = frame
+            else:
+                np.copyto(out, frame)
+            if self.valid(seq):
+                return seq
+
+    def timestamp(self, seq):
+        self.check_open()
+        return float(self.table[(seq - 1) % len(self.table)]['timestamp'])
+
+# command line
+# ============
+avaiable_options = ["-h", "--help", "--publish", "--watch", "--name", "--width", "--height",
+                    "--framerate", "--codec", "--slots", "--fake", "--command"]
+
+usage = '''
+Usage:
+    python3 frame_bus.py --publish [option]
+    python3 frame_bus.py --watch [option]
+
+Options:
+               --publish   Stream the camera (rpicam-vid) to the bus
+               --watch     Read the bus and print the frame rate and skipped frames
+               --name=NAME Name of the bus in /dev/shm (default picrawler-camera)
+               --width=N --height=N --framerate=N
+                           Camera mode (default 640x480 at 30)
+               --codec=NAME
+                           yuv420 (default) or mjpeg
+               --slots=N   Frames the bus holds (default 4)
+               --fake      Publish synthetic frames of fake_camera.py
+               --command=CMD
+                           Use CMD instead of rpicam-vid
+    -h         --help      Show this help text and exit
+'''
+
+def get_option(options, name, default=None):
+    for opt in options:
+        if opt.startswith(name + "="):
+            return opt.split("=", 1)[1]
+    return default
+
+def publish_camera(options, name):
+    from frame_source import FrameSource
+    width = int(get_option(options, "--width", 640))
+    height = int(get_option(options, "--height", 480))
+    codec = get_option(options, "--codec", "yuv420")
+    command = get_option(options, "--command")
+    if "--fake" in options:
+        command = f"{sys.executable} {os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_camera.py')}"
+    shape = (height * 3 // 2, width) if codec == 'yuv420' else (width * height * 3 // 2,)
+    with FrameSource(width, height, int(get_option(options, "--framerate", 30)), codec,
+                     command=command) as camera, \
+            FrameBus.create(name, shape, slots=int(get_option(options, "--slots", 4))) as bus:
+        print(f"Publishing {codec} {width}x{height} to {bus_path(name)}, Ctrl+C to stop")
+        seq = 0
+        while True:
+            seq, frame = camera.wait(seq, timeout=5)
+            if frame is None:
+                if camera.error is not None:
+                    print(f"\033[0;31mCan't start the camera: {camera.error}\033[0m")
+                else:
+                    print("The camera stopped")
+                break
+            bus.publish(frame)
+
+def watch(name):
+    bus = FrameBus.attach(name, timeout=10)
+    print(f"Reading {bus_path(name)}: {bus.shape} {bus.dtype}, Ctrl+C to stop")
+    start, frames = time.time(), 0
+    while True:
+        seq, frame = bus.wait(timeout=5)
+        if frame is None:
+            print("The producer stopped")
+            break
+        frames += 1
+        if time.time() - start >= 1:
+            print(f"  {frames / (time.time() - start):.1f} fps, frame {seq},"
+                  f" {bus.stats['skipped']} skipped,"
+                  f" {(time.time() - bus.timestamp(seq)) * 1000:.1f}ms old")
+            start, frames = time.time(), 0
+
+if __name__ == "__main__":
+    options = sys.argv[1:]
+    for opt in options:
+        if opt.split('=')[0] not in avaiable_options:
+            print("Option {} is not found.".format(opt))
+            print(usage)
+            sys.exit(0)
+    if "-h" in options or "--help" in options or not ("--publish" in options or "--watch" in options):
+        print(usage)
+        sys.exit(0)
+    # e.g. systemd stopping the service, so the bus is removed as well
+    import signal
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        if "--publish" in options:
+            publish_camera(options, get_option(options, "--name", "picrawler-camera"))
+        else:
+            watch(get_option(options, "--name", "picrawler-camera"))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,250 @@
+"""
+Camera frames from one long-running rpicam-vid process
+
+picamera2 doesn't see the camera on Ubuntu 24.04 (see vilib-investigation),
+but the rpicam CLI tools do. Starting rpicam-jpeg for every frame costs
+about a second; FrameSource starts rpicam-vid once and reads its stream
+from a pipe instead:
+
+    from frame_source import FrameSource
+
+    with FrameSource(640, 480, codec='yuv420') as camera:
+        seq, frame = camera.wait()
+        gray = frame[:480]  # the Y plane
+
+Frames are read straight into a ring of buffers allocated up front, so
+nothing is allocated per frame. latest() and wait() hand out views of
+the ring, not copies: a view stays valid until the camera wraps around
+the ring, i.e. for ring - 1 more frames. Copy it (or check valid(seq))
+to keep it longer.
+
+yuv420 frames are numpy arrays of shape (height * 3 // 2, width): the Y
+plane, then U and V. The width must be a multiple of 64, rpicam-vid pads
+the rows of other widths. mjpeg frames are the encoded JPEG as a 1-D uint8
+array, decode() turns one into a BGR image with OpenCV.
+"""
+import shlex
+import subprocess
+import threading
+import time
+
+import numpy as np
+
+SOI = b'\xff\xd8'  # start of a JPEG
+EOI = b'\xff\xd9'  # end of it, 0xff in the data is always followed by 0x00
+
+class FrameSource:
+    """Stream of frames from rpicam-vid (or the stand-in given as command)"""
+
+    def __init__(self, width=640, height=480, framerate=30, codec='yuv420', ring=4,
+                 command=None, restart=True):
+        if codec not in ('yuv420', 'mjpeg'):
+            raise ValueError(f"codec must be yuv420 or mjpeg, not {codec}")
+        if ring < 2:
+            raise ValueError("the ring needs at least 2 buffers")
+        if codec == 'yuv420' and width % 64 != 0:
+            # rpicam-vid would pad the rows to a multiple of 64, frames would be skewed
+            raise ValueError(f"yuv420 needs a width that is a multiple of 64, not {width}")
+        self.width, self.height, self.framerate = width, height, framerate
+        self.codec = codec
+        self.restart = restart
+        if command is None:
+            command = "rpicam-vid"
+        # the stand-ins (fake_camera.py) take the same arguments
+        self.command = (f"{command} -t 0 -n --codec {codec} --width {width} --height {height}"
+                        f" --framerate {framerate} --flush -o -")
+
+        # rpicam-vid writes yuv420 planes without padding for widths that
+        # are a multiple of 64 (checked above), a JPEG is always well below
+        # the raw size
+        self.frame_size = width * height * 3 // 2
+        self.buffers = [bytearray(self.frame_size) for _ in range(ring)]
+        if codec == 'yuv420':
+            self.frames = [np.frombuffer(buf, np.uint8).reshape(height * 3 // 2, width)
+                           for buf in self.buffers]
+        else:
+            self.frames = [np.frombuffer(buf, np.uint8) for buf in self.buffers]
+        self.lengths = [0] * ring
+
+        self.cond = threading.Condition()
+        self.seq = 0  # of the latest frame, 0 before the first
+        self.slot = None  # ring slot of the latest frame
+        self.closed = False
+        self.error = None  # why rpicam-vid couldn't be started, if it couldn't
+        self.stats = {'frames': 0, 'bad_frames': 0, 'restarts': 0}
+        self.started = None
+        self.process = None
+        self.thread = None
+
+    def start(self):
+        self.started = time.time()
+        self.thread = threading.Thread(target=self.reader, name="frame-source", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def latest(self):
+        """(seq, frame) of the newest frame, (0, None) before the first one"""
+        with self.cond:
+            if self.slot is None:
+                return 0, None
+            return self.seq, self.view(self.slot)
+
+    def wait(self, after=None, timeout=None):
+        """
+        (seq, frame) of the first frame newer than seq after
+
+        after defaults to the latest frame, so wait() returns the next
+        frame. Returns (seq, None) on timeout or when the camera stopped.
+        """
+        with self.cond:
+            if after is None:
+                after = self.seq
+            self.cond.wait_for(lambda: self.seq > after or self.closed, timeout)
+            if self.seq <= after:
+                return self.seq, None
+            return self.seq, self.view(self.slot)
+
+    def valid(self, seq):
+        """Whether the frame seq is still in the ring, not yet overwritten"""
+        return self.seq - seq < len(self.buffers) - 1
+
+    def fps(self):
+        if self.started is None:
+            return 0.0
+        return self.stats['frames'] / max(time.time() - self.started, 1e-6)
+
+    def decode(self, frame):
+        """BGR image of an mjpeg frame, needs OpenCV"""
+        import cv2
+        return cv2.imdecode(frame, cv2.IMREAD_COLOR)
+
+    def view(self, slot):
+        if self.codec == 'yuv420':
+            return self.frames[slot]
+        return self.frames[slot][:self.lengths[slot]]
+
+    # the reader thread
+    # =================
+    def publish(self, slot, length):
+        with self.cond:
+            self.lengths[slot] = length
+            self.slot = slot
+            self.seq += 1
+            self.stats['frames'] += 1
+            self.cond.notify_all()
+
+    def reader(self):
+        try:
+            while not self.closed:
+                try:
+                    self.process = subprocess.Popen(shlex.split(self.command),
+                                                    stdout=subprocess.PIPE,
+                                                    stderr=subprocess.DEVNULL, bufsize=0)
+                except OSError as e:
+                    # e.g. rpicam-vid isn't installed, restarting won't help;
+                    # consumers see the source closed and error says why
+                    self.error = e
+                    break
+                try:
+                    if self.codec == 'yuv420':
+                        self.read_yuv420(self.process.stdout)
+                    else:
+                        self.read_mjpeg(self.process.stdout)
+                except (OSError, ValueError):
+                    pass  # the pipe closed under us by stop()
+                self.process.stdout.close()
+                self.process.wait()
+                if self.closed or not self.restart:
+                    break
+                self.stats['restarts'] += 1
+                time.sleep(1)  # e.g. the camera is busy, don't spin
+        finally:
+            # wait() returns and consumers stop, whatever ended the reader
+            with self.cond:
+                self.closed = True
+                self.cond.notify_all()
+
+    def read_yuv420(self, pipe):
+        """Read fixed size frames straight into the ring"""
+        slot = 0
+        while not self.closed:
+            view = memoryview(self.buffers[slot])
+            filled = 0
+            while filled < self.frame_size:
+                n = pipe.readinto(view[filled:])
+                if not n:
+                    return
+                filled += n
+            self.publish(slot, self.frame_size)
+            slot = (slot + 1) % len(self.buffers)
+
+    def read_mjpeg(self, pipe):
+        """
+        Split the stream at the JPEG markers while it comes in
+
+        Each chunk is read into the ring slot of the frame it belongs to.
+        Only the bytes after a frame's end move, to the start of the
+        next slot.
+        """
+        slot = 0
+        buf = self.buffers[slot]
+        view = memoryview(buf)
+        filled = 0
+        searched = 0  # where to look for the end next
+
+        def drop(start):
+            # move buf[start:filled] to the front
+            nonlocal filled, searched
+            view[:filled - start] = view[start:filled]
+            filled -= start
+            searched = 0
+
+        while not self.closed:
+            if filled == len(buf):
+                # no end in sight, not a frame of ours: start over at the next SOI
+                self.stats['bad_frames'] += 1
+                start = buf.find(SOI, 1)
+                drop(start if start > 0 else filled - 1)  # a marker may be cut in two
+            n = pipe.readinto(view[filled:])
+            if not n:
+                return
+            filled += n
+            while True:
+                if not buf.startswith(SOI):
+                    start = buf.find(SOI, 0, filled)
+                    if start < 0:
+                        # keep a 0xff that may start the next SOI
+                        drop(filled - 1 if buf[filled - 1] == 0xff else filled)
+                        break
+                    drop(start)
+                end = buf.find(EOI, max(searched, 2), filled)
+                if end < 0:
+                    searched = max(filled - 1, 2)
+                    break
+                length = end + 2
+                self.publish(slot, length)
+                slot = (slot + 1) % len(self.buffers)
+                rest = filled - length
+                next_view = memoryview(self.buffers[slot])
+                next_view[:rest] = view[length:filled]
+                buf, view = self.buffers[slot], next_view
+                filled, searched = rest, 0
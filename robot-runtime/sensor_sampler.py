@@ -0,0 +1,604 @@
+#!/usr/bin/env python3
+"""
+IMU, time-of-flight and ultrasonic samples at their own rates, on one thread
+
+install_ubuntu.py loads i2c-dev and installs smbus2. Polling every sensor
+register by register from the code that needs it costs one transaction
+per register and blocks the caller. The sampler owns /dev/i2c-1, reads
+each sensor with one burst (the ICM-20948's accelerometer, gyroscope,
+temperature and magnetometer in a single 23-byte read), and keeps the
+samples in ring buffers:
+
+    sampler = Sampler(1, [ICM20948(rate=200), VL53L0X(rate=30), Ultrasonic(rate=10)])
+    with sampler:
+        imu = sampler.rings['imu']
+        sample = imu.latest()           # newest sample, a numpy record
+        seq, samples = imu.since(seq)   # all samples since seq, e.g. to integrate the gyro
+
+Each ring is a numpy structured array allocated at the start. The sampler
+thread is its only writer; readers never lock, they check the sequence
+numbers of the records they copied instead, like frame_bus.py does for
+frames. Samples are timestamped with time.monotonic() when their
+transaction finished.
+
+    python3 sensor_sampler.py --fake --imu=200 --tof=30 --ultrasonic=10
+"""
+import struct
+import threading
+import time
+
+import numpy as np
+
+# Lock-free ring of samples
+# =========================
+class Ring:
+    """
+    The last size samples of a sensor, written by one thread, read by any
+
+    Every record starts with its sequence number (1, 2, ...) and its
+    timestamp. The writer zeroes the sequence number while it writes a
+    record, so a reader that copied a record can tell whether it got a
+    whole one.
+    """
+
+    def __init__(self, fields, size):
+        self.dtype = np.dtype([('seq', '<u8'), ('t', '<f8')] + list(fields))
+        self.data = np.zeros(size, self.dtype)
+        self.seq = 0  # of the newest sample
+
+    def __len__(self):
+        return min(self.seq, len(self.data))
+
+    # writer
+    def next(self):
+        """The record to fill for the next sample, commit() makes it visible"""
+        record = self.data[self.seq % len(self.data)]
+        record['seq'] = 0
+        return record
+
+    def commit(self, record, timestamp):
+        record['t'] = timestamp
+        record['seq'] = self.seq + 1
+        self.seq += 1
+
+    # readers
+    def latest(self):
+        """Copy of the newest sample, None before the first"""
+        while True:
+            seq = self.seq
+            if seq == 0:
+                return None
+            record = self.data[(seq - 1) % len(self.data)].copy()
+            if record['seq'] == seq:
+                return record
+            # overwritten while copying, the writer is a whole ring ahead
+
+    def since(self, after=0):
+        """
+        (seq, samples) of the samples after seq after, oldest first
+
+        At most the last len(ring) - 1 samples, older ones are gone. Pass
+        the returned seq as after next time.
+        """
+        seq = self.seq
+        count = min(seq - after, len(self.data) - 1)
+        if count <= 0:
+            return seq, self.data[:0].copy()
+        start = (seq - count) % len(self.data)
+        if start + count <= len(self.data):
+            samples = self.data[start:start + count].copy()
+        else:
+            samples = np.concatenate([self.data[start:], self.data[:start + count - len(self.data)]])
+        # records the writer got to meanwhile don't have the seq they should
+        expected = np.arange(seq - count + 1, seq + 1, dtype=np.uint64)
+        return seq, samples[samples['seq'] == expected]
+
+    def window(self, seconds):
+        """Samples of the last seconds"""
+        _, samples = self.since(0)
+        return samples[samples['t'] >= time.monotonic() - seconds]
+
+# Sensors
+# =======
+class Sensor:
+    """
+    A sensor the sampler reads at rate Hz
+
+    setup(bus) runs once on the sampler thread, read(bus, record) fills
+    the record and returns False if there was no new sample.
+    """
+    name = 'sensor'
+    fields = []
+
+    def __init__(self, rate):
+        self.rate = rate
+
+    def setup(self, bus):
+        pass
+
+    def read(self, bus, record):
+        raise NotImplementedError
+
+class ICM20948(Sensor):
+    """
+    ICM-20948 9-axis IMU, accelerometer in g, gyroscope in deg/s, magnetometer in uT
+
+    The magnetometer (an AK09916 inside) is read by the chip's own I2C
+    master into EXT_SLV_SENS_DATA, right behind the accelerometer,
+    gyroscope and temperature registers, so one block read gets all of
+    them.
+    """
+    name = 'imu'
+    fields = [('accel', '<f4', (3,)), ('gyro', '<f4', (3,)), ('mag', '<f4', (3,)),
+              ('temp', '<f4')]
+    BANK_SEL = 0x7F
+    DATA = 0x2D  # ACCEL_XOUT_H, 14 bytes to TEMP_OUT_L and 9 of the magnetometer
+    DATA_LENGTH = 23
+    MAG_ADDRESS = 0x0C
+
+    def __init__(self, rate=200, address=0x68):
+        super().__init__(rate)
+        self.address = address
+
+    def bank(self, bus, bank):
+        bus.write_byte_data(self.address, self.BANK_SEL, bank << 4)
+
+    def setup(self, bus):
+        a = self.address
+        self.bank(bus, 0)
+        if bus.read_byte_data(a, 0x00) != 0xEA:
+            raise OSError(f"no ICM-20948 at {a:#x}")
+        bus.write_byte_data(a, 0x06, 0x80)  # PWR_MGMT_1: reset
+        time.sleep(0.01)
+        self.bank(bus, 0)
+        bus.write_byte_data(a, 0x06, 0x01)  # wake up, best clock
+        bus.write_byte_data(a, 0x07, 0x00)  # PWR_MGMT_2: accelerometer and gyroscope on
+        self.bank(bus, 2)
+        bus.write_byte_data(a, 0x00, 0x00)  # GYRO_SMPLRT_DIV: 1.1kHz
+        bus.write_byte_data(a, 0x01, 0x03)  # GYRO_CONFIG_1: +-500dps, low pass on
+        bus.write_byte_data(a, 0x11, 0x00)  # ACCEL_SMPLRT_DIV_2: 1.1kHz
+        bus.write_byte_data(a, 0x14, 0x03)  # ACCEL_CONFIG: +-4g, low pass on
+        # the I2C master reads the magnetometer for us
+        self.bank(bus, 0)
+        bus.write_byte_data(a, 0x03, 0x20)  # USER_CTRL: I2C_MST_EN
+        self.bank(bus, 3)
+        bus.write_byte_data(a, 0x01, 0x07)  # I2C_MST_CTRL: 400kHz
+        bus.write_byte_data(a, 0x03, self.MAG_ADDRESS)  # I2C_SLV0_ADDR, write
+        bus.write_byte_data(a, 0x04, 0x31)  # to CNTL2
+        bus.write_byte_data(a, 0x06, 0x08)  # I2C_SLV0_DO: continuous 100Hz
+        bus.write_byte_data(a, 0x05, 0x81)  # I2C_SLV0_CTRL: one byte
+        time.sleep(0.01)
+        bus.write_byte_data(a, 0x03, 0x80 | self.MAG_ADDRESS)  # read
+        bus.write_byte_data(a, 0x04, 0x10)  # from ST1
+        bus.write_byte_data(a, 0x05, 0x89)  # ST1, the 3 axes, TMPS and ST2
+        self.bank(bus, 0)
+
+    def read(self, bus, record):
+        data = bytes(bus.read_i2c_block_data(self.address, self.DATA, self.DATA_LENGTH))
+        ax, ay, az, gx, gy, gz, temp = struct.unpack_from('>7h', data)
+        mx, my, mz = struct.unpack_from('<3h', data, 15)
+        record['accel'] = (ax / 8192, ay / 8192, az / 8192)
+        record['gyro'] = (gx / 65.5, gy / 65.5, gz / 65.5)
+        record['mag'] = (mx * 0.15, my * 0.15, mz * 0.15)
+        record['temp'] = temp / 333.87 + 21
+        return True
+
+class VL53L0X(Sensor):
+    """
+    VL53L0X time-of-flight distance in mm, in continuous mode
+
+    setup() is the init of ST's API (as Pololu's VL53L0X library does it):
+    the stop variable handshake, the reference SPADs from the chip's NVM,
+    ST's tuning settings, a 33ms timing budget and the VHV and phase
+    calibrations, then back-to-back ranging.
+    """
+    name = 'tof'
+    fields = [('range', '<u2'), ('status', 'u1')]
+    INTERRUPT_STATUS = 0x13  # RESULT_INTERRUPT_STATUS, then RESULT_RANGE_STATUS
+    TIMEOUT = 0.5  # of each wait of setup() for the chip
+    # ST's DefaultTuningSettings, (register, value)
+    TUNING = [
+        (0xFF, 0x01), (0x00, 0x00), (0xFF, 0x00), (0x09, 0x00), (0x10, 0x00), (0x11, 0x00),
+        (0x24, 0x01), (0x25, 0xFF), (0x75, 0x00), (0xFF, 0x01), (0x4E, 0x2C), (0x48, 0x00),
+        (0x30, 0x20), (0xFF, 0x00), (0x30, 0x09), (0x54, 0x00), (0x31, 0x04), (0x32, 0x03),
+        (0x40, 0x83), (0x46, 0x25), (0x60, 0x00), (0x27, 0x00), (0x50, 0x06), (0x51, 0x00),
+        (0x52, 0x96), (0x56, 0x08), (0x57, 0x30), (0x61, 0x00), (0x62, 0x00), (0x64, 0x00),
+        (0x65, 0x00), (0x66, 0xA0), (0xFF, 0x01), (0x22, 0x32), (0x47, 0x14), (0x49, 0xFF),
+        (0x4A, 0x00), (0xFF, 0x00), (0x7A, 0x0A), (0x7B, 0x00), (0x78, 0x21), (0xFF, 0x01),
+        (0x23, 0x34), (0x42, 0x00), (0x44, 0xFF), (0x45, 0x26), (0x46, 0x05), (0x40, 0x40),
+        (0x0E, 0x06), (0x20, 0x1A), (0x43, 0x40), (0xFF, 0x00), (0x34, 0x03), (0x35, 0x44),
+        (0xFF, 0x01), (0x31, 0x04), (0x4B, 0x09), (0x4C, 0x05), (0x4D, 0x04), (0xFF, 0x00),
+        (0x44, 0x00), (0x45, 0x20), (0x47, 0x08), (0x48, 0x28), (0x67, 0x00), (0x70, 0x04),
+        (0x71, 0x01), (0x72, 0xFE), (0x76, 0x00), (0x77, 0x00), (0xFF, 0x01), (0x0D, 0x01),
+        (0xFF, 0x00), (0x80, 0x01), (0x01, 0xF8), (0xFF, 0x01), (0x8E, 0x01), (0x00, 0x01),
+        (0xFF, 0x00), (0x80, 0x00)]
+
+    def __init__(self, rate=30, address=0x29):
+        super().__init__(rate)
+        self.address = address
+        self.stop_variable = 0
+
+    def get(self, bus, register):
+        return bus.read_byte_data(self.address, register)
+
+    def set(self, bus, *pairs):
+        for register, value in pairs:
+            bus.write_byte_data(self.address, register, value)
+
+    def get16(self, bus, register):
+        high, low = bus.read_i2c_block_data(self.address, register, 2)
+        return (high << 8) | low
+
+    def set16(self, bus, register, value):
+        bus.write_i2c_block_data(self.address, register, [value >> 8, value & 0xFF])
+
+    def wait(self, bus, register, ready, what):
+        deadline = time.monotonic() + self.TIMEOUT
+        while not ready(self.get(bus, register)):
+            if time.monotonic() > deadline:
+                raise OSError(f"VL53L0X at {self.address:#x} timed out on {what}")
+            time.sleep(0.001)
+
+    def setup(self, bus):
+        if self.get(bus, 0xC0) != 0xEE:
+            raise OSError(f"no VL53L0X at {self.address:#x}")
+        # data init
+        self.set(bus, (0x89, self.get(bus, 0x89) | 0x01))  # VHV_CONFIG_PAD_SCL_SDA__EXTSUP_HV: 2V8
+        self.set(bus, (0x88, 0x00))  # I2C standard mode
+        self.set(bus, (0x80, 0x01), (0xFF, 0x01), (0x00, 0x00))
+        self.stop_variable = self.get(bus, 0x91)
+        self.set(bus, (0x00, 0x01), (0xFF, 0x00), (0x80, 0x00))
+        # MSRC_CONFIG_CONTROL: no SIGNAL_RATE_MSRC and SIGNAL_RATE_PRE_RANGE limit checks
+        self.set(bus, (0x60, self.get(bus, 0x60) | 0x12))
+        self.set16(bus, 0x44, 32)  # FINAL_RANGE_CONFIG_MIN_COUNT_RATE_RTN_LIMIT: 0.25 MCPS, Q9.7
+        self.set(bus, (0x01, 0xFF))  # SYSTEM_SEQUENCE_CONFIG
+        # static init
+        self.set_reference_spads(bus)
+        self.set(bus, *self.TUNING)
+        self.set(bus, (0x0A, 0x04))  # SYSTEM_INTERRUPT_CONFIG_GPIO: new sample ready
+        self.set(bus, (0x84, self.get(bus, 0x84) & ~0x10))  # GPIO_HV_MUX_ACTIVE_HIGH: active low
+        self.set(bus, (0x0B, 0x01))  # SYSTEM_INTERRUPT_CLEAR
+        budget = self.timing_budget(bus)
+        self.set(bus, (0x01, 0xE8))  # no MSRC and TCC, as ST's API by default
+        self.set_timing_budget(bus, budget)
+        # ref calibration
+        self.set(bus, (0x01, 0x01))
+        self.calibrate(bus, 0x40)  # VHV
+        self.set(bus, (0x01, 0x02))
+        self.calibrate(bus, 0x00)  # phase
+        self.set(bus, (0x01, 0xE8))
+        # continuous, back-to-back
+        self.set(bus, (0x80, 0x01), (0xFF, 0x01), (0x00, 0x00), (0x91, self.stop_variable),
+                 (0x00, 0x01), (0xFF, 0x00), (0x80, 0x00))
+        self.set(bus, (0x00, 0x02))  # SYSRANGE_START
+
+    def set_reference_spads(self, bus):
+        # the count and type of the reference SPADs, from the NVM
+        self.set(bus, (0x80, 0x01), (0xFF, 0x01), (0x00, 0x00), (0xFF, 0x06))
+        self.set(bus, (0x83, self.get(bus, 0x83) | 0x04))
+        self.set(bus, (0xFF, 0x07), (0x81, 0x01), (0x80, 0x01), (0x94, 0x6B), (0x83, 0x00))
+        self.wait(bus, 0x83, lambda value: value != 0x00, "the SPAD info")
+        self.set(bus, (0x83, 0x01))
+        info = self.get(bus, 0x92)
+        count, aperture = info & 0x7F, info >> 7
+        self.set(bus, (0x81, 0x00), (0xFF, 0x06))
+        self.set(bus, (0x83, self.get(bus, 0x83) & ~0x04))
+        self.set(bus, (0xFF, 0x01), (0x00, 0x01), (0xFF, 0x00), (0x80, 0x00))
+        # GLOBAL_CONFIG_SPAD_ENABLES_REF_0..5: keep the first count good SPADs
+        spads = bus.read_i2c_block_data(self.address, 0xB0, 6)
+        self.set(bus, (0xFF, 0x01), (0x4F, 0x00), (0x4E, 0x2C), (0xFF, 0x00), (0xB6, 0xB4))
+        first = 12 if aperture else 0  # 12 is the first aperture SPAD
+        enabled = 0
+        for i in range(48):
+            if i < first or enabled == count:
+                spads[i // 8] &= ~(1 << (i % 8))
+            elif (spads[i // 8] >> (i % 8)) & 0x01:
+                enabled += 1
+        bus.write_i2c_block_data(self.address, 0xB0, spads)
+
+    def calibrate(self, bus, vhv_init):
+        self.set(bus, (0x00, 0x01 | vhv_init))  # SYSRANGE_START
+        self.wait(bus, self.INTERRUPT_STATUS, lambda value: value & 0x07, "calibration")
+        self.set(bus, (0x0B, 0x01), (0x00, 0x00))
+
+    # timing budget, in us, as ST's API computes it
+    @staticmethod
+    def macro_period(vcsel):
+        return (2304 * vcsel * 1655 + 500) // 1000  # ns
+
+    @staticmethod
+    def decode_timeout(value):
+        return ((value & 0xFF) << (value >> 8)) + 1
+
+    @staticmethod
+    def encode_timeout(mclks):
+        low, high = mclks - 1, 0
+        while low & 0xFFFFFF00:
+            low >>= 1
+            high += 1
+        return (high << 8) | (low & 0xFF)
+
+    def steps(self, bus):
+        """Enabled sequence steps and their timeouts"""
+        config = self.get(bus, 0x01)
+        enabled = {'tcc': config >> 4 & 1, 'dss': config >> 3 & 1, 'msrc': config >> 2 & 1,
+                   'pre_range': config >> 6 & 1, 'final_range': config >> 7 & 1}
+        pre_vcsel = (self.get(bus, 0x50) + 1) << 1  # PRE_RANGE_CONFIG_VCSEL_PERIOD
+        final_vcsel = (self.get(bus, 0x70) + 1) << 1  # FINAL_RANGE_CONFIG_VCSEL_PERIOD
+        us = lambda mclks, vcsel: (mclks * self.macro_period(vcsel) + 500) // 1000
+        msrc = self.get(bus, 0x46) + 1  # MSRC_CONFIG_TIMEOUT_MACROP
+        pre_range = self.decode_timeout(self.get16(bus, 0x51))  # PRE_RANGE_CONFIG_TIMEOUT_MACROP_HI
+        final_range = self.decode_timeout(self.get16(bus, 0x71))  # FINAL_RANGE_CONFIG_TIMEOUT_MACROP_HI
+        if enabled['pre_range']:
+            final_range -= pre_range
+        timeouts = {'msrc_us': us(msrc, pre_vcsel), 'pre_range_us': us(pre_range, pre_vcsel),
+                    'pre_range_mclks': pre_range, 'final_range_us': us(final_range, final_vcsel),
+                    'final_vcsel': final_vcsel}
+        return enabled, timeouts
+
+    def overhead(self, enabled, timeouts, start):
+        budget = start + 960
+        if enabled['tcc']:
+            budget += timeouts['msrc_us'] + 590
+        if enabled['dss']:
+            budget += 2 * (timeouts['msrc_us'] + 690)
+        elif enabled['msrc']:
+            budget += timeouts['msrc_us'] + 660
+        if enabled['pre_range']:
+            budget += timeouts['pre_range_us'] + 660
+        return budget
+
+    def timing_budget(self, bus):
+        enabled, timeouts = self.steps(bus)
+        budget = self.overhead(enabled, timeouts, 1910)
+        if enabled['final_range']:
+            budget += timeouts['final_range_us'] + 550
+        return budget
+
+    def set_timing_budget(self, bus, budget):
+        """Gives the final range step what the other steps leave of budget"""
+        enabled, timeouts = self.steps(bus)
+        if not enabled['final_range']:
+            return
+        used = self.overhead(enabled, timeouts, 1320) + 550
+        if used > budget:
+            raise ValueError(f"timing budget {budget}us is below {used}us")
+        period = self.macro_period(timeouts['final_vcsel'])
+        mclks = ((budget - used) * 1000 + period // 2) // period
+        if enabled['pre_range']:
+            mclks += timeouts['pre_range_mclks']
+        self.set16(bus, 0x71, self.encode_timeout(mclks))
+
+    def read(self, bus, record):
+        # the ready flag and the range status block in one read
+        data = bus.read_i2c_block_data(self.address, self.INTERRUPT_STATUS, 13)
+        if data[0] & 0x07 == 0:
+            return False
+        record['status'] = (data[1] & 0x78) >> 3
+        record['range'] = (data[11] << 8) | data[12]
+        bus.write_byte_data(self.address, 0x0B, 0x01)  # SYSTEM_INTERRUPT_CLEAR
+        return True
+
+class Ultrasonic(Sensor):
+    """
+    Ultrasonic distance in cm, on the Robot HAT's D2 (trigger) and D3 (echo)
+
+    It isn't on I2C: gpiozero's DistanceSensor measures in its own thread
+    and the sampler picks up its latest value, so waiting for an echo
+    never delays the other sensors. source replaces it with a function
+    returning the distance, e.g. for tests.
+    """
+    name = 'ultrasonic'
+    fields = [('distance', '<f4')]
+
+    def __init__(self, rate=10, trigger=27, echo=22, source=None):
+        super().__init__(rate)
+        self.trigger, self.echo = trigger, echo
+        self.source = source
+
+    def setup(self, bus):
+        if self.source is None:
+            from gpiozero import DistanceSensor
+            sensor = DistanceSensor(echo=self.echo, trigger=self.trigger, max_distance=4,
+                                    queue_len=1)
+            self.source = lambda: sensor.distance * 100
+
+    def read(self, bus, record):
+        record['distance'] = self.source()
+        return True
+
+# The sampler
+# ===========
+class Sampler:
+    """Reads sensors on one thread, each at its rate, into rings of history seconds"""
+
+    def __init__(self, bus=1, sensors=(), history=10):
+        if isinstance(bus, int):
+            from smbus2 import SMBus
+            bus = SMBus(bus)
+        self.bus = bus
+        self.sensors = []
+        self.rings = {}
+        self.stats = {}
+        self.errors = {}  # sensor name -> its last error
+        self.error = None  # what stopped the thread, if anything
+        self.thread = None
+        self.running = False
+        for sensor in sensors:
+            self.add(sensor, history)
+
+    def add(self, sensor, history=10):
+        size = max(int(sensor.rate * history), 16)
+        self.sensors.append(sensor)
+        self.rings[sensor.name] = Ring(sensor.fields, size)
+        self.stats[sensor.name] = {'samples': 0, 'empty': 0, 'errors': 0, 'late': 0,
+                                   'lateness_max': 0.0, 'lateness_sum': 0.0,
+                                   'read_max': 0.0, 'read_sum': 0.0, 'reads': 0}
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.loop, name="sensor-sampler", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def loop(self):
+        try:
+            self.schedule()
+        except Exception as e:
+            # not a sensor's error, those are counted in sample(); keep it for the caller
+            self.error = e
+            self.running = False
+
+    def schedule(self):
+        for sensor in list(self.sensors):
+            try:
+                sensor.setup(self.bus)
+            except Exception as e:
+                print(f"\033[0;33m{sensor.name} skipped, {e}\033[0m")
+                self.errors[sensor.name] = e
+                self.sensors.remove(sensor)
+        periods = [1 / sensor.rate for sensor in self.sensors]
+        now = time.monotonic()
+        due = [now] * len(self.sensors)
+        while self.running and len(self.sensors) > 0:
+            i = min(range(len(due)), key=due.__getitem__)
+            wait = due[i] - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self.sample(i, due[i])
+            due[i] += periods[i]
+            now = time.monotonic()
+            if due[i] < now:
+                # more than a period behind, e.g. a bus error timeout: don't catch up in a burst
+                self.stats[self.sensors[i].name]['late'] += 1
+                due[i] = now
+
+    def sample(self, i, due):
+        sensor = self.sensors[i]
+        ring = self.rings[sensor.name]
+        stats = self.stats[sensor.name]
+        start = time.monotonic()
+        lateness = start - due
+        stats['lateness_sum'] += lateness
+        stats['lateness_max'] = max(stats['lateness_max'], lateness)
+        record = ring.next()
+        try:
+            fresh = sensor.read(self.bus, record)
+        except Exception as e:
+            # a bus error or a bug in a driver, the other sensors keep going
+            stats['errors'] += 1
+            self.errors[sensor.name] = e
+            fresh = False
+        end = time.monotonic()
+        stats['reads'] += 1
+        stats['read_sum'] += end - start
+        stats['read_max'] = max(stats['read_max'], end - start)
+        if fresh:
+            ring.commit(record, end)
+            stats['samples'] += 1
+        else:
+            stats['empty'] += 1
+
+    def report(self, duration):
+        lines = []
+        for sensor in self.sensors:
+            stats = self.stats[sensor.name]
+            reads = max(stats['reads'], 1)
+            lines.append(f"  {sensor.name:<11} {stats['samples'] / duration:7.1f}/s of {sensor.rate:g},"
+                         f" read {stats['read_sum'] / reads * 1000:5.2f}ms"
+                         f" (max {stats['read_max'] * 1000:.2f}),"
+                         f" late {stats['lateness_sum'] / reads * 1000:5.2f}ms"
+                         f" (max {stats['lateness_max'] * 1000:.2f}),"
+                         f" {stats['empty']} empty, {stats['errors']} errors")
+            if sensor.name in self.errors:
+                lines.append(f"              last error: {self.errors[sensor.name]!r}")
+        if self.error is not None:
+            lines.append(f"  stopped by {self.error!r}")
+        return '\n'.join(lines)
+
+# command line
+# ============
+avaiable_options = ["-h", "--help", "--imu", "--tof", "--ultrasonic", "--bus", "--fake",
+                    "--duration"]
+
+usage = '''
+Usage:
+    python3 sensor_sampler.py [option]
+
+Options:
+               --imu=HZ    Read the ICM-20948 at HZ (default 200, 0 leaves it out)
+               --tof=HZ    Read the VL53L0X at HZ (default 30, 0 leaves it out)
+               --ultrasonic=HZ
+                           Read the ultrasonic sensor at HZ (default 10, 0 leaves it out)
+               --bus=N     I2C bus (default 1, /dev/i2c-1)
+               --fake      Simulated sensors on a fake bus (fake_i2c.py), no robot needed
+               --duration=SECONDS
+                           Stop after SECONDS (default 10) and print the rates
+    -h         --help      Show this help text and exit
+'''
+
+def get_option(options, name, default=None):
+    for opt in options:
+        if opt.startswith(name + "="):
+            return opt.split("=", 1)[1]
+    return default
+
+if __name__ == "__main__":
+    import math
+    import sys
+    options = sys.argv[1:]
+    for opt in options:
+        if opt.split('=')[0] not in avaiable_options:
+            print("Option {} is not found.".format(opt))
+            print(usage)
+            sys.exit(0)
+    if "-h" in options or "--help" in options:
+        print(usage)
+        sys.exit(0)
+    rates = {'imu': float(get_option(options, "--imu", 200)),
+             'tof': float(get_option(options, "--tof", 30)),
+             'ultrasonic': float(get_option(options, "--ultrasonic", 10))}
+    source = None
+    if "--fake" in options:
+        from fake_i2c import FakeSMBus, FakeICM20948, FakeVL53L0X
+        bus = FakeSMBus([FakeICM20948(), FakeVL53L0X()], byte_time=9 / 400e3)
+        source = lambda: 50 + 20 * math.sin(time.monotonic())
+    else:
+        bus = int(get_option(options, "--bus", 1))
+    sensors = []
+    if rates['imu'] > 0:
+        sensors.append(ICM20948(rates['imu']))
+    if rates['tof'] > 0:
+        sensors.append(VL53L0X(rates['tof']))
+    if rates['ultrasonic'] > 0:
+        sensors.append(Ultrasonic(rates['ultrasonic'], source=source))
+    sampler = Sampler(bus, sensors)
+    duration = float(get_option(options, "--duration", 10))
+    start = time.monotonic()
+    try:
+        with sampler:
+            while time.monotonic() - start < duration:
+                time.sleep(1)
+                for name, ring in sampler.rings.items():
+                    sample = ring.latest()
+                    if sample is not None:
+                        values = ', '.join(f"{field}={np.round(np.asarray(sample[field], float), 2)}"
+                                           for field in sample.dtype.names[2:])
+                        print(f"  {name}: {values}")
+    except KeyboardInterrupt:
+        pass
+    print(f"\nSampled for {time.monotonic() - start:.1f}s:")
+    print(sampler.report(time.monotonic() - start))
+    if "--fake" in options:
+        print(f"  bus: {bus.stats['transactions']} transactions, {bus.stats['bytes']} bytes")
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+All 12 servos of a PiCrawler pose per control tick, in as few I2C writes as possible
+
+The servos hang off the Robot HAT's PWM controller at I2C address 0x14.
+robot_hat writes one register per servo, 12 transactions per pose, one
+after the other, so the legs move at slightly different times and the
+bus limits the control rate. ServoWriter takes the whole pose:
+
+    writer = ServoWriter(SMBus(1))
+    for pose in gait:                       # 12 angles in degrees, -90 .. 90
+        writer.write(pose)
+
+Joints whose PWM value didn't change since the last write are left out.
+The angles get picrawler's calibration offsets (the servo offsets
+robot_hat keeps in /opt/picrawler/picrawler.config), so a pose is the
+same as with Picrawler.do_action().
+
+With block=True the changed channels that are next to each other go out
+in one block write. That is off by default: robot_hat only ever writes
+one 16-bit register per transaction, and whether the HAT's firmware
+steps to the next channel register within a longer write isn't
+documented. Check a pose with block writes on the robot before turning
+it on. FixedRate runs the control loop on fixed deadlines and reports
+jitter and overruns:
+
+    loop = FixedRate(100)
+    loop.run(lambda tick: writer.write(gait(tick)), duration=10)
+    print(loop.report())
+
+    python3 servo_writer.py --fake --compare      # transactions per tick, no robot needed
+"""
+import collections
+import time
+
+import numpy as np
+
+ADDRESS = 0x14
+REG_CHANNEL = 0x20  # pulse width of channel n at REG_CHANNEL + n
+REG_PRESCALER = 0x40  # of timer n (channels 4n .. 4n + 3)
+REG_PERIOD = 0x44
+CLOCK = 72000000
+PERIOD = 4095
+FREQUENCY = 50  # Hz, a 20ms servo frame
+
+# joint order of picrawler's Picrawler class (leg by leg, coxa, femur,
+# tibia) to the HAT channel of the servo
+PICRAWLER_CHANNELS = [9, 10, 11, 3, 4, 5, 0, 1, 2, 6, 7, 8]
+
+# where picrawler's calibration keeps the servo offsets (robot_hat's
+# fileDB, "key = value" lines), in degrees per joint
+PICRAWLER_CONFIG = "/opt/picrawler/picrawler.config"
+OFFSET_KEY = "picrawler_servo_offset_list"
+
+def load_offsets(file=PICRAWLER_CONFIG, joints=12):
+    """The calibration offsets of the joints from file, zeros if there is none"""
+    try:
+        with open(file) as f:
+            lines = f.readlines()
+    except OSError:
+        return np.zeros(joints)
+    for line in lines:
+        key, _, value = line.partition('=')
+        if key.strip() == OFFSET_KEY:
+            values = [float(v) for v in value.strip().strip('[]').split(',') if v.strip()]
+            if len(values) != joints:
+                raise ValueError(f"{file}: {OFFSET_KEY} has {len(values)} values, not {joints}")
+            return np.array(values)
+    return np.zeros(joints)
+
+class ServoWriter:
+    """
+    Writes whole poses to the HAT, only what changed, coalesced with block=True
+
+    offsets are added to the angles of every pose, by default the
+    calibration from PICRAWLER_CONFIG (zeros without one).
+    """
+
+    def __init__(self, bus, channels=PICRAWLER_CHANNELS, block=False, address=ADDRESS,
+                 min_pulse=500, max_pulse=2500, setup=True, offsets=None):
+        self.bus = bus
+        self.address = address
+        self.channels = np.asarray(channels)
+        self.block = block
+        if offsets is None:
+            offsets = load_offsets(joints=len(channels))
+        self.offsets = np.asarray(offsets, np.float64)
+        self.min_pulse, self.max_pulse = min_pulse, max_pulse
+        # the channels ordered, and where each joint goes in that order
+        self.order = np.argsort(self.channels)
+        self.sorted_channels = self.channels[self.order]
+        self.values = np.full(len(channels), -1)  # last written, by joint
+        self.stats = {'ticks': 0, 'transactions': 0, 'values': 0, 'unchanged': 0}
+        if setup:
+            self.setup()
+
+    def setup(self):
+        """50Hz on the timers of the channels, as robot_hat.Servo sets it up"""
+        prescaler = round(CLOCK / FREQUENCY / PERIOD)
+        for timer in sorted(set(int(channel) // 4 for channel in self.channels)):
+            self.write_register(REG_PERIOD + timer, [PERIOD])
+            self.write_register(REG_PRESCALER + timer, [prescaler - 1])
+
+    def pwm_values(self, angles):
+        """PWM register values of angles (with the offsets), like robot_hat.Servo.angle()"""
+        angles = np.clip(np.asarray(angles, np.float64) + self.offsets, -90, 90)
+        # robot_hat maps -90 to the longest pulse
+        pulse = self.max_pulse + (angles + 90) / 180 * (self.min_pulse - self.max_pulse)
+        return (pulse / (1e6 / FREQUENCY) * PERIOD).astype(np.int64)
+
+    def write(self, angles):
+        """Write the pose angles (one per joint, degrees), returns the number of transactions"""
+        values = self.pwm_values(angles)
+        changed = values != self.values
+        self.stats['ticks'] += 1
+        self.stats['unchanged'] += int(len(values) - changed.sum())
+        if not changed.any():
+            return 0
+        sorted_values = values[self.order]
+        sorted_changed = changed[self.order]
+        transactions = 0
+        i = 0
+        n = len(sorted_values)
+        while i < n:
+            if not sorted_changed[i]:
+                i += 1
+                continue
+            j = i + 1
+            if self.block:
+                # the run of changed channels with consecutive numbers
+                while (j < n and sorted_changed[j]
+                       and self.sorted_channels[j] == self.sorted_channels[j - 1] + 1):
+                    j += 1
+            self.write_register(REG_CHANNEL + int(self.sorted_channels[i]), sorted_values[i:j])
+            transactions += 1
+            i = j
+        self.values = values
+        self.stats['transactions'] += transactions
+        self.stats['values'] += int(changed.sum())
+        return transactions
+
+    def write_register(self, register, values):
+        """16-bit values, high byte first, starting at register"""
+        data = []
+        for value in values:
+            data += [(int(value) >> 8) & 0xff, int(value) & 0xff]
+        if len(data) == 2:
+            # what robot_hat sends: register, high byte, low byte
+            self.bus.write_word_data(self.address, register, data[0] | (data[1] << 8))
+        else:
+            self.bus.write_i2c_block_data(self.address, register, data)
+
+    def resend(self):
+        """Write every joint again on the next write(), e.g. after the HAT was reset"""
+        self.values = np.full(len(self.channels), -1)
+
+class FixedRate:
+    """
+    Calls a function every 1/rate seconds, on deadlines that don't drift
+
+    A tick that starts late counts as jitter, a tick whose function runs
+    past the next deadline is an overrun and the deadlines it missed are
+    skipped rather than caught up on.
+    """
+
+    def __init__(self, rate, window=1000):
+        self.period = 1 / rate
+        self.jitter = collections.deque(maxlen=window)  # seconds late, per tick
+        self.work = collections.deque(maxlen=window)  # seconds in the function
+        self.stats = {'ticks': 0, 'overruns': 0, 'missed': 0}
+        self.running = False
+
+    def run(self, function, duration=None):
+        """function(tick) every period until stop() or duration seconds"""
+        self.running = True
+        start = time.monotonic()
+        deadline = start
+        tick = 0
+        while self.running and (duration is None or deadline - start < duration):
+            now = time.monotonic()
+            if deadline > now:
+                time.sleep(deadline - now)
+                now = time.monotonic()
+            self.jitter.append(now - deadline)
+            function(tick)
+            end = time.monotonic()
+            self.work.append(end - now)
+            self.stats['ticks'] += 1
+            tick += 1
+            deadline += self.period
+            if end > deadline:
+                self.stats['overruns'] += 1
+                missed = int((end - deadline) // self.period)
+                self.stats['missed'] += missed
+                deadline += missed * self.period
+                tick += missed
+
+    def stop(self):
+        self.running = False
+
+    def report(self):
+        if len(self.jitter) == 0:
+            return "  no ticks"
+        jitter = np.array(self.jitter) * 1000
+        work = np.array(self.work) * 1000
+        return (f"  {self.stats['ticks']} ticks at {1 / self.period:g}Hz,"
+                f" jitter avg {jitter.mean():.3f}ms p99 {np.percentile(jitter, 99):.3f}ms"
+                f" max {jitter.max():.3f}ms, work avg {work.mean():.3f}ms max {work.max():.3f}ms,"
+                f" {self.stats['overruns']} overruns, {self.stats['missed']} ticks missed")
+
+# command line
+# ============
+def gait(tick, rate):
+    """Synthetic walk: coxa and femur swing, tibia only moves in the lift half of the step"""
+    t = tick / rate
+    pose = []
+    for leg in range(4):
+        phase = 2 * np.pi * (t + leg / 4)  # one step a second, the legs a quarter apart
+        pose += [30 * np.sin(phase), 20 * np.cos(phase), 45 + 30 * max(np.sin(phase), 0)]
+    return pose
+
+avaiable_options = ["-h", "--help", "--rate", "--duration", "--block", "--fake", "--bus",
+                    "--bus-speed", "--compare"]
+
+usage = '''
+Usage:
+    python3 servo_writer.py [option]
+
+Options:
+               --rate=HZ   Control rate (default 100)
+               --duration=SECONDS
+                           Walk in place for SECONDS (default 5)
+               --block     Write neighbouring channels in one block write
+               --fake      A fake HAT on a fake bus (fake_i2c.py), no robot needed
+               --bus=N     I2C bus (default 1, /dev/i2c-1)
+               --bus-speed=HZ
+                           Clock of the fake bus (default 100000, the Pi's default)
+               --compare   With --fake: every joint every tick one by one, as
+                           robot_hat does, then unchanged joints left out,
+                           then also block writes
+    -h         --help      Show this help text and exit
+'''
+
+def get_option(options, name, default=None):
+    for opt in options:
+        if opt.startswith(name + "="):
+            return opt.split("=", 1)[1]
+    return default
+
+def walk(bus, rate, duration, block, always=False):
+    writer = ServoWriter(bus, block=block)
+    loop = FixedRate(rate)
+    def tick(n):
+        if always:
+            writer.resend()
+        writer.write(gait(n, rate))
+    loop.run(tick, duration)
+    return writer, loop
+
+if __name__ == "__main__":
+    import sys
+    options = sys.argv[1:]
+    for opt in options:
+        if opt.split('=')[0] not in avaiable_options:
+            print("Option {} is not found.".format(opt))
+            print(usage)
+            sys.exit(0)
+    if "-h" in options or "--help" in options:
+        print(usage)
+        sys.exit(0)
+    rate = float(get_option(options, "--rate", 100))
+    duration = float(get_option(options, "--duration", 5))
+    runs = [("coalesced" + (", block writes" if "--block" in options else ""),
+             "--block" in options, False)]
+    if "--fake" in options and "--compare" in options:
+        runs = [("every joint, one by one", False, True), ("changed joints only", False, False),
+                ("changed joints, block writes", True, False)]
+    for name, block, always in runs:
+        if "--fake" in options:
+            from fake_i2c import FakeSMBus, FakeRobotHat
+            byte_time = 9 / float(get_option(options, "--bus-speed", 100000))
+            bus = FakeSMBus([FakeRobotHat()], byte_time=byte_time)
+        else:
+            from smbus2 import SMBus
+            bus = SMBus(int(get_option(options, "--bus", 1)))
+        try:
+            writer, loop = walk(bus, rate, duration, block, always)
+        except KeyboardInterrupt:
+            break
+        ticks = max(writer.stats['ticks'], 1)
+        print(f"{name}:")
+        print(f"  {writer.stats['transactions'] / ticks:.2f} transactions and"
+              f" {writer.stats['values'] / ticks:.2f} servo values per tick,"
+              f" {writer.stats['unchanged'] / ticks:.2f} unchanged left out")
+        if "--fake" in options:
+            print(f"  bus: {bus.stats['transactions']} transactions, {bus.stats['bytes']} bytes")
+        print(loop.report())
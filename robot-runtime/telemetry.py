@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+"""
+Binary telemetry of the robot, appended to memory-mapped segment files
+
+Printing every IMU sample and servo command to a log file formats text
+and writes through to the drive from the control loop. The recorder
+copies fixed-size records into preallocated files mapped into memory
+instead; a background thread writes them out:
+
+    recorder = Recorder('/mnt/nvme/telemetry')
+    imu = recorder.stream('imu')                # one of SCHEMAS, or give a dtype
+    imu.append(sampler.rings['imu'].latest())   # a numpy record of the stream's dtype
+    record = imu.next()                         # or fill the record in place
+    record['t'] = time.monotonic()
+    ...
+    imu.commit()
+    recorder.close()
+
+Each stream is written to its own segments, <stream>-<n>.tlm, of
+segment_size bytes: a header, the record dtype and the records. A full
+segment is closed and the next one, prepared by the flush thread ahead
+of time, takes over; with max_segments the oldest closed ones are
+removed. The
+header's record count goes up after each record, so a segment is
+readable while it is written and after a crash. For offline analysis
+read_stream() loads a stream into one numpy structured array:
+
+    imu = read_stream('/mnt/nvme/telemetry', 'imu')
+    plt.plot(imu['t'], imu['gyro'][:, 2])
+
+    python3 telemetry.py --bench                      # synthetic load, no robot needed
+    python3 telemetry.py --trace=trace.json           # an installer --trace as a stream
+    python3 telemetry.py --show=DIR                   # the streams in DIR
+"""
+import json
+import mmap
+import os
+import threading
+import time
+
+import numpy as np
+
+MAGIC = 0x4D4C5450  # "PTLM"
+VERSION = 1
+PAGE = mmap.PAGESIZE
+MAX_SPARES = 64  # segments made ahead per stream, at most
+
+HEADER = np.dtype([('magic', '<u4'), ('version', '<u4'), ('record_size', '<u4'),
+                   ('descr_length', '<u4'), ('data', '<u8'), ('capacity', '<u8'),
+                   ('count', '<u8'), ('created', '<f8'), ('closed', '<u4'), ('pad', '<u4')])
+
+# Record types of the robot. imu is what sensor_sampler.ICM20948 puts
+# into its ring, so ring records are appended as they are.
+SCHEMAS = {
+    'imu': [('seq', '<u8'), ('t', '<f8'), ('accel', '<f4', (3,)), ('gyro', '<f4', (3,)),
+            ('mag', '<f4', (3,)), ('temp', '<f4')],
+    'servo': [('t', '<f8'), ('tick', '<u8'), ('angles', '<f4', (12,)), ('transactions', 'u1'),
+              ('unchanged', 'u1')],
+    'frame': [('t', '<f8'), ('seq', '<u8'), ('captured', '<f8'), ('detector', 'S16'),
+              ('latency', '<f4')],
+    'step': [('start', '<f8'), ('wall', '<f4'), ('cpu', '<f4'), ('status', '<i4'),
+             ('max_rss_kb', '<u4'), ('written', '<u8'), ('net', '<u8'), ('step', 'S32'),
+             ('msg', 'S96')],
+}
+
+# Segments
+# ========
+class Segment:
+    """One preallocated file of records of dtype, mapped for writing"""
+
+    def __init__(self, path, dtype, size):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        descr = json.dumps(np.lib.format.dtype_to_descr(self.dtype)).encode()
+        data = -(-(HEADER.itemsize + len(descr)) // PAGE) * PAGE
+        capacity = max((size - data) // self.dtype.itemsize, 1)
+        size = data + capacity * self.dtype.itemsize
+        fd = os.open(path + '.tmp', os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            try:
+                os.posix_fallocate(fd, 0, size)  # the blocks now, not while recording
+            except (AttributeError, OSError):
+                os.ftruncate(fd, size)
+            self.buf = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.header = np.ndarray((), HEADER, self.buf, 0)
+        self.header['record_size'] = self.dtype.itemsize
+        self.header['descr_length'] = len(descr)
+        self.header['data'] = data
+        self.header['capacity'] = capacity
+        self.header['created'] = time.time()
+        self.buf[HEADER.itemsize:HEADER.itemsize + len(descr)] = descr
+        self.header['version'] = VERSION
+        self.header['magic'] = MAGIC
+        self.records = np.ndarray((capacity,), self.dtype, self.buf, data)
+        self.capacity = capacity
+        self.count = 0
+        self.flushed = 0  # bytes of the file written out
+        self.ready = False  # renamed to path, see open()
+
+    def open(self):
+        """Give the segment its name, once it is used"""
+        os.replace(self.path + '.tmp', self.path)
+        self.ready = True
+
+    def end(self):
+        return int(self.header['data']) + self.count * self.dtype.itemsize
+
+    def flush(self):
+        """Write the records added since the last flush (and the header) to the file"""
+        end = self.end()
+        start = self.flushed // PAGE * PAGE
+        if end > start:
+            self.buf.flush(start, end - start)
+        self.buf.flush(0, PAGE)  # the record count
+        self.flushed = end
+
+    def close(self):
+        """Flush and cut the file to the records in it"""
+        self.header['closed'] = 1
+        self.flush()
+        end = self.end()
+        self.header = self.records = None
+        try:
+            self.buf.close()
+        except BufferError:
+            # a record from next() is still around; the map goes with it,
+            # and the file keeps its size (readers go by the count)
+            self.buf = None
+            return
+        if self.ready:
+            os.truncate(self.path, end)
+        else:
+            os.remove(self.path + '.tmp')  # a spare that was never used
+
+class Stream:
+    """Records of one type, appended by one thread"""
+
+    def __init__(self, recorder, name, dtype):
+        self.recorder = recorder
+        self.name = name
+        self.dtype = np.dtype(dtype)
+        self.number = recorder.last_number(name)
+        self.segment = None
+        self.spares = []  # the next segments, kept topped up by the flush thread
+        self.target = recorder.spares  # spares to keep, more if rotations wait
+        self.closed = []  # full segments, for the flush thread to close
+        self.done = segments(recorder.directory, name)  # closed segments, oldest first
+        self.lock = threading.Lock()  # around making the next segments
+        self.stats = {'records': 0, 'segments': 0, 'rotation_waits': 0, 'errors': 0}
+        self.error = None  # the last error of the flush thread
+        self.rotate()
+        self.add_spares()
+
+    def new_segment(self):
+        self.number += 1
+        path = os.path.join(self.recorder.directory, f"{self.name}-{self.number:06d}.tlm")
+        return Segment(path, self.dtype, self.recorder.segment_size)
+
+    def add_spares(self):
+        with self.lock:
+            while len(self.spares) < self.target:
+                self.spares.append(self.new_segment())
+
+    def rotate(self):
+        old = self.segment
+        with self.lock:
+            if len(self.spares) > 0:
+                spare = self.spares.pop(0)
+            else:
+                if old is not None:
+                    # the segments fill faster than the flush thread makes them
+                    self.stats['rotation_waits'] += 1
+                    self.target = min(self.target * 2, MAX_SPARES)
+                spare = self.new_segment()
+        spare.open()
+        self.segment = spare
+        self.stats['segments'] += 1
+        if old is not None:
+            self.closed.append(old)
+        self.recorder.wake()  # to close old and make the next spare
+
+    def next(self):
+        """The record to fill in for the next append, commit() adds it"""
+        if self.segment.count == self.segment.capacity:
+            self.rotate()
+        return self.segment.records[self.segment.count]
+
+    def commit(self):
+        segment = self.segment
+        segment.count += 1
+        segment.header['count'] = segment.count  # after the record, readers see whole ones
+        self.stats['records'] += 1
+
+    def append(self, record):
+        """Add record, a numpy record of the stream's dtype or a tuple of its fields"""
+        self.next()
+        self.segment.records[self.segment.count] = record
+        self.commit()
+
+class Recorder:
+    """
+    The streams recorded to directory, with a thread flushing them every flush_interval
+
+    max_segments keeps at most that many segments per stream, removing
+    the oldest. spares segments per stream are made ahead of time, so a
+    rotation doesn't wait for a new file; a stream whose rotations wait
+    anyway gets up to MAX_SPARES. Errors of the flush thread are
+    counted in stream.stats['errors'], the last one is in stream.error.
+    """
+
+    def __init__(self, directory, segment_size=64 << 20, flush_interval=1.0, max_segments=None,
+                 spares=2):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.flush_interval = flush_interval
+        self.max_segments = max_segments
+        self.spares = spares
+        os.makedirs(directory, exist_ok=True)
+        self.streams = {}
+        self.cond = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self.flusher, name="telemetry-flush", daemon=True)
+        self.thread.start()
+
+    def stream(self, name, dtype=None):
+        """The stream name, dtype defaults to SCHEMAS[name]"""
+        if name not in self.streams:
+            self.streams[name] = Stream(self, name, SCHEMAS[name] if dtype is None else dtype)
+        return self.streams[name]
+
+    def last_number(self, name):
+        files = segments(self.directory, name)
+        return int(files[-1][-10:-4]) if len(files) > 0 else 0
+
+    def wake(self):
+        with self.cond:
+            self.cond.notify()
+
+    def flusher(self):
+        while True:
+            with self.cond:
+                if self.running:
+                    self.cond.wait(self.flush_interval)
+                running = self.running
+            for stream in list(self.streams.values()):
+                self.service(stream)
+            if not running:
+                return
+
+    def service(self, stream):
+        """Flush the stream, close its full segments and prepare the next ones"""
+        while len(stream.closed) > 0:
+            segment = stream.closed.pop(0)
+            if self.attempt(stream, segment.close):
+                stream.done.append(segment.path)
+        self.attempt(stream, lambda: self.remove_old(stream))
+        segment = stream.segment
+        if segment is not None:
+            self.attempt(stream, segment.flush)
+        self.attempt(stream, stream.add_spares)
+
+    def attempt(self, stream, action):
+        """action(), an error is counted for stream instead of ending the flush thread"""
+        try:
+            action()
+            return True
+        except Exception as e:
+            stream.stats['errors'] += 1
+            stream.error = e
+            return False
+
+    def remove_old(self, stream):
+        """Remove the oldest closed segments beyond max_segments (with the current one)"""
+        if self.max_segments is None:
+            return
+        while len(stream.done) > 0 and len(stream.done) + 1 > self.max_segments:
+            try:
+                os.remove(stream.done[0])
+            except FileNotFoundError:
+                pass
+            stream.done.pop(0)
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.thread.join()
+        for stream in self.streams.values():
+            for segment in stream.closed + [stream.segment] + stream.spares:
+                if segment is not None:
+                    self.attempt(stream, segment.close)
+            stream.closed, stream.segment, stream.spares = [], None, []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Reading
+# =======
+def read_segment(path, copy=True):
+    """The records of the segment path as a numpy structured array, a read-only map with copy=False"""
+    with open(path, 'rb') as f:
+        header = np.frombuffer(f.read(HEADER.itemsize), HEADER)[0]
+        if header['magic'] != MAGIC or header['version'] != VERSION:
+            raise ValueError(f"{path} is not a telemetry segment of version {VERSION}")
+        descr = json.loads(f.read(int(header['descr_length'])))
+    dtype = np.lib.format.descr_to_dtype(descr if isinstance(descr, str)
+                                         else [tuple(field) for field in descr])
+    count = int(header['count'])
+    if count == 0:
+        return np.zeros(0, dtype)
+    if copy:
+        return np.fromfile(path, dtype, count, offset=int(header['data']))
+    return np.memmap(path, dtype, 'r', int(header['data']), (count,))
+
+def segments(directory, name):
+    """Paths of the segments of the stream name, oldest first"""
+    return sorted(os.path.join(directory, file) for file in os.listdir(directory)
+                  if file.startswith(name + '-') and file.endswith('.tlm')
+                  and file[len(name) + 1:-4].isdigit())
+
+def read_stream(directory, name):
+    """All records of the stream name in directory, oldest first"""
+    paths = segments(directory, name)
+    if len(paths) == 0:
+        raise FileNotFoundError(f"no {name} segments in {directory}")
+    parts = [read_segment(path) for path in paths]
+    for path, part in zip(paths, parts):
+        if part.dtype != parts[0].dtype:
+            raise ValueError(f"{path} has other fields than {paths[0]}, read the segments"
+                             " one by one with read_segment()")
+    return np.concatenate(parts)
+
+def record_trace(recorder, file):
+    """Add the steps of an installer --trace file to the step stream, start is seconds into the install"""
+    with open(file) as f:
+        steps = json.load(f)['steps']
+    stream = recorder.stream('step')
+    for step in steps:
+        record = stream.next()
+        record['start'] = step['start']
+        record['wall'] = step['wall']
+        record['cpu'] = step.get('cpu', 0)
+        record['status'] = step['status']
+        record['max_rss_kb'] = step.get('max_rss_kb', 0)
+        record['written'] = step.get('written', 0)
+        record['net'] = step.get('net_rx', 0) + step.get('net_tx', 0)
+        record['step'] = step.get('step', '').encode()[:32]
+        record['msg'] = step['msg'].encode()[:96]
+        stream.commit()
+    return len(steps)
+
+# command line
+# ============
+avaiable_options = ["-h", "--help", "--dir", "--bench", "--records", "--segment-size",
+                    "--trace", "--show"]
+
+usage = '''
+Usage:
+    python3 telemetry.py --bench [option]
+    python3 telemetry.py --trace=FILE [option]
+    python3 telemetry.py --show=DIR
+
+Options:
+               --dir=DIR   Directory of the segments (default ./telemetry)
+               --bench     Record synthetic IMU, servo and frame records as fast as
+                           possible and compare with print-logging them to a file
+               --records=N Records per stream for --bench (default 200000)
+               --segment-size=MB
+                           Size of the segments (default 64)
+               --trace=FILE
+                           Record the steps of an installer --trace file
+               --show=DIR  List the streams in DIR with their records
+    -h         --help      Show this help text and exit
+'''
+
+def get_option(options, name, default=None):
+    for opt in options:
+        if opt.startswith(name + "="):
+            return opt.split("=", 1)[1]
+    return default
+
+def bench(directory, count, segment_size):
+    """Append count synthetic records per stream, returns append times in seconds"""
+    times = {}
+    with Recorder(directory, segment_size) as recorder:
+        imu, servo, frame = recorder.stream('imu'), recorder.stream('servo'), recorder.stream('frame')
+        sample = np.zeros((), imu.dtype)
+        sample['accel'] = (0.01, -0.02, 1.0)
+        angles = np.zeros(12, np.float32)
+        for name, add in [
+                ('imu', lambda i: imu.append(sample)),
+                ('servo', lambda i: servo.append((time.monotonic(), i, angles, 3, 9))),
+                ('frame', lambda i: frame.append((time.monotonic(), i, time.monotonic(),
+                                                  b'qr', 0.012)))]:
+            took = np.empty(count)
+            for i in range(count):
+                start = time.perf_counter()
+                add(i)
+                took[i] = time.perf_counter() - start
+            times[name] = took
+        streams = dict((name, dict(stream.stats)) for name, stream in recorder.streams.items())
+    # the same IMU samples as text lines
+    took = np.empty(count)
+    with open(os.path.join(directory, 'print-log.txt'), 'w', buffering=1) as f:
+        for i in range(count):
+            start = time.perf_counter()
+            print(f"imu {i} {time.monotonic():.6f} accel {sample['accel']} gyro {sample['gyro']}"
+                  f" mag {sample['mag']} temp {sample['temp']}", file=f, flush=True)
+            took[i] = time.perf_counter() - start
+    times['print (imu)'] = took
+    os.remove(os.path.join(directory, 'print-log.txt'))
+    return times, streams
+
+if __name__ == "__main__":
+    import sys
+    options = sys.argv[1:]
+    for opt in options:
+        if opt.split('=')[0] not in avaiable_options:
+            print("Option {} is not found.".format(opt))
+            print(usage)
+            sys.exit(0)
+    if "-h" in options or "--help" in options or len(options) == 0:
+        print(usage)
+        sys.exit(0)
+    directory = get_option(options, "--dir", "telemetry")
+    segment_size = int(float(get_option(options, "--segment-size", 64)) * (1 << 20))
+    if "--bench" in options:
+        count = int(get_option(options, "--records", 200000))
+        times, streams = bench(directory, count, segment_size)
+        print(f"{count} records per stream into {directory}:")
+        for name, took in times.items():
+            took = took * 1e6
+            print(f"  {name:<12} p50 {np.percentile(took, 50):6.2f}us  p99 {np.percentile(took, 99):7.2f}us"
+                  f"  max {took.max():9.1f}us")
+        for name, stats in streams.items():
+            print(f"  {name}: {stats['segments']} segments,"
+                  f" {stats['rotation_waits']} rotations waited for a new segment")
+        start = time.perf_counter()
+        imu = read_stream(directory, 'imu')
+        print(f"  read_stream imu: {len(imu)} records in {(time.perf_counter() - start) * 1000:.1f}ms")
+    elif get_option(options, "--trace") is not None:
+        with Recorder(directory, segment_size) as recorder:
+            count = record_trace(recorder, get_option(options, "--trace"))
+        print(f"{count} steps recorded to {directory}")
+    elif get_option(options, "--show") is not None:
+        directory = get_option(options, "--show")
+        names = sorted(set(file.rsplit('-', 1)[0] for file in os.listdir(directory)
+                           if file.endswith('.tlm')))
+        for name in names:
+            records = read_stream(directory, name)
+            print(f"  {name}: {len(records)} records in {len(segments(directory, name))} segments,"
+                  f" fields {', '.join(records.dtype.names)}")
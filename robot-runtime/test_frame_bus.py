@@ -0,0 +1,93 @@
+"""
+Tests of frame_bus.py, producer and consumer in one process
+
+    python3 -m pytest robot-runtime/test_frame_bus.py
+"""
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+from frame_bus import FrameBus, bus_path
+
+class FrameBusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.name = f"picrawler-test-{os.getpid()}-{self._testMethodName}"
+        self.producer = FrameBus.create(self.name, (8, 4), slots=4)
+        self.consumer = FrameBus.attach(self.name)
+
+    def tearDown(self):
+        if self.producer.header is not None:
+            self.producer.close()
+
+    def frame(self, value):
+        return np.full((8, 4), value, np.uint8)
+
+    def test_publish_and_wait(self):
+        self.assertEqual(self.consumer.latest(), (0, None))
+        self.assertEqual(self.consumer.wait(timeout=0.01)[1], None)
+        self.producer.publish(self.frame(1))
+        seq, frame = self.consumer.wait(timeout=1)
+        self.assertEqual(seq, 1)
+        np.testing.assert_array_equal(frame, self.frame(1))
+        self.assertTrue(self.consumer.valid(seq))
+
+    def test_newest_frame_and_skipped(self):
+        self.consumer.wait(after=0, timeout=0.01)
+        for value in range(1, 4):
+            self.producer.publish(self.frame(value))
+        seq, frame = self.consumer.wait(after=1, timeout=1)
+        self.assertEqual(seq, 3)
+        self.assertEqual(frame[0, 0], 3)
+        self.assertEqual(self.consumer.stats['skipped'], 1)
+
+    def test_overwritten(self):
+        self.producer.publish(self.frame(1))
+        seq, frame = self.consumer.wait(timeout=1)
+        for value in range(2, 6):  # the 4 slots come round to frame 1's
+            self.producer.publish(self.frame(value))
+        self.assertFalse(self.consumer.valid(seq))
+        self.assertEqual(self.consumer.stats['overwritten'], 1)
+
+    def test_read_copies(self):
+        self.producer.publish(self.frame(7))
+        out = np.zeros((8, 4), np.uint8)
+        self.assertEqual(self.consumer.read(out, timeout=1), 1)
+        self.producer.publish(self.frame(8))
+        self.assertEqual(out[0, 0], 7)
+
+    def test_variable_length(self):
+        producer = FrameBus.create(self.name + '-jpeg', (100,))
+        try:
+            consumer = FrameBus.attach(self.name + '-jpeg')
+            producer.publish(np.arange(10, dtype=np.uint8))
+            seq, frame = consumer.wait(timeout=1)
+            self.assertEqual(len(frame), 10)
+            with self.assertRaises(ValueError):
+                producer.publish(np.zeros(101, np.uint8))
+        finally:
+            producer.close()
+
+    def test_producer_closed(self):
+        self.producer.publish(self.frame(1))
+        self.consumer.wait(timeout=1)
+        self.producer.close()
+        self.assertFalse(os.path.exists(bus_path(self.name)))
+        self.assertTrue(self.consumer.closed)
+        self.assertEqual(self.consumer.wait(), (1, None))  # doesn't wait for more
+
+    def test_use_after_close(self):
+        self.consumer.close()
+        self.assertTrue(self.consumer.closed)
+        for call in [self.consumer.latest, self.consumer.wait, lambda: self.consumer.valid(1)]:
+            with self.assertRaisesRegex(ValueError, "closed"):
+                call()
+        self.producer.close()
+        with self.assertRaisesRegex(ValueError, "closed"):
+            self.producer.publish(self.frame(1))
+
+if __name__ == "__main__":
+    unittest.main()
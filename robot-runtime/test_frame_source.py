@@ -0,0 +1,89 @@
+"""
+Tests of frame_source.py with fake_camera.py replaying recorded streams
+
+    python3 -m pytest robot-runtime/test_frame_source.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+here = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, here)
+from frame_source import EOI, SOI, FrameSource
+
+def jpeg(n):
+    """Not a real JPEG, just its markers around data with 0xff 0x00 stuffing"""
+    return SOI + bytes([n]) * (100 + 50 * n) + b'\xff\x00' + bytes([n]) * 7 + EOI
+
+class FrameSourceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="frame-source-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def replay(self, data, frames, **kwargs):
+        """Every frame the source hands out for a recorded stream of data"""
+        stream = os.path.join(self.directory, 'stream')
+        with open(stream, 'wb') as f:
+            f.write(data)
+        command = (f"{sys.executable} {os.path.join(here, 'fake_camera.py')}"
+                   f" --input={stream} --frames={frames}")
+        seen = []
+        with FrameSource(framerate=50, command=command, restart=False, ring=8,
+                         **kwargs) as camera:
+            seq = 0
+            while True:
+                seq, frame = camera.wait(seq, timeout=10)
+                if frame is None:
+                    break
+                seen.append((seq, frame.copy()))
+        self.assertTrue(camera.closed)
+        self.assertIsNone(camera.error)
+        return camera, seen
+
+    def test_yuv420(self):
+        width, height = 64, 4
+        size = width * height * 3 // 2
+        data = b''.join(bytes([n]) * size for n in range(3))
+        camera, seen = self.replay(data, 5, width=width, height=height, codec='yuv420')
+        self.assertEqual(camera.stats['frames'], 5)
+        self.assertEqual([seq for seq, _ in seen], [1, 2, 3, 4, 5])
+        for seq, frame in seen:
+            self.assertEqual(frame.shape, (height * 3 // 2, width))
+            self.assertTrue((frame == (seq - 1) % 3).all())
+
+    def test_yuv420_width(self):
+        with self.assertRaisesRegex(ValueError, "multiple of 64"):
+            FrameSource(100, 100, codec='yuv420')
+        FrameSource(100, 100, codec='mjpeg')  # no rows to pad
+
+    def test_mjpeg(self):
+        frames = [jpeg(n) for n in range(4)]
+        # garbage before the first frame and between two is skipped
+        data = b'\x00\xff' + frames[0] + frames[1] + b'junk' + frames[2] + frames[3]
+        camera, seen = self.replay(data, 4, width=64, height=48, codec='mjpeg')
+        self.assertEqual(len(seen), 4)
+        for (seq, frame), expected in zip(seen, frames):
+            self.assertEqual(frame.tobytes(), expected)
+
+    def test_mjpeg_frame_too_big(self):
+        data = jpeg(1) + SOI + bytes(10000) + EOI + jpeg(2)
+        camera, seen = self.replay(data, 3, width=64, height=48, codec='mjpeg')
+        self.assertEqual([frame.tobytes() for _, frame in seen], [jpeg(1), jpeg(2)])
+        self.assertGreater(camera.stats['bad_frames'], 0)
+
+    def test_missing_binary(self):
+        with FrameSource(command="/nonexistent/rpicam-vid") as camera:
+            self.assertEqual(camera.wait(timeout=10), (0, None))
+        self.assertTrue(camera.closed)
+        self.assertIsInstance(camera.error, FileNotFoundError)
+        self.assertEqual(camera.stats['restarts'], 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+"""
+Tests of sensor_sampler.py on the fake sensors of fake_i2c.py
+
+    python3 -m pytest robot-runtime/test_sensor_sampler.py
+"""
+import os
+import sys
+import time
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+from fake_i2c import FakeDevice, FakeICM20948, FakeSMBus, FakeVL53L0X
+from sensor_sampler import ICM20948, Ring, Sampler, Sensor, Ultrasonic, VL53L0X
+
+class Broken(Sensor):
+    """Raises error on every read but the first"""
+    name = 'broken'
+    fields = [('value', '<f4')]
+
+    def __init__(self, error, rate=100):
+        super().__init__(rate)
+        self.error = error
+        self.reads = 0
+
+    def read(self, bus, record):
+        self.reads += 1
+        if self.reads > 1:
+            raise self.error
+        record['value'] = 1
+        return True
+
+class RingTest(unittest.TestCase):
+
+    def test_since_and_wrap(self):
+        ring = Ring([('value', '<f4')], 4)
+        for value in range(6):
+            record = ring.next()
+            record['value'] = value
+            ring.commit(record, value)
+        self.assertEqual(len(ring), 4)
+        self.assertEqual(ring.latest()['value'], 5)
+        seq, samples = ring.since(3)
+        self.assertEqual(seq, 6)
+        self.assertEqual(samples['value'].tolist(), [3, 4, 5])
+
+class SamplerTest(unittest.TestCase):
+
+    def test_imu(self):
+        bus = FakeSMBus([FakeICM20948()])
+        with Sampler(bus, [ICM20948(rate=200)]) as sampler:
+            time.sleep(0.1)
+        stats = sampler.stats['imu']
+        self.assertGreater(stats['samples'], 10)
+        self.assertEqual(stats['errors'], 0)
+        sample = sampler.rings['imu'].latest()
+        self.assertAlmostEqual(float(sample['accel'][2]), 1.0, places=2)
+        self.assertAlmostEqual(float(sample['temp']), 25.0, places=1)
+        self.assertAlmostEqual(float(sample['mag'][0]), 20.0, places=0)
+
+    def test_one_transaction_per_sample(self):
+        bus = FakeSMBus([FakeICM20948()])
+        sampler = Sampler(bus, [ICM20948()])
+        sampler.sensors[0].setup(bus)
+        bus.stats['transactions'] = 0
+        for _ in range(5):
+            sampler.sample(0, time.monotonic())
+        self.assertEqual(bus.stats['transactions'], 5)
+
+    def test_tof(self):
+        fake = FakeVL53L0X(period=0.01)
+        bus = FakeSMBus([fake])
+        with Sampler(bus, [VL53L0X(rate=100)]) as sampler:
+            time.sleep(0.1)
+        self.assertEqual(sampler.stats['tof']['errors'], 0)
+        self.assertGreater(sampler.stats['tof']['samples'], 3)
+        self.assertGreater(sampler.stats['tof']['empty'], 0)  # sampled faster than it ranges
+        sample = sampler.rings['tof'].latest()
+        self.assertTrue(200 <= sample['range'] <= 600)
+        self.assertEqual(sample['status'], 11)
+        # back-to-back ranging, with the stop variable given back before the start
+        self.assertEqual(fake.registers[0x00], 0x02)
+        self.assertEqual(fake.registers[0x91], 0x3C)
+        self.assertEqual(fake.registers[0x01], 0xE8)
+
+    def test_tof_setup_times_out(self):
+        fake = FakeVL53L0X()
+        fake.write = lambda register, data: FakeDevice.write(fake, register, data)  # never ready
+        sensor = VL53L0X()
+        sensor.TIMEOUT = 0.01
+        with self.assertRaisesRegex(OSError, "timed out"):
+            sensor.setup(FakeSMBus([fake]))
+
+    def test_errors_are_counted(self):
+        bus = FakeSMBus([FakeICM20948()])
+        sensors = [ICM20948(rate=200), Broken(ValueError("bad value")),
+                   Broken(OSError(121, "Remote I/O error"))]
+        sensors[2].name = 'broken-bus'
+        with Sampler(bus, sensors) as sampler:
+            time.sleep(0.1)
+        self.assertTrue(sampler.thread is not None and not sampler.thread.is_alive())
+        self.assertIsNone(sampler.error)
+        self.assertGreater(sampler.stats['imu']['samples'], 10)
+        self.assertEqual(sampler.stats['imu']['errors'], 0)
+        for name, error in [('broken', ValueError), ('broken-bus', OSError)]:
+            self.assertEqual(sampler.stats[name]['samples'], 1)
+            self.assertGreater(sampler.stats[name]['errors'], 3)
+            self.assertIsInstance(sampler.errors[name], error)
+        self.assertIn("bad value", sampler.report(0.1))
+
+    def test_missing_sensor_skipped(self):
+        bus = FakeSMBus([FakeICM20948()])
+        with Sampler(bus, [ICM20948(), VL53L0X()]) as sampler:
+            time.sleep(0.02)
+        self.assertEqual([sensor.name for sensor in sampler.sensors], ['imu'])
+        self.assertIsInstance(sampler.errors['tof'], OSError)
+
+    def test_ultrasonic_source(self):
+        with Sampler(FakeSMBus(), [Ultrasonic(rate=100, source=lambda: 42.0)]) as sampler:
+            time.sleep(0.05)
+        self.assertEqual(sampler.rings['ultrasonic'].latest()['distance'], np.float32(42.0))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+"""
+Tests of servo_writer.py on the fake HAT of fake_i2c.py
+
+    python3 -m pytest robot-runtime/test_servo_writer.py
+"""
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+from fake_i2c import FakeRobotHat, FakeSMBus
+from servo_writer import (FixedRate, PICRAWLER_CHANNELS, REG_CHANNEL, REG_PERIOD, ServoWriter,
+                          load_offsets)
+
+ZERO = np.zeros(12)
+
+class ServoWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.hat = FakeRobotHat()
+        self.bus = FakeSMBus([self.hat])
+
+    def writer(self, **kwargs):
+        kwargs.setdefault('offsets', ZERO)
+        writer = ServoWriter(self.bus, **kwargs)
+        self.bus.stats['transactions'] = 0
+        return writer
+
+    def channel(self, joint):
+        return self.hat.values[REG_CHANNEL + PICRAWLER_CHANNELS[joint]]
+
+    def test_setup(self):
+        self.writer()
+        for timer in range(3):  # channels 0 to 11
+            self.assertEqual(self.hat.values[REG_PERIOD + timer], 4095)
+
+    def test_only_changed_joints(self):
+        writer = self.writer()
+        self.assertEqual(writer.write(ZERO), 12)
+        self.assertEqual(writer.write(ZERO), 0)
+        pose = ZERO.copy()
+        pose[4] = 30
+        self.assertEqual(writer.write(pose), 1)
+        self.assertEqual(self.bus.stats['transactions'], 13)
+        self.assertEqual(self.channel(4), writer.pwm_values(pose)[4])
+        self.assertEqual(writer.stats['unchanged'], 12 + 11)
+
+    def test_values_like_robot_hat(self):
+        writer = self.writer()
+        # 1500us at 0, -90 the longest pulse, of a 20ms period of 4095 steps
+        pose = np.zeros(12)
+        pose[1:3] = -90, 90
+        np.testing.assert_array_equal(writer.pwm_values(pose)[:3], [307, 511, 102])
+        writer.write(ZERO)
+        self.assertEqual(self.channel(0), 307)
+
+    def test_block_writes(self):
+        writer = self.writer(block=True)
+        self.assertEqual(writer.write(ZERO), 1)  # channels 0 to 11 in one go
+        pose = ZERO.copy()
+        pose[[6, 7, 0]] = 20  # channels 0 and 1 next to each other, 9 on its own
+        self.assertEqual(writer.write(pose), 2)
+        for joint in range(12):
+            self.assertEqual(self.channel(joint), writer.pwm_values(pose)[joint])
+
+    def test_resend(self):
+        writer = self.writer()
+        writer.write(ZERO)
+        writer.resend()
+        self.assertEqual(writer.write(ZERO), 12)
+
+    def test_offsets(self):
+        offsets = np.arange(12) - 6.0
+        writer = self.writer(offsets=offsets)
+        writer.write(ZERO)
+        for joint in range(12):
+            self.assertEqual(self.channel(joint), self.writer().pwm_values(offsets)[joint])
+
+    def test_load_offsets(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.config', delete=False) as f:
+            f.write("# robot-hat config and calibration value of robots\n\n")
+            f.write("picrawler_servo_offset_list = [1.0, -2.0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 3.5]\n")
+        try:
+            offsets = load_offsets(f.name)
+        finally:
+            os.remove(f.name)
+        self.assertEqual(offsets.tolist(), [1, -2] + [0] * 9 + [3.5])
+        np.testing.assert_array_equal(load_offsets('/nonexistent/picrawler.config'), ZERO)
+
+class FixedRateTest(unittest.TestCase):
+
+    def test_ticks_and_overruns(self):
+        loop = FixedRate(200)
+        ticks = []
+        loop.run(ticks.append, duration=0.1)
+        self.assertGreaterEqual(len(ticks), 15)
+        self.assertEqual(ticks[:3], [0, 1, 2])
+        slow = FixedRate(1000)
+        slow.run(lambda tick: time.sleep(0.0035), duration=0.05)
+        self.assertGreater(slow.stats['overruns'], 0)
+        self.assertGreater(slow.stats['missed'], 0)
+
+if __name__ == "__main__":
+    unittest.main()
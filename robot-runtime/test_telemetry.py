@@ -0,0 +1,118 @@
+"""
+Tests of telemetry.py on a temporary directory
+
+    python3 -m pytest robot-runtime/test_telemetry.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+from telemetry import PAGE, Recorder, SCHEMAS, read_segment, read_stream, segments
+
+SEGMENT = PAGE + 4096  # a page of header, the rest for records
+PER_SEGMENT = 4096 // np.dtype(SCHEMAS['servo']).itemsize
+
+def servo(tick):
+    return (tick * 0.01, tick, np.full(12, tick % 90, np.float32), 1, 11)
+
+class RecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="telemetry-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_rotation_and_read_back(self):
+        with Recorder(self.directory, segment_size=SEGMENT, flush_interval=0.01) as recorder:
+            stream = recorder.stream('servo')
+            for tick in range(1000):
+                stream.append(servo(tick))
+        self.assertEqual(stream.stats['errors'], 0)
+        self.assertEqual(len(segments(self.directory, 'servo')), -(-1000 // PER_SEGMENT))
+        records = read_stream(self.directory, 'servo')
+        self.assertEqual(records.dtype, np.dtype(SCHEMAS['servo']))
+        np.testing.assert_array_equal(records['tick'], np.arange(1000))
+        self.assertEqual(records['angles'][999, 0], 999 % 90)
+        # no spare is left behind, and closed segments are cut to their records
+        self.assertEqual([file for file in os.listdir(self.directory) if file.endswith('.tmp')], [])
+        last = 1000 % PER_SEGMENT or PER_SEGMENT
+        self.assertEqual(os.path.getsize(segments(self.directory, 'servo')[-1]),
+                         PAGE + last * np.dtype(SCHEMAS['servo']).itemsize)
+
+    def test_readable_while_written(self):
+        recorder = Recorder(self.directory, segment_size=SEGMENT)
+        try:
+            stream = recorder.stream('servo')
+            for tick in range(10):
+                stream.append(servo(tick))
+            live = read_segment(stream.segment.path)
+            np.testing.assert_array_equal(live['tick'], np.arange(10))
+        finally:
+            recorder.close()
+
+    def test_record_filled_in_place(self):
+        with Recorder(self.directory) as recorder:
+            stream = recorder.stream('frame')
+            record = stream.next()
+            record['seq'] = 7
+            record['detector'] = b'qr'
+            stream.commit()
+        records = read_stream(self.directory, 'frame')
+        self.assertEqual((records['seq'][0], records['detector'][0]), (7, b'qr'))
+
+    def test_max_segments(self):
+        with Recorder(self.directory, segment_size=SEGMENT, max_segments=3,
+                      flush_interval=0.01) as recorder:
+            stream = recorder.stream('servo')
+            for tick in range(2000):
+                stream.append(servo(tick))
+                if tick % PER_SEGMENT == 0:
+                    time.sleep(0.002)  # let the flush thread remove segments meanwhile
+        self.assertEqual(stream.stats['errors'], 0, stream.error)
+        self.assertLessEqual(len(segments(self.directory, 'servo')), 4)
+        records = read_stream(self.directory, 'servo')
+        self.assertEqual(records['tick'][-1], 1999)
+        np.testing.assert_array_equal(np.diff(records['tick']), 1)
+
+    def test_record_held_at_close(self):
+        recorder = Recorder(self.directory, segment_size=SEGMENT)
+        stream = recorder.stream('servo')
+        held = stream.next()
+        held['tick'] = 5
+        stream.commit()
+        recorder.close()
+        self.assertEqual(stream.stats['errors'], 0)
+        self.assertEqual(read_stream(self.directory, 'servo')['tick'].tolist(), [5])
+
+    def test_flush_thread_survives_errors(self):
+        with Recorder(self.directory, segment_size=SEGMENT, flush_interval=0.01) as recorder:
+            stream = recorder.stream('servo')
+            add_spares = stream.add_spares
+            def failing():
+                stream.add_spares = add_spares
+                raise OSError(28, "No space left on device")
+            stream.add_spares = failing
+            time.sleep(0.05)
+            self.assertEqual(stream.stats['errors'], 1)
+            self.assertTrue(recorder.thread.is_alive())
+            for tick in range(300):
+                stream.append(servo(tick))
+        self.assertEqual(len(read_stream(self.directory, 'servo')), 300)
+
+    def test_read_stream_refuses_other_fields(self):
+        with Recorder(self.directory) as recorder:
+            recorder.stream('servo').append(servo(1))
+        with Recorder(self.directory) as recorder:
+            recorder.stream('servo', SCHEMAS['frame']).append((1.0, 1, 1.0, b'qr', 0.01))
+        with self.assertRaises(ValueError):
+            read_stream(self.directory, 'servo')
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+Run several detectors on one camera stream, sharing the preprocessing
+
+pyzbar, mediapipe and tflite-runtime are installed by install_ubuntu_v2.py
+(where is_mediapipe_supported()/is_tensorflow_supported() allow it).
+Each wants the frame in another size and color space; converting per
+detector costs more than some of the detectors. The scheduler converts
+each frame once, with numpy on the YUV420 planes, into what the due
+detectors need, and runs them on a pool of worker threads:
+
+    scheduler = Scheduler([QRDetector(rate=10), PoseDetector(rate=5),
+                           TFLiteDetector('model.tflite', rate=15)])
+    scheduler.run(FrameSource(640, 480).start())      # or a FrameBus
+    print(scheduler.report())
+
+Every detector runs at most at its rate, and one frame at a time (neither
+a mediapipe graph nor a tflite interpreter can run twice at once). A
+frame that comes while the detector is busy waits in its queue, which
+holds as many frames as the detector takes in one batch and drops the
+oldest; a tflite model with a free batch dimension gets all of them in
+one invocation. numpy, OpenCV, pyzbar and tflite release the GIL, so
+four workers keep the four cores of the Pi 5 busy.
+
+    python3 vision_scheduler.py --fake --detect=qr:10,pose:5   # headless, no camera
+"""
+import collections
+import sys
+import threading
+import time
+
+import numpy as np
+
+# Frames and their preprocessing
+# ==============================
+class Frame:
+    """
+    One camera frame and the inputs made from it, each made only once
+
+    image is a YUV420 frame of shape (height * 3 // 2, width) as rpicam-vid
+    writes it, a BGR image, or an encoded JPEG (1-D), see FrameSource.
+    """
+
+    def __init__(self, seq, image, timestamp):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.inputs = {}
+        if image.ndim == 1:
+            import cv2
+            image = cv2.imdecode(image, cv2.IMREAD_COLOR)
+        self.image = image
+        self.yuv420 = image.ndim == 2
+        if self.yuv420:
+            self.height = image.shape[0] * 2 // 3
+            self.width = image.shape[1]
+        else:
+            self.height, self.width = image.shape[:2]
+
+    def planes(self, step):
+        """Y, U and V at half the size divided by step, as views"""
+        h, w = self.height, self.width
+        chroma = self.image[h:].reshape(-1)
+        u = chroma[:h * w // 4].reshape(h // 2, w // 2)
+        v = chroma[h * w // 4:].reshape(h // 2, w // 2)
+        return self.image[:h:2 * step, ::2 * step], u[::step, ::step], v[::step, ::step]
+
+    def get(self, spec):
+        """The input spec, e.g. ('gray', 640), ('rgb', 320) or ('tensor', (192, 192), 'float32')"""
+        if spec not in self.inputs:
+            self.inputs[spec] = self.make(spec)
+        return self.inputs[spec]
+
+    def make(self, spec):
+        kind = spec[0]
+        if kind == 'gray':
+            step = max(self.width // spec[1], 1)
+            if self.yuv420:
+                gray = self.image[:self.height:step, ::step]  # the Y plane is gray already
+            else:
+                gray = self.image[::step, ::step] @ np.array([0.114, 0.587, 0.299], np.float32)
+            return np.array(gray, np.uint8)  # a copy even at step 1, the slot gets overwritten
+        if kind == 'rgb':
+            step = max(self.width // spec[1], 1)
+            if not self.yuv420:
+                return np.array(self.image[::step, ::step, ::-1])
+            # BT.601 limited range (rpicam-vid's colour space up to 720p) on
+            # the planes at chroma resolution, no upsampling
+            y, u, v = self.planes(max(step // 2, 1))
+            y = (y.astype(np.float32) - 16) * 1.164
+            u = u.astype(np.float32) - 128
+            v = v.astype(np.float32) - 128
+            rgb = np.empty(y.shape + (3,), np.float32)
+            rgb[..., 0] = y + 1.596 * v
+            rgb[..., 1] = y - 0.392 * u - 0.813 * v
+            rgb[..., 2] = y + 2.017 * u
+            return np.clip(rgb, 0, 255, out=rgb).astype(np.uint8)
+        if kind == 'tensor':
+            (height, width), dtype = spec[1], np.dtype(spec[2])
+            rgb = self.get(('rgb', max(width, 1)))
+            rows, cols = resize_index(rgb.shape[:2], (height, width))
+            tensor = rgb[rows[:, None], cols[None, :]]
+            if dtype.kind == 'f':
+                return tensor.astype(dtype) * np.asarray(1 / 255, dtype)
+            return tensor.astype(dtype)
+        raise ValueError(f"unknown input {spec}")
+
+resize_indexes = {}
+
+def resize_index(src, dst):
+    """Rows and columns of src picked for a nearest-neighbour resize to dst"""
+    key = (src, dst)
+    if key not in resize_indexes:
+        resize_indexes[key] = ((np.arange(dst[0]) * src[0] // dst[0]),
+                               (np.arange(dst[1]) * src[1] // dst[1]))
+    return resize_indexes[key]
+
+# Detectors
+# =========
+class Detector:
+    """
+    Base of the detectors: inputs lists what run() needs from a Frame
+
+    run() gets the inputs of up to batch frames, one tuple per frame, and
+    returns one result per frame. load() imports and sets up the library
+    and raises ImportError if it is missing.
+    """
+    name = 'detector'
+    inputs = ()
+    batch = 1
+
+    def __init__(self, rate=10):
+        self.rate = rate
+
+    def load(self):
+        pass
+
+    def run(self, batch):
+        raise NotImplementedError
+
+class QRDetector(Detector):
+    """QR codes and barcodes with pyzbar, on the gray image"""
+    name = 'qr'
+
+    def __init__(self, rate=10, width=640):
+        super().__init__(rate)
+        self.inputs = (('gray', width),)
+
+    def load(self):
+        from pyzbar import pyzbar
+        self.decode = pyzbar.decode
+
+    def run(self, batch):
+        return [[(code.type, code.data.decode('utf-8', 'replace'), tuple(code.rect))
+                 for code in self.decode(gray)] for gray, in batch]
+
+class PoseDetector(Detector):
+    """Body pose with mediapipe, on the RGB image"""
+    name = 'pose'
+
+    def __init__(self, rate=5, width=320):
+        super().__init__(rate)
+        self.inputs = (('rgb', width),)
+
+    def load(self):
+        import mediapipe
+        self.pose = mediapipe.solutions.pose.Pose(model_complexity=0)
+
+    def run(self, batch):
+        results = []
+        for rgb, in batch:
+            landmarks = self.pose.process(rgb).pose_landmarks
+            results.append(None if landmarks is None else
+                           np.array([(p.x, p.y, p.visibility) for p in landmarks.landmark],
+                                    np.float32))
+        return results
+
+class TFLiteDetector(Detector):
+    """
+    A tflite model, batched when its batch dimension can be resized
+
+    The result of each frame is the list of its output tensors.
+    """
+
+    def __init__(self, model, rate=15, batch=4, threads=1, name=None):
+        super().__init__(rate)
+        self.model = model
+        self.name = name or f"tflite:{model.rsplit('/', 1)[-1]}"
+        self.max_batch = batch
+        self.threads = threads
+
+    def load(self):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow  # the full tensorflow, e.g. on x86
+            Interpreter = tensorflow.lite.Interpreter
+        self.interpreter = Interpreter(model_path=self.model, num_threads=self.threads)
+        detail = self.interpreter.get_input_details()[0]
+        _, height, width, _ = detail['shape']
+        self.input_index = detail['index']
+        self.dtype = detail['dtype']
+        self.inputs = (('tensor', (int(height), int(width)), np.dtype(self.dtype).name),)
+        self.batch = 1
+        if self.max_batch > 1:
+            try:
+                self.interpreter.resize_tensor_input(self.input_index,
+                                                     [self.max_batch, height, width, 3])
+                self.interpreter.allocate_tensors()
+                self.batch = self.max_batch
+            except (RuntimeError, ValueError):
+                # fixed batch of 1 in the model
+                self.interpreter.resize_tensor_input(self.input_index, [1, height, width, 3])
+        self.interpreter.allocate_tensors()
+        self.input = np.zeros([self.batch, height, width, 3], self.dtype)
+
+    def run(self, batch):
+        for i, (tensor,) in enumerate(batch):
+            self.input[i] = tensor
+        self.interpreter.set_tensor(self.input_index, self.input)
+        self.interpreter.invoke()
+        outputs = [self.interpreter.get_tensor(detail['index'])
+                   for detail in self.interpreter.get_output_details()]
+        return [[output[i] for output in outputs] for i in range(len(batch))]
+
+# Scheduling and statistics
+# =========================
+class Timings:
+    """The last window durations of a stage, in seconds"""
+
+    def __init__(self, window=200):
+        self.values = collections.deque(maxlen=window)
+        self.count = 0
+
+    def add(self, seconds):
+        self.values.append(seconds)
+        self.count += 1
+
+    def summary(self):
+        if len(self.values) == 0:
+            return "-"
+        values = np.array(self.values) * 1000
+        return "%6.1fms avg %6.1fms p95" % (values.mean(), np.percentile(values, 95))
+
+class Scheduler:
+    """Feeds the frames of a source to the detectors, see the module docstring"""
+
+    def __init__(self, detectors, workers=4, on_result=None):
+        from concurrent.futures import ThreadPoolExecutor
+        self.detectors = []
+        for detector in detectors:
+            try:
+                detector.load()
+                self.detectors.append(detector)
+            except ImportError as e:
+                print(f"\033[0;33m{detector.name} skipped, {e}\033[0m")
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="vision")
+        self.on_result = on_result
+        self.lock = threading.Lock()
+        self.queues = {d.name: collections.deque(maxlen=d.batch) for d in self.detectors}
+        self.busy = set()
+        self.due = {d.name: 0.0 for d in self.detectors}
+        self.results = {}  # detector -> (seq, result) of its latest frame
+        self.timings = collections.defaultdict(Timings)
+        self.counts = collections.Counter()
+        self.started = None
+
+    def submit(self, seq, image, timestamp=None):
+        """Preprocess a frame for the detectors that are due and queue it for them"""
+        now = time.time()
+        if timestamp is None:
+            timestamp = now
+        self.counts['frames'] += 1
+        due = [d for d in self.detectors if now >= self.due[d.name]]
+        if len(due) == 0:
+            return
+        frame = Frame(seq, image, timestamp)
+        for detector in due:
+            for spec in detector.inputs:
+                frame.get(spec)  # the source may reuse image, the inputs are copies
+        self.timings['preprocess'].add(time.time() - now)
+        with self.lock:
+            for detector in due:
+                self.due[detector.name] = max(self.due[detector.name] + 1 / detector.rate, now)
+                queue = self.queues[detector.name]
+                if len(queue) == queue.maxlen:
+                    self.counts[f"{detector.name} dropped"] += 1
+                queue.append((frame, time.time()))
+                if detector.name not in self.busy:
+                    self.busy.add(detector.name)
+                    self.pool.submit(self.work, detector)
+
+    def work(self, detector):
+        """Run detector on what is in its queue until the queue is empty"""
+        while True:
+            with self.lock:
+                queue = self.queues[detector.name]
+                if len(queue) == 0:
+                    self.busy.discard(detector.name)
+                    return
+                batch = list(queue)
+                queue.clear()
+            start = time.time()
+            for _, queued in batch:
+                self.timings[f"{detector.name} wait"].add(start - queued)
+            try:
+                results = detector.run([tuple(frame.get(spec) for spec in detector.inputs)
+                                        for frame, _ in batch])
+            except Exception as e:
+                self.counts[f"{detector.name} errors"] += 1
+                print(f"\033[0;31m{detector.name}: {e}\033[0m")
+                continue
+            end = time.time()
+            self.timings[f"{detector.name} run"].add(end - start)
+            for (frame, _), result in zip(batch, results):
+                self.timings[f"{detector.name} latency"].add(end - frame.timestamp)
+                self.results[detector.name] = (frame.seq, result)
+                if self.on_result is not None:
+                    self.on_result(detector.name, frame.seq, result)
+
+    def run(self, source, duration=None):
+        """Feed the frames of source (a FrameSource or FrameBus) until it stops or for duration seconds"""
+        self.started = time.time()
+        seq = 0
+        try:
+            while duration is None or time.time() - self.started < duration:
+                seq, image = source.wait(seq, timeout=1)
+                if image is None:
+                    if getattr(source, 'closed', False):
+                        break
+                    continue
+                self.submit(seq, image)
+        finally:
+            self.pool.shutdown(wait=True)
+
+    def report(self):
+        """Frame rates and the latency of every stage, as text"""
+        elapsed = max(time.time() - (self.started or time.time()), 1e-6)
+        lines = [f"{self.counts['frames'] / elapsed:.1f} frames/s in,"
+                 f" preprocess {self.timings['preprocess'].summary()}"]
+        for detector in self.detectors:
+            runs = self.timings[f"{detector.name} latency"].count
+            lines.append(f"  {detector.name:<12} {runs / elapsed:5.1f}/s (target {detector.rate}),"
+                         f" batch {detector.batch}, dropped {self.counts[detector.name + ' dropped']}")
+            for stage in ('wait', 'run', 'latency'):
+                lines.append(f"      {stage:<8} {self.timings[f'{detector.name} {stage}'].summary()}")
+        return '\n'.join(lines)
+
+# command line
+# ============
+avaiable_options = ["-h", "--help", "--detect", "--source", "--fake", "--input", "--width",
+                    "--height", "--workers", "--duration"]
+
+usage = '''
+Usage:
+    python3 vision_scheduler.py [option]
+
+Options:
+               --detect=LIST
+                           Detectors and their rate, e.g. qr:10,pose:5,model.tflite:15
+                           (default qr:10)
+               --source=NAME
+                           camera (default, rpicam-vid) or bus:NAME for a frame bus
+               --fake      Synthetic frames of fake_camera.py instead of the camera
+               --input=FILE
+                           Frames of a recorded .mjpeg stream instead of the camera
+               --width=N --height=N
+                           Camera size (default 640x480)
+               --workers=N Worker threads (default 4, the cores of a Pi 5)
+               --duration=SECONDS
+                           Stop after SECONDS (default 10) and print the report
+    -h         --help      Show this help text and exit
+'''
+
+def get_option(options, name, default=None):
+    for opt in options:
+        if opt.startswith(name + "="):
+            return opt.split("=", 1)[1]
+    return default
+
+def make_detectors(spec):
+    detectors = []
+    for item in spec.split(','):
+        name, _, rate = item.rpartition(':')
+        if name == '':
+            name, rate = rate, 10
+        rate = float(rate)
+        if name == 'qr':
+            detectors.append(QRDetector(rate))
+        elif name == 'pose':
+            detectors.append(PoseDetector(rate))
+        elif name.endswith('.tflite'):
+            detectors.append(TFLiteDetector(name, rate))
+        else:
+            raise ValueError(f"unknown detector {name}")
+    return detectors
+
+def open_source(options):
+    import os
+    source = get_option(options, "--source", "camera")
+    if source.startswith("bus:"):
+        from frame_bus import FrameBus
+        return FrameBus.attach(source[4:], timeout=10)
+    from frame_source import FrameSource
+    command = None
+    fake = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_camera.py')
+    if get_option(options, "--input") is not None:
+        command = f"{sys.executable} {fake} --input={get_option(options, '--input')}"
+    elif "--fake" in options:
+        command = f"{sys.executable} {fake}"
+    codec = 'mjpeg' if get_option(options, "--input") is not None else 'yuv420'
+    return FrameSource(int(get_option(options, "--width", 640)),
+                       int(get_option(options, "--height", 480)),
+                       codec=codec, command=command).start()
+
+if __name__ == "__main__":
+    options = sys.argv[1:]
+    for opt in options:
+        if opt.split('=')[0] not in avaiable_options:
+            print("Option {} is not found.".format(opt))
+            print(usage)
+            sys.exit(0)
+    if "-h" in options or "--help" in options:
+        print(usage)
+        sys.exit(0)
+    scheduler = Scheduler(make_detectors(get_option(options, "--detect", "qr:10")),
+                          int(get_option(options, "--workers", 4)))
+    source = open_source(options)
+    try:
+        scheduler.run(source, float(get_option(options, "--duration", 10)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if hasattr(source, 'stop'):
+            source.stop()
+    if getattr(source, 'error', None) is not None:
+        print(f"\033[0;31mCan't start the camera: {source.error}\033[0m")
+    print(scheduler.report())
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Benchmark the installers against stand-ins, no robot or network needed
+
+    python3 bench.py [option] [-- installer option]
+
+Each run installs into a sandbox: apt-get, apt-cache, pip3, dpkg,
+dpkg-query, modprobe, lsmod and usermod are replaced by fakes that only
+log their call and sleep for a set latency (or fail on purpose), and a
+fake root (PICRAWLER_ROOT) holds /etc/os-release, /proc/device-tree/model
+and everything the installer writes. The installer writes a --trace,
+its steps are summed up into phases, and the median of the runs is
+compared with a stored baseline.
+"""
+import os
+import sys
+import json
+import time
+import shlex
+import shutil
+import subprocess
+import tempfile
+
+here = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, here)
+from installer_engine import get_option, plain_output, warn
+
+avaiable_options = ["-h", "--help", "--installer", "--repo", "--runs", "--latency", "--fail",
+                    "--os", "--model", "--warm", "--baseline", "--save-baseline",
+                    "--tolerance", "--keep"]
+
+usage = '''
+Usage:
+    python3 bench.py [option] [-- installer option]
+
+Options:
+               --installer=NAME
+                           robot_hat (install_ubuntu.py), vilib (install_ubuntu_v2.py)
+                           or all (install_all.py, default)
+               --repo=DIR  Benchmark the installers of the checkout DIR
+                           (default the one bench.py is in)
+               --runs=N    Install N times and take the median (default 3)
+               --latency=TOOL=SECONDS,...
+                           Latency of the fakes, e.g. apt-get=2,pip3=0.5
+                           (default apt-get=0.5,pip3=0.3, the others 0.01)
+               --fail=TOOL:PATTERN,...
+                           Make TOOL fail when its arguments match the shell
+                           pattern, e.g. pip3:*pyaudio* or apt-get:install*
+               --os=NAME   ubuntu-24.04 (default), ubuntu-22.04, raspbian-12 or
+                           raspbian-11 in the fake /etc/os-release
+               --model=N   Raspberry Pi model in the fake device tree (default 5)
+               --warm      Keep the fake root between runs (the fact cache and
+                           the journal survive), after one run that isn't counted
+               --baseline=FILE
+                           Compare with the baseline FILE (default bench-baseline.json)
+               --save-baseline
+                           Save the result as the new baseline
+               --tolerance=PERCENT
+                           A phase more than PERCENT slower than the baseline
+                           is a regression (default 10)
+               --keep      Keep the sandbox and print where it is
+    -h         --help      Show this help text and exit
+
+Installer options after "--" replace the default "--reinstall --jobs=4".
+Exits with status 1 if a phase regressed against the baseline.
+'''
+
+INSTALLERS = {
+    'robot_hat': ('robot-hat-ubuntu-fix/install_ubuntu.py', ['robot_hat']),
+    'vilib': ('vilib-investigation/install_ubuntu_v2.py', ['vilib']),
+    'all': ('scripts/install_all.py', ['robot_hat', 'picrawler', 'vilib']),
+}
+ENGINE_FILES = ['scripts/installer_engine.py', 'scripts/components.py', 'scripts/cache_proxy.py']
+
+OS_RELEASES = {
+    'ubuntu-24.04': ('ID=ubuntu\nVERSION_ID="24.04"\nVERSION_CODENAME=noble\n', 'trixie/sid\n'),
+    'ubuntu-22.04': ('ID=ubuntu\nVERSION_ID="22.04"\nVERSION_CODENAME=jammy\n', 'bookworm/sid\n'),
+    'raspbian-12': ('ID=debian\nVERSION_ID="12"\nVERSION_CODENAME=bookworm\n', '12.5\n'),
+    'raspbian-11': ('ID=raspbian\nVERSION_ID="11"\nVERSION_CODENAME=bullseye\n', '11.9\n'),
+}
+
+FAKE_TOOLS = ['apt-get', 'apt-cache', 'pip3', 'dpkg', 'dpkg-query', 'dpkg-deb',
+              'modprobe', 'lsmod', 'usermod']
+DEFAULT_LATENCY = {'apt-get': 0.5, 'pip3': 0.3}
+
+# what the fakes print, before the failure check
+FAKE_OUTPUT = {
+    'pip3': 'case "$1" in help) echo "  --break-system-packages  Allow pip to modify an'
+            ' EXTERNALLY-MANAGED Python installation";; esac',
+    'apt-cache': 'case "$1" in pkgnames) echo "libhdf5-dev"; echo "libhdf5-103";; esac',
+    'lsmod': 'echo "Module                  Size  Used by"',
+}
+
+# steps of run_steps() by phase, the first prefix that matches wins
+PHASES = [
+    ('apt update', ['dpkg-configure', 'apt-update']),
+    ('apt install', ['apt-install', 'pip-update']),
+    ('pip', ['pip:', 'pip-optional']),
+    ('bundle', ['bundle']),
+    ('post-install', ['precompile', 'lazy-imports', ':import-profile']),
+    ('library', [':lib']),
+    ('setup', [':']),
+]
+
+def write_fake(bin_dir, tool, latency, fail):
+    """Write the fake tool to bin_dir, sleeping latency seconds and failing on the patterns in fail"""
+    lines = ['#!/bin/sh',
+             f'echo "{tool} $*" >> "$BENCH_CALLS"',
+             f'sleep {latency}',
+             FAKE_OUTPUT.get(tool, '')]
+    for pattern in fail:
+        lines.append(f'case "$*" in {pattern}) echo "{tool}: injected failure" >&2; exit 100;; esac')
+    lines.append('exit 0')
+    path = os.path.join(bin_dir, tool)
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.chmod(path, 0o755)
+
+def make_root(root, os_name, model):
+    """Fake root with the system files the installer reads"""
+    os_release, debian_version = OS_RELEASES[os_name]
+    files = {
+        'etc/os-release': os_release,
+        'etc/debian_version': debian_version,
+        'etc/modules': '',
+        'etc/apt/sources.list': 'deb http://ports.ubuntu.com/ubuntu-ports noble main\n',
+        'var/lib/apt/lists/ports.ubuntu.com_ubuntu-ports_dists_noble_main_binary-arm64_Packages': '',
+        'var/lib/dpkg/status': 'Package: dpkg\nStatus: install ok installed\n',
+        'proc/device-tree/model': f"Raspberry Pi {model} Model B Rev 1.0\x00",
+    }
+    for name, content in files.items():
+        os.makedirs(os.path.join(root, os.path.dirname(name)), exist_ok=True)
+        with open(os.path.join(root, name), 'w') as f:
+            f.write(content)
+    os.makedirs(os.path.join(root, 'boot/firmware/overlays'), exist_ok=True)
+    os.makedirs(os.path.join(root, 'var/lib/dpkg/updates'), exist_ok=True)
+
+def make_checkout(checkout, name):
+    """Fake checkout of the component name, with what its install steps copy"""
+    os.makedirs(os.path.join(checkout, name), exist_ok=True)
+    with open(os.path.join(checkout, name, 'version.py'), 'w') as f:
+        f.write('__version__ = "0.0.0"\n')
+    if name == 'robot_hat':
+        os.makedirs(os.path.join(checkout, 'dtoverlays'), exist_ok=True)
+        open(os.path.join(checkout, 'dtoverlays', 'sunfounder-robothat.dtbo'), 'w').close()
+    if name == 'vilib':
+        os.makedirs(os.path.join(checkout, 'workspace'), exist_ok=True)
+        open(os.path.join(checkout, 'workspace', 'README'), 'w').close()
+
+def make_sandbox(sandbox, repo, installer, latency, fail):
+    """Fakes, checkouts and the installer, returns the installer command"""
+    bin_dir = os.path.join(sandbox, 'bin')
+    os.makedirs(bin_dir, exist_ok=True)
+    for tool in FAKE_TOOLS:
+        write_fake(bin_dir, tool, latency.get(tool, DEFAULT_LATENCY.get(tool, 0.01)),
+                   fail.get(tool, []))
+    script, names = INSTALLERS[installer]
+    checkouts = {name: os.path.join(sandbox, name.replace('_', '-')) for name in names}
+    for name, checkout in checkouts.items():
+        make_checkout(checkout, name)
+    # the installers find the engine next to themselves first
+    target = checkouts[names[0]] if installer != 'all' else os.path.join(sandbox, 'installer')
+    os.makedirs(target, exist_ok=True)
+    for file in [script] + ENGINE_FILES:
+        if os.path.exists(os.path.join(repo, file)):  # older checkouts lack some
+            shutil.copy(os.path.join(repo, file), target)
+    cmd = [sys.executable, os.path.join(target, os.path.basename(script))]
+    if installer == 'all':
+        cmd += [f"--robot-hat={checkouts['robot_hat']}", f"--picrawler={checkouts['picrawler']}",
+                f"--vilib={checkouts['vilib']}"]
+    return cmd
+
+def install(sandbox, root, cmd, installer_args):
+    """Install once, returns the steps of its trace, the wall time and whether it succeeded"""
+    trace = os.path.join(sandbox, 'trace.json')
+    env = dict(os.environ, PICRAWLER_ROOT=root, BENCH_CALLS=os.path.join(sandbox, 'calls.log'),
+               PATH=os.path.join(sandbox, 'bin') + os.pathsep + os.environ['PATH'])
+    env.pop('SUDO_USER', None)
+    if os.path.exists(trace):
+        os.remove(trace)  # of the run before
+    start = time.time()
+    with open(os.path.join(sandbox, 'install.log'), 'a') as log:
+        status = subprocess.call(cmd + installer_args + [f"--trace={trace}", "--profile=0"],
+                                 stdout=log, stderr=subprocess.STDOUT, env=env)
+    total = time.time() - start
+    if not os.path.exists(trace):
+        warn(f"installer produced no trace (exit status {status})")
+        return [], total, False
+    with open(trace) as f:
+        steps = json.load(f)['steps']
+    return steps, total, status == 0
+
+def run_once(sandbox, root, cmd, installer_args):
+    """Install once, returns the phase timings in seconds and whether it succeeded"""
+    steps, total, ok = install(sandbox, root, cmd, installer_args)
+    return phase_times(steps, total), ok
+
+def phase_times(steps, total):
+    """Wall time of each phase from the steps of a trace, from its first start to its last end"""
+    spans = {}
+    for step in steps:
+        name = step.get('step', '')
+        for phase, prefixes in PHASES:
+            if any(prefix in name if prefix.startswith(':') else name.startswith(prefix)
+                   for prefix in prefixes):
+                break
+        else:
+            phase = 'other'
+        first, last = spans.get(phase, (step['start'], step['start']))
+        spans[phase] = (min(first, step['start']), max(last, step['start'] + step['wall']))
+    times = {phase: round(last - first, 3) for phase, (first, last) in spans.items()}
+    first_step = min((step['start'] for step in steps), default=0)
+    times['startup'] = round(first_step, 3)  # detection and planning, since the engine loaded
+    times['total'] = round(total, 3)
+    return times
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2 == 1:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+def compare(result, baseline, tolerance):
+    """Print result next to baseline, returns the phases that regressed"""
+    if baseline['config'] != result['config']:
+        warn("The baseline was taken with other settings:")
+        for key in sorted(set(baseline['config']) | set(result['config'])):
+            if baseline['config'].get(key) != result['config'].get(key):
+                print(f"  {key}: {baseline['config'].get(key)} -> {result['config'].get(key)}")
+    print("\n  %-12s %10s %10s %9s" % ('phase', 'baseline', 'now', 'change'))
+    regressed = []
+    for phase in sorted(set(baseline['phases']) | set(result['phases'])):
+        old, new = baseline['phases'].get(phase), result['phases'].get(phase)
+        if old is None or new is None:
+            print("  %-12s %10s %10s" % (phase, '-' if old is None else f"{old:.2f}s",
+                                          '-' if new is None else f"{new:.2f}s"))
+            continue
+        change = (new - old) / old * 100 if old > 0 else 0
+        # below 50ms the noise of the fakes is bigger than any change
+        slower = change > tolerance and new - old > 0.05
+        if slower:
+            regressed.append(phase)
+        color = '\033[0;31m' if slower else '\033[0;32m' if change < -tolerance else ''
+        print("  %-12s %9.2fs %9.2fs %s%+8.1f%%\033[0m" % (phase, old, new, color, change))
+    return regressed
+
+def bench(options, installer_args):
+    installer = get_option(options, "--installer", "all")
+    repo = os.path.abspath(get_option(options, "--repo", os.path.join(here, '..')))
+    runs = int(get_option(options, "--runs", 3))
+    os_name = get_option(options, "--os", "ubuntu-24.04")
+    model = get_option(options, "--model", "5")
+    latency = {}
+    for item in filter(None, get_option(options, "--latency", "").split(',')):
+        tool, _, seconds = item.partition('=')
+        latency[tool] = float(seconds)
+    fail = {}
+    for item in filter(None, get_option(options, "--fail", "").split(',')):
+        tool, _, pattern = item.partition(':')
+        fail.setdefault(tool, []).append(pattern)
+    if installer not in INSTALLERS or os_name not in OS_RELEASES:
+        print(usage)
+        sys.exit(1)
+
+    sandbox = tempfile.mkdtemp(prefix="picrawler-bench-")
+    root = os.path.join(sandbox, 'root')
+    cmd = make_sandbox(sandbox, repo, installer, latency, fail)
+    print(f"Benchmarking {' '.join(shlex.quote(arg) for arg in cmd[1:2] + installer_args)}"
+          f" ({installer}, {os_name}, Pi {model}), {runs} runs")
+    try:
+        if "--warm" in options:
+            make_root(root, os_name, model)
+            run_once(sandbox, root, cmd, installer_args)
+        samples, failed = [], 0
+        for n in range(runs):
+            if "--warm" not in options:
+                shutil.rmtree(root, ignore_errors=True)
+                make_root(root, os_name, model)
+            times, ok = run_once(sandbox, root, cmd, installer_args)
+            failed += 0 if ok else 1
+            samples.append(times)
+            print(f"  run {n + 1}: {times['total']:.2f}s" + ("" if ok else " \033[0;31m(failed)\033[0m"))
+    finally:
+        if "--keep" in options:
+            print(f"Sandbox kept in {sandbox}, the calls to the fakes are in calls.log")
+        else:
+            shutil.rmtree(sandbox, ignore_errors=True)
+    if failed > 0 and not fail:
+        warn(f"{failed} of {runs} runs failed, see install.log with --keep")
+
+    phases = set(phase for times in samples for phase in times)
+    result = {'config': {'installer': installer, 'os': os_name, 'model': model,
+                         'latency': latency, 'fail': fail, 'warm': "--warm" in options,
+                         'args': installer_args},
+              'phases': {phase: round(median([times.get(phase, 0) for times in samples]), 3)
+                         for phase in phases}}
+
+    baseline_file = get_option(options, "--baseline", "bench-baseline.json")
+    regressed = []
+    if os.path.exists(baseline_file) and "--save-baseline" not in options:
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+        regressed = compare(result, baseline, float(get_option(options, "--tolerance", 10)))
+    else:
+        print("\n  %-12s %10s" % ('phase', 'median'))
+        for phase in sorted(result['phases']):
+            print("  %-12s %9.2fs" % (phase, result['phases'][phase]))
+    if "--save-baseline" in options:
+        with open(baseline_file, 'w') as f:
+            json.dump(result, f, indent=1)
+        print(f"\nSaved as the baseline in {baseline_file}")
+    if len(regressed) > 0:
+        print(f"\n\033[0;31mSlower than the baseline: {', '.join(regressed)}\033[0m")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    installer_args = ["--reinstall", "--jobs=4"]
+    if '--' in argv:
+        installer_args = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+    options = argv
+    for opt in options:
+        if opt.split('=')[0] not in avaiable_options:
+            print("Option {} is not found.".format(opt))
+            print(usage)
+            sys.exit(0)
+    if "-h" in options or "--help" in options:
+        print(usage)
+        sys.exit(0)
+    plain_output()
+    bench(options, installer_args)
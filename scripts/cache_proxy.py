@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+Caching proxy for apt and pip, shared by the robots of a LAN
+
+    python3 cache_proxy.py [option]
+
+apt uses it as its http proxy (Acquire::http::Proxy), pip as its index
+(PIP_INDEX_URL=http://HOST:3142/simple/). Everything downloaded through
+it is kept on disk, so the next robot, or the next install on the same
+robot, gets it from the LAN. The cache is bounded: when it grows over
+--max-size, the files used least recently are removed first.
+
+Packages (.deb, wheels, sdists) never change under their URL and are
+kept as they are. Indexes (apt's dists/, pip's simple pages) are fetched
+again after --index-ttl seconds, and the old copy is served if upstream
+can't be reached. A file larger than --max-size is passed through without
+being kept.
+
+It only fetches from the hosts of the apt and pip sources (ALLOWED_HOSTS
+and --allow), so listening on the whole LAN doesn't make it an open
+proxy for anything else.
+"""
+import os
+import sys
+import time
+import threading
+import collections
+
+avaiable_options = ["-h", "--help", "--port", "--listen", "--dir", "--max-size",
+                    "--index-ttl", "--pypi", "--allow", "--upstream"]
+
+usage = '''
+Usage:
+    python3 cache_proxy.py [option]
+
+Options:
+               --port=N    Listen on port N (default 3142)
+               --listen=ADDR
+                           Listen on address ADDR (default 0.0.0.0, the whole LAN;
+                           127.0.0.1 for this machine only)
+               --dir=DIR   Keep the cache in DIR (default /var/cache/picrawler/proxy)
+               --max-size=SIZE
+                           Remove the least recently used files when the cache
+                           grows over SIZE, e.g. 500M or 40G (default 20G)
+               --index-ttl=SECONDS
+                           Fetch indexes again when they are older (default 300)
+               --pypi=URL  Package index to mirror (default https://pypi.org/simple)
+               --allow=HOST[,HOST...]
+                           Also fetch from these hosts (and their subdomains), e.g.
+                           a local apt mirror. Ubuntu, Debian, Raspberry Pi, PyPI
+                           and piwheels hosts are always allowed, others get 403
+               --upstream=URL
+                           Fetch everything from the stand-in mirror at URL instead,
+                           http://host/path becomes URL/host/path (for tests)
+    -h         --help      Show this help text and exit
+
+Point the installers at it with --cache-proxy=http://HOST:3142, the
+statistics are at http://HOST:3142/stats.
+'''
+
+DEFAULT_PORT = 3142
+DEFAULT_DIR = "/var/cache/picrawler/proxy"
+# the hosts of the apt and pip sources, with their subdomains, e.g. ports.ubuntu.com
+ALLOWED_HOSTS = ['ubuntu.com', 'debian.org', 'raspberrypi.com', 'raspberrypi.org',
+                 'pypi.org', 'pythonhosted.org', 'piwheels.org']
+
+cache_dir = DEFAULT_DIR
+max_size = 20 << 30
+index_ttl = 300
+pypi_index = "https://pypi.org/simple"
+upstream = None
+allowed_hosts = list(ALLOWED_HOSTS)
+
+cache_lock = threading.Lock()
+entries = collections.OrderedDict()  # cache file -> size, least recently used first
+cache_size = 0
+fetching = {}  # cache file -> Event, set when its download is over
+stats = {'hits': 0, 'misses': 0, 'stale': 0, 'evicted': 0, 'passed_through': 0,
+         'denied': 0, 'bytes_served': 0, 'bytes_fetched': 0}
+
+class TooBig(Exception):
+    """The file is larger than the whole cache, it is passed through instead"""
+
+def parse_size(text):
+    """Bytes of a size like 500M or 40G"""
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+    text = text.strip().upper().rstrip('B')
+    if text[-1:] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def cache_path(url):
+    """File of url in the cache, None for URLs that can't be one"""
+    from urllib.parse import urlsplit, unquote
+    parts = urlsplit(url)
+    segments = [unquote(segment) for segment in parts.path.split('/')]
+    if parts.scheme not in ('http', 'https') or parts.netloc == '' \
+            or any(segment in ('.', '..') or '/' in segment for segment in segments):
+        return None
+    if segments[-1] == '':
+        segments[-1] = 'index.html'  # pip's simple pages end in /
+    return os.path.join(cache_dir, parts.scheme, parts.netloc.lower(),
+                        *[segment for segment in segments if segment != ''])
+
+def allowed(url):
+    """Whether url is on one of the allowed hosts, or the package index"""
+    from urllib.parse import urlsplit
+    host = (urlsplit(url).hostname or '').lower()
+    hosts = allowed_hosts + [urlsplit(pypi_index).hostname]
+    return any(host == allowed or host.endswith('.' + allowed) for allowed in hosts)
+
+def immutable(url):
+    """Whether url is a package, which never changes, rather than an index"""
+    from urllib.parse import urlsplit
+    path = urlsplit(url).path
+    return '/by-hash/' in path or path.endswith(
+        ('.deb', '.udeb', '.whl', '.tar.gz', '.tar.bz2', '.zip', '.metadata'))
+
+def load_cache():
+    """Index the files already in the cache, oldest use first"""
+    global cache_size
+    files = []
+    for root, _, names in [walk for scheme in ('http', 'https')
+                           for walk in os.walk(os.path.join(cache_dir, scheme))]:
+        for name in names:
+            path = os.path.join(root, name)
+            if name.endswith('.part'):
+                os.remove(path)  # left over from a download cut short
+                continue
+            st = os.stat(path)
+            files.append((st.st_atime, path, st.st_size))
+    for _, path, size in sorted(files):
+        entries[path] = size
+        cache_size += size
+    evict()
+
+def evict():
+    """Remove the least recently used files until the cache fits in max_size"""
+    global cache_size
+    with cache_lock:
+        while cache_size > max_size and len(entries) > 0:
+            path, size = entries.popitem(last=False)
+            cache_size -= size
+            stats['evicted'] += 1
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+def touch(path):
+    """Mark path as just used, the access time keeps the order over restarts"""
+    entries.move_to_end(path)
+    try:
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+    except FileNotFoundError:
+        pass
+
+def upstream_url(url):
+    """Where url is really fetched from, see --upstream"""
+    if upstream is None:
+        return url
+    from urllib.parse import urlsplit
+    parts = urlsplit(url)
+    return f"{upstream}/{parts.netloc}{parts.path}"
+
+def rewrite_links(page, base):
+    """Make the links of the simple index page fetched from base go through the proxy"""
+    import html
+    import re
+    from urllib.parse import urljoin, urlsplit
+
+    def link(match):
+        parts = urlsplit(urljoin(base, html.unescape(match.group(2))))
+        url = f"/url/{parts.scheme}/{parts.netloc}{parts.path}"
+        if parts.fragment:
+            url += f"#{parts.fragment}"  # the hash pip checks
+        return match.group(1) + html.escape(url) + match.group(3)
+    return re.sub(r'(href=")([^"]*)(")', link, page)
+
+def open_upstream(url):
+    import urllib.request
+    request = urllib.request.Request(upstream_url(url),
+                                     headers={'Accept': 'text/html', 'User-Agent': 'picrawler-cache-proxy'})
+    return urllib.request.urlopen(request, timeout=60)
+
+def fetch(url, path):
+    """
+    Download url into the cache file path, the index pages of pip with their links rewritten
+
+    Raises TooBig, without keeping anything, if the file turns out to be
+    larger than max_size: storing it would evict it right away.
+    """
+    global cache_size
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    size = 0
+    with open_upstream(url) as response:
+        index = url.startswith(pypi_index + '/')
+        length = response.headers.get('Content-Length')
+        if not index and length is not None and int(length) > max_size:
+            raise TooBig(url)
+        try:
+            with open(path + '.part', 'wb') as f:
+                if index:
+                    page = rewrite_links(response.read().decode('utf-8', 'replace'), url)
+                    f.write(page.encode('utf-8'))
+                    size = f.tell()
+                else:
+                    for chunk in iter(lambda: response.read(1 << 20), b''):
+                        f.write(chunk)
+                        size += len(chunk)
+                        if size > max_size:
+                            raise TooBig(url)  # no Content-Length to tell beforehand
+        except TooBig:
+            os.remove(path + '.part')
+            raise
+    os.replace(path + '.part', path)
+    with cache_lock:
+        cache_size += size - entries.pop(path, 0)
+        entries[path] = size
+        stats['bytes_fetched'] += size
+    evict()
+
+def cached(url):
+    """
+    Cache file of url, downloaded first if it is missing or stale
+
+    A file is downloaded once however many robots ask for it at the same
+    time, the others wait for it. Raises urllib's HTTPError if upstream
+    doesn't have it or the host isn't allowed, TooBig for files larger
+    than the cache.
+    """
+    import urllib.error
+    path = cache_path(url)
+    if path is None:
+        raise urllib.error.HTTPError(url, 400, "bad URL", None, None)
+    if not allowed(url):
+        with cache_lock:
+            stats['denied'] += 1
+        raise urllib.error.HTTPError(url, 403, "host not allowed", None, None)
+    while True:
+        with cache_lock:
+            event = fetching.get(path)
+            if event is None:
+                if path in entries and (immutable(url)
+                                        or time.time() - os.stat(path).st_mtime < index_ttl):
+                    stats['hits'] += 1
+                    touch(path)
+                    return path
+                event = fetching[path] = threading.Event()
+                break
+        event.wait()
+    try:
+        fetch(url, path)
+        with cache_lock:
+            stats['misses'] += 1
+        return path
+    except OSError as e:
+        with cache_lock:
+            if path not in entries or (isinstance(e, urllib.error.HTTPError) and e.code < 500):
+                raise
+            stats['stale'] += 1  # upstream is down, the old index is better than none
+            touch(path)
+        return path
+    finally:
+        with cache_lock:
+            del fetching[path]
+        event.set()
+
+def open_cached(url):
+    """cached(url) and the file opened, fetched again if it was evicted before the open"""
+    for _ in range(3):
+        path = cached(url)
+        try:
+            return path, open(path, 'rb')
+        except FileNotFoundError:
+            pass  # evict() removed it after the hit, now it's a miss
+    raise OSError(f"{url} was evicted before it could be served")
+
+def stats_page():
+    import json
+    with cache_lock:
+        page = dict(stats, files=len(entries), size=cache_size, max_size=max_size)
+    return json.dumps(page, indent=1).encode()
+
+def make_handler():
+    from http.server import BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # apt keeps the connection for the next file
+
+        def do_GET(self):
+            self.answer(body=True)
+
+        def do_HEAD(self):
+            self.answer(body=False)
+
+        def answer(self, body):
+            import urllib.error
+            if self.path == '/stats':
+                self.send_bytes(stats_page(), 'application/json', body)
+                return
+            if self.path.startswith('http://'):
+                url = self.path  # apt asking its proxy
+            elif self.path.startswith('/simple/'):
+                url = pypi_index + self.path[len('/simple'):]
+            elif self.path.startswith('/url/'):
+                scheme, _, rest = self.path[len('/url/'):].partition('/')
+                url = f"{scheme}://{rest}"
+            else:
+                self.send_error(404)
+                return
+            url = url.split('#', 1)[0].split('?', 1)[0]
+            try:
+                path, f = open_cached(url)
+            except urllib.error.HTTPError as e:
+                self.send_error(e.code)
+                return
+            except OSError as e:
+                self.send_error(502, f"upstream: {e}")
+                return
+            except TooBig:
+                self.pass_through(url, body)
+                return
+            content_type = 'text/html' if path.endswith('index.html') else 'application/octet-stream'
+            with f:
+                size = os.fstat(f.fileno()).st_size
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(size))
+                self.end_headers()
+                if body:
+                    self.wfile.flush()
+                    self.connection.sendfile(f)
+                    with cache_lock:
+                        stats['bytes_served'] += size
+
+        def pass_through(self, url, body):
+            """Stream url from upstream to the client, for files too big to cache"""
+            import urllib.error
+            try:
+                response = open_upstream(url)
+            except urllib.error.HTTPError as e:
+                self.send_error(e.code)
+                return
+            except OSError as e:
+                self.send_error(502, f"upstream: {e}")
+                return
+            with response:
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                length = response.headers.get('Content-Length')
+                if length is not None:
+                    self.send_header('Content-Length', length)
+                else:
+                    self.send_header('Connection', 'close')  # the end of the body is the end
+                    self.close_connection = True
+                self.end_headers()
+                served = 0
+                if body:
+                    for chunk in iter(lambda: response.read(1 << 20), b''):
+                        self.wfile.write(chunk)
+                        served += len(chunk)
+            with cache_lock:
+                stats['passed_through'] += 1
+                stats['bytes_served'] += served
+
+        def send_bytes(self, data, content_type, body):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            if body:
+                self.wfile.write(data)
+
+    return Handler
+
+def serve(listen="0.0.0.0", port=DEFAULT_PORT):
+    from http.server import ThreadingHTTPServer
+    os.makedirs(cache_dir, exist_ok=True)
+    load_cache()
+    server = ThreadingHTTPServer((listen, port), make_handler())
+    server.daemon_threads = True
+    print(f"Caching apt and pip downloads in {cache_dir} ({len(entries)} files,"
+          f" {cache_size >> 20} of {max_size >> 20} MB), listening on {listen}:{port}", flush=True)
+    server.serve_forever()
+
+if __name__ == "__main__":
+    options = sys.argv[1:]
+    for opt in options:
+        if opt.split('=')[0] not in avaiable_options:
+            print("Option {} is not found.".format(opt))
+            print(usage)
+            sys.exit(0)
+    if "-h" in options or "--help" in options:
+        print(usage)
+        sys.exit(0)
+
+    def get_option(name, default=None):
+        for opt in options:
+            if opt.startswith(name + "="):
+                return opt.split("=", 1)[1]
+        return default
+
+    cache_dir = os.path.abspath(get_option("--dir", DEFAULT_DIR))
+    max_size = parse_size(get_option("--max-size", "20G"))
+    index_ttl = float(get_option("--index-ttl", index_ttl))
+    pypi_index = get_option("--pypi", pypi_index).rstrip('/')
+    upstream = get_option("--upstream")
+    allowed_hosts += [host.strip().lower() for host in get_option("--allow", "").split(',')
+                      if host.strip() != '']
+    if upstream is not None:
+        upstream = upstream.rstrip('/')
+    try:
+        serve(get_option("--listen", "0.0.0.0"), int(get_option("--port", DEFAULT_PORT)))
+    except KeyboardInterrupt:
+        pass
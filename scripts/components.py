@@ -0,0 +1,316 @@
+"""
+Manifests of the components installed by installer_engine.py
+
+Each manifest says what a component needs, the engine works out how to
+install it, see the comment above resolve() in installer_engine.py for
+the fields. The installers set 'source' to the component's checkout.
+"""
+import os
+
+from installer_engine import (check_os_bit, check_python_version, check_raspbain_version,
+                              component_user, detect_os, do, log, run_command, cached_probe,
+                              bundle_file, root_path, sync_files, check_command, check_device,
+                              check_group, check_i2c_device, check_import, check_module,
+                              apt_lists_key)
+
+def is_ubuntu():
+    return detect_os() == "ubuntu"
+
+def is_mediapipe_supported():
+    # Note: On Ubuntu, may conflict with system scipy - use --ignore-installed
+    python_version = check_python_version()
+    return (check_os_bit() == 64 and check_raspbain_version() >= 11
+            and python_version[0] == 3 and python_version[1] < 13)
+
+def is_tensorflow_supported():
+    python_version = check_python_version()
+    return python_version[0] == 3 and python_version[1] < 13
+
+def check_hdf5_package():
+    """Name of the libhdf5 runtime package, Ubuntu 24.04 uses a different one"""
+    # the answer only changes with the package indexes
+    def probe():
+        import re
+        _, result = run_command("apt-cache pkgnames libhdf5")
+        names = sorted(name for name in result.split() if re.fullmatch(r'libhdf5-[0-9]+', name))
+        if len(names) > 0:
+            return names[0]
+        else:
+            return "libhdf5-dev"  # Fallback
+    return cached_probe('hdf5_package', apt_lists_key(), probe)
+
+def import_checks(modules, timeout=10, when=None):
+    """--verify checks importing each of modules"""
+    checks = []
+    for module in modules:
+        check = {'name': f"import {module}", 'timeout': timeout,
+                 'check': lambda component, module=module: check_import(module, timeout)}
+        if when is not None:
+            check['when'] = when
+        checks.append(check)
+    return checks
+
+# robot_hat
+# =========
+def enable_i2c_ubuntu(component):
+    """Enable I2C on Ubuntu by loading kernel module"""
+    # Check if i2c-dev is already loaded
+    loaded, _ = check_module("i2c_dev")
+    if not loaded:
+        do(msg="load i2c-dev module", cmd="modprobe i2c-dev")
+        do(msg="make i2c-dev persistent", cmd=f"echo 'i2c-dev' >> {root_path('/etc/modules')}")
+
+    # Add the user the checkout belongs to (whoami is root under sudo)
+    username = component_user(component)
+    if username != "root":
+        do(msg=f"add {username} to i2c group", cmd=f"usermod -a -G i2c {username}")
+
+def enable_spi_ubuntu(component):
+    """Enable SPI on Ubuntu by loading kernel module"""
+    loaded, _ = check_module("spi_bcm2835")
+    if not loaded:
+        do(msg="load spi module", cmd="modprobe spi_bcm2835")
+        do(msg="make spi persistent", cmd=f"echo 'spi_bcm2835' >> {root_path('/etc/modules')}")
+
+    # Add the user the checkout belongs to, if the spi group exists
+    username = component_user(component)
+    if username != "root":
+        status, _ = run_command("getent group spi")
+        if status == 0:
+            do(msg=f"add {username} to spi group", cmd=f"usermod -a -G spi {username}")
+
+DEFAULT_OVERLAYS_PATH = root_path("/boot/firmware/overlays/")
+LEGACY_OVERLAYS_PATH = root_path("/boot/overlays/")
+
+def overlays_path():
+    if os.path.exists(DEFAULT_OVERLAYS_PATH):
+        return DEFAULT_OVERLAYS_PATH
+    elif os.path.exists(LEGACY_OVERLAYS_PATH):
+        return LEGACY_OVERLAYS_PATH
+    return None
+
+def copy_dtoverlay(component):
+    _overlays_path = overlays_path()
+    if _overlays_path is None:
+        log("\033[0;33mBoot overlay path not found, skipping dtoverlay copy\033[0m")
+        return
+    sync_files(bundle_file(component, 'dtoverlays'), _overlays_path, msg="copy dtoverlay")
+
+ROBOT_HAT = {
+    'name': 'robot_hat',
+    # Dependencies for Ubuntu (no raspi-config!)
+    # Skip TTS pico on Ubuntu for now (architecture mismatch)
+    # You can install it manually if needed
+    'apt': [
+        "i2c-tools",
+        "espeak",
+        'libsdl2-dev',
+        'libsdl2-mixer-dev',
+        'portaudio19-dev',
+        'sox',
+    ],
+    'pip': [
+        'smbus2',
+        'gpiozero',
+        'pyaudio',
+        'spidev',
+        'pyserial',
+        'pillow',
+        "pygame>=2.1.2",
+    ],
+    # apt packages a pip package needs to build, it waits for them to be installed
+    'build_depends': {
+        'pyaudio': ['portaudio19-dev'],
+        "pygame>=2.1.2": ['libsdl2-dev', 'libsdl2-mixer-dev'],
+    },
+    # Setup interfaces (Ubuntu method), both edit /etc/modules
+    'actions': [
+        {'name': 'i2c', 'locks': ['modules'], 'run': enable_i2c_ubuntu},
+        {'name': 'spi', 'locks': ['modules'], 'run': enable_spi_ubuntu},
+        {'name': 'dtoverlay', 'run': copy_dtoverlay},
+    ],
+    'bundle': ['dtoverlays'],
+    # --verify, after a reboot
+    'verify': [
+        {'name': 'i2c module', 'check': lambda component: check_module('i2c_dev')},
+        {'name': 'spi module', 'check': lambda component: check_module('spi_bcm2835')},
+        {'name': 'i2c device', 'check': lambda component: check_device('/dev/i2c-*')},
+        {'name': 'spi device', 'check': lambda component: check_device('/dev/spidev*')},
+        {'name': 'i2c group', 'check': lambda component: check_group(component_user(component), 'i2c')},
+        # only some systems have an spi group, see enable_spi_ubuntu()
+        {'name': 'spi group',
+         'check': lambda component: check_group(component_user(component), 'spi', required=False)},
+        {'name': 'Robot HAT at 0x14', 'check': lambda component: check_i2c_device(1, 0x14)},
+    ] + import_checks(['robot_hat', 'smbus2', 'gpiozero', 'pyaudio', 'spidev', 'serial', 'PIL',
+                       'pygame']),
+    'finish': [
+        "\nFinished! You may need to reboot for I2C/SPI to work.",
+        "After reboot, verify with: 'ls /dev/i2c* /dev/spi*'",
+    ],
+}
+
+# picrawler
+# =========
+PICRAWLER = {
+    'name': 'picrawler',
+    'requires': ['robot_hat'],
+    'verify': import_checks(['picrawler']),
+    'finish': [
+        "\nPiCrawler installed, try: 'cd ~/picrawler/examples && sudo python3 move.py'",
+    ],
+}
+
+# vilib
+# =====
+def remove_egg_info(component):
+    do(msg="cleanup", cmd=f"rm -rf {component['source']}/vilib.egg-info")
+
+def link_libcamera(component):
+    """Fix libcamera linking issue on Ubuntu"""
+    log("  Ubuntu installs libcamera to arch-specific site-packages,")
+    log("  but pip's picamera2 looks in local dist-packages.")
+
+    # Find the Python version
+    python_version = check_python_version()
+    py_version = f"{python_version[0]}.{python_version[1]}"
+
+    # Ubuntu uses arch-specific path for system packages
+    system_path = root_path(f"/usr/lib/aarch64-linux-gnu/python{py_version}/site-packages")
+    local_path = root_path(f"/usr/local/lib/python{py_version}/dist-packages")
+
+    # Check if libcamera exists in system packages
+    libcamera_path = f"{system_path}/libcamera"
+    if os.path.isdir(libcamera_path):
+        # Create symlink for libcamera package
+        do(msg="link libcamera package",
+           cmd=f'ln -sf {libcamera_path} {local_path}/libcamera')
+        log("  ✓ libcamera linking complete")
+    else:
+        log(f'\033[0;33m  Could not find libcamera at {libcamera_path}\033[0m')
+        log('\033[0;33m  picamera2 may not work - try: sudo apt-get install python3-libcamera\033[0m')
+
+def create_workspace(component):
+    user_name = component_user(component)
+    opt = root_path('/opt')
+    if not os.path.exists(opt):
+        do(msg="create /opt",
+           cmd=f'mkdir {opt} && chmod 774 {opt}'
+           + f' && chown -R {user_name}:{user_name} {opt}')
+    if not os.path.isdir(f'{opt}/vilib'):
+        do(msg="create dir",
+           cmd=f'mkdir -p {opt}/vilib'
+           + f' && chmod 774 {opt}/vilib'
+           + f' && chown {user_name}:{user_name} {opt}/vilib')
+    # only the files that changed since the last copy
+    sync_files(f"{component['source']}/workspace", f'{opt}/vilib', msg="copy workspace",
+               mode='774', user=user_name)
+
+VILIB = {
+    'name': 'vilib',
+    # Ubuntu 24.04 is equivalent to Debian 12+
+    'min_debian': 11,
+    'dpkg_configure': True,
+    # Note: On Ubuntu, python3-picamera2 and rpicam-apps are not available via apt
+    'apt': [
+        "python3-libcamera",
+        "libcap-dev",  # Required for python-prctl (picamera2 dependency)
+        "python3-pyqt5",
+        "python3-opengl",
+        "python3-opencv",
+        "opencv-data",
+        "ffmpeg",
+        # mediapipe dependencies
+        "libgtk-3-0",
+        "libxcb-shm0",
+        "libcdio-paranoia-dev",
+        "libsdl2-2.0-0",
+        "libxv1",
+        "libtheora0",
+        "libva-drm2",
+        "libva-x11-2",
+        "libvdpau1",
+        "libharfbuzz0b",
+        "libbluray2",
+        "libzbar0",
+        "libopenblas-dev",
+        # tflite-runtime dependencies
+        {'name': "libatlas-base-dev", 'when': is_tensorflow_supported},
+        # Ubuntu-specific: check for correct libhdf5 package name
+        {'name': check_hdf5_package,
+         'when': lambda: is_tensorflow_supported() and is_ubuntu()},
+        {'name': "libhdf5-130",
+         'when': lambda: is_tensorflow_supported() and not is_ubuntu()},
+    ],
+    # Note: picamera2 must be installed via pip on Ubuntu (not available via apt)
+    'pip': [
+        "picamera2",  # CRITICAL: Install via pip on Ubuntu
+        "imutils",
+        "qrcode",
+        "pyzbar",
+        "pyzbar[scripts]",
+        "readchar",
+        'protobuf>=3.20.0',
+        {'name': "numpy", 'when': lambda: check_raspbain_version() > 11},
+        {'name': "numpy==1.26.4", 'when': lambda: check_raspbain_version() <= 11},
+        # tflite-runtime often not available for newer Python versions
+        {'name': "tflite-runtime", 'when': is_tensorflow_supported,
+         'otherwise': "tflite-runtime is only supported on python 3.12 or older."},
+    ],
+    # Install optional packages (may conflict with system packages)
+    'optional': [
+        # Flask (optional - for web interface)
+        {'name': "Flask", 'args': "--ignore-installed blinker", 'when': is_ubuntu},
+        # mediapipe (optional - for advanced vision)
+        {'name': "mediapipe", 'args': "--ignore-installed scipy protobuf",
+         'when': is_mediapipe_supported,
+         'otherwise': "mediapipe is only supported on 64bit system with python 3.12 or older."},
+    ],
+    'build_depends': {
+        "picamera2": ["libcap-dev"],  # python-prctl
+    },
+    'actions': [
+        {'name': 'cleanup', 'after': ['lib'], 'run': remove_egg_info},
+        # python3-libcamera comes from the apt list
+        {'name': 'libcamera', 'after': ['apt-install'], 'when': is_ubuntu,
+         'run': link_libcamera},
+        {'name': 'workspace', 'run': create_workspace},
+    ],
+    # mediapipe and tensorflow take a while to import on the Pi
+    'verify': [
+        {'name': 'camera', 'timeout': 20,
+         'check': lambda component: check_command("rpicam-hello --list-cameras",
+                                                  "Available cameras", 20)},
+    ] + import_checks(['vilib', 'picamera2', 'libcamera', 'cv2', 'numpy', 'pyzbar', 'qrcode',
+                       'imutils', 'readchar'])
+      + import_checks(['tflite_runtime'], 30, when=is_tensorflow_supported)
+      + import_checks(['mediapipe'], 30, when=is_mediapipe_supported),
+    'finish': [
+        "\n" + "=" * 60,
+        "✅ vilib installation completed successfully!",
+        "=" * 60,
+        "\nNext steps:",
+        "  1. Test vilib import:",
+        "     python3 -c 'import vilib; print(vilib.__version__)'",
+        "\n  2. Test camera with picamera2:",
+        "     libcamera-hello -t 3000",
+        "\n  3. Check examples:",
+        "     ls /opt/vilib/",
+        "\n  4. Test vilib camera:",
+        "     cd ~/vilib/examples",
+        "     python3 [example_file].py",
+        "\n" + "=" * 60,
+    ],
+    'error_note': [
+        "\n💡 Note: Core vilib functionality may still work.",
+        "   Some optional features (AI/ML) may be unavailable.",
+    ],
+}
+
+COMPONENTS = [ROBOT_HAT, PICRAWLER, VILIB]
+
+def component(name, source):
+    """Copy of the manifest of the component name, for the checkout in source"""
+    for manifest in COMPONENTS:
+        if manifest['name'] == name:
+            return dict(manifest, source=os.path.abspath(source))
+    raise ValueError(f"unknown component {name}")
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Provision a fleet of robots from one controller
+
+    python3 fleet.py --inventory=FILE [option] [-- installer option]
+
+Pushes the installer to every host of the inventory over ssh and runs
+install_all.py on all of them at once. Hosts with the same OS, Python
+and architecture share one build: the first of them installs with
+--export-bundle, the others install offline from that bundle. The step
+results of every host end up in one report.
+"""
+import os
+import sys
+import shlex
+
+here = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, here)
+import installer_engine
+from installer_engine import (check_number_options, do, errors, get_option, run_command, run_steps,
+                              warn)
+
+avaiable_options = ["-h", "--help", "--inventory", "--jobs", "--bundle", "--wheelhouse",
+                    "--work-dir", "--rebuild", "--ssh", "--scp", "--sudo"]
+
+usage = '''
+Usage:
+    python3 fleet.py --inventory=FILE [option] [-- installer option]
+
+Options:
+               --inventory=FILE
+                           Hosts to install, one ssh destination ([user@]host)
+                           per line, # starts a comment
+               --jobs=N    Work on up to N hosts at once (default 8)
+               --bundle=FILE
+                           Install every host from this offline bundle
+               --wheelhouse=DIR
+                           Copy this wheelhouse root (with its cpXY-arch
+                           directories) to every host and install from it
+               --work-dir=DIR
+                           Keep bundles and reports in DIR (default ./fleet-work)
+               --rebuild   Build the bundles again, even if DIR has them
+               --ssh=CMD   ssh command (default "ssh -o BatchMode=yes")
+               --scp=CMD   scp command (default "scp -q -o BatchMode=yes")
+               --sudo=CMD  Run the installer with CMD on the hosts (default "sudo -n")
+    -h         --help      Show this help text and exit
+
+Installer options after "--" are passed to install_all.py on every host,
+e.g. "-- --vilib=/home/pi/vilib --jobs=2".
+'''
+
+# where the installer and the bundles go on the hosts
+REMOTE_DIR = "/tmp/picrawler-installer"
+INSTALLER_FILES = ['installer_engine.py', 'components.py', 'install_all.py', 'cache_proxy.py']
+
+def read_inventory(file):
+    """The hosts listed in file"""
+    hosts = []
+    with open(file) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line != '' and line not in hosts:
+                hosts.append(line)
+    return hosts
+
+def remote(host, cmd):
+    """Shell command running cmd on host"""
+    return f"{ssh} {shlex.quote(host)} {shlex.quote(cmd)}"
+
+def probe_host(host):
+    """
+    The build group of host, e.g. "ubuntu-24.04-cp312-aarch64", None if unreachable
+
+    Hosts of a group can install the same .debs and wheels.
+    """
+    _, result = run_command(remote(host, "python3 -c 'import platform, sys;"
+                                         " print(open(\"/etc/os-release\").read());"
+                                         " print(\"PYTHON=cp%d%d\" % sys.version_info[:2]);"
+                                         " print(\"ARCH=\" + platform.machine())'"))
+    info = {}
+    for line in result.splitlines():
+        key, sep, value = line.partition('=')
+        if sep:
+            info[key.strip()] = value.strip().strip('"')
+    if 'PYTHON' not in info:
+        return None
+    return "%s-%s-%s-%s" % (info.get('ID', 'linux'), info.get('VERSION_ID', ''),
+                            info['PYTHON'], info['ARCH'])
+
+def push(host, files):
+    """Copy files (and directories) to REMOTE_DIR on host"""
+    return do(msg=f"{host}: push {', '.join(os.path.basename(f) for f in files)}",
+              cmd=remote(host, f"mkdir -p {REMOTE_DIR}")
+              + f" && {scp} -r {' '.join(shlex.quote(f) for f in files)}"
+              + f" {shlex.quote(host)}:{REMOTE_DIR}/")
+
+def run_installer(host, msg, args):
+    """Run install_all.py on host, then fetch its report, returns if it succeeded"""
+    ok = do(msg=f"{host}: {msg}",
+            cmd=remote(host, f"{sudo} python3 {REMOTE_DIR}/install_all.py {args}"
+                             f" --report={REMOTE_DIR}/report.json"))
+    report = os.path.join(work_dir, 'reports', f"{host}.json")
+    run_command(f"{scp} {shlex.quote(host)}:{REMOTE_DIR}/report.json {shlex.quote(report)}")
+    return ok
+
+def fleet_report(hosts, groups, roles):
+    """Collect the reports of the hosts into one, write it and print a summary"""
+    import json
+    report = {'hosts': {}}
+    for host in hosts:
+        entry = {'group': groups.get(host), 'role': roles.get(host)}
+        try:
+            with open(os.path.join(work_dir, 'reports', f"{host}.json")) as f:
+                entry['report'] = json.load(f)
+        except (OSError, ValueError):
+            entry['report'] = None
+        report['hosts'][host] = entry
+    report['errors'] = errors
+    report_file = os.path.join(work_dir, 'report.json')
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=1)
+
+    print(f"\nFleet report ({len(hosts)} hosts), details in {report_file}:")
+    print("  %-24s %-28s %s" % ('host', 'group', 'result'))
+    failed = 0
+    for host, entry in report['hosts'].items():
+        if entry['group'] is None:
+            result = "\033[0;31munreachable\033[0m"
+        elif entry['report'] is None:
+            result = "\033[0;31mfailed, no report\033[0m"
+        elif not entry['report']['ok']:
+            result = "\033[0;31m%d errors\033[0m" % len(entry['report']['errors'])
+        else:
+            result = "ok, %d steps in %.0fs" % (len(entry['report']['steps']),
+                                               entry['report']['duration'])
+        if entry['report'] is None or not entry['report']['ok']:
+            failed += 1
+        if entry['role'] is not None:
+            result += f" ({entry['role']})"
+        print("  %-24s %-28s %s" % (host, entry['group'] or '-', result))
+    return failed
+
+def provision(hosts, install_args):
+    """Install all hosts, sharing one bundle build per group"""
+    from concurrent.futures import ThreadPoolExecutor
+    bundle = get_option(options, "--bundle")
+    wheelhouse = get_option(options, "--wheelhouse")
+    os.makedirs(os.path.join(work_dir, 'bundles'), exist_ok=True)
+    os.makedirs(os.path.join(work_dir, 'reports'), exist_ok=True)
+    for host in hosts:
+        # a report of an earlier run would look like this run's
+        try:
+            os.remove(os.path.join(work_dir, 'reports', f"{host}.json"))
+        except FileNotFoundError:
+            pass
+
+    print(f"Probing {len(hosts)} hosts ...")
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        groups = dict(zip(hosts, pool.map(probe_host, hosts)))
+    roles = {}
+    for host in hosts:
+        if groups[host] is None:
+            errors.append(f"{host} error:\n  unreachable or without python3")
+
+    # Steps for run_steps(): push the installer, then install. The first
+    # host of a group builds the group's bundle unless one is given or
+    # kept from an earlier run, the others wait for it.
+    installer = [os.path.join(here, name) for name in INSTALLER_FILES]
+    steps = []
+    builders = {}
+    for host in hosts:
+        group = groups[host]
+        if group is None:
+            continue
+        group_bundle = os.path.join(work_dir, 'bundles', f"{group}.tar")
+        if bundle is None and wheelhouse is None and group not in builders \
+                and ("--rebuild" in options or not os.path.exists(group_bundle)):
+            builders[group] = host
+            roles[host] = "built the bundle"
+
+            def build(host=host, group_bundle=group_bundle):
+                if not push(host, installer):
+                    return
+                remote_bundle = f"{REMOTE_DIR}/bundle.tar"
+                if run_installer(host, "install and build the bundle",
+                                 f"{install_args} --export-bundle={remote_bundle}"):
+                    do(msg=f"{host}: fetch the bundle",
+                       cmd=f"{scp} {shlex.quote(host)}:{remote_bundle} {shlex.quote(group_bundle)}.tmp"
+                           f" && mv {shlex.quote(group_bundle)}.tmp {shlex.quote(group_bundle)}")
+            steps.append({'name': f"build:{group}", 'run': build})
+            continue
+
+        def install(host=host, group_bundle=group_bundle):
+            files = list(installer)
+            args = install_args
+            if bundle is not None:
+                files.append(bundle)
+                args += f" --from-bundle={REMOTE_DIR}/{os.path.basename(bundle)}"
+            elif wheelhouse is not None:
+                files.append(wheelhouse)
+                args += f" --wheelhouse={REMOTE_DIR}/{os.path.basename(os.path.abspath(wheelhouse))}"
+            elif os.path.exists(group_bundle):
+                files.append(group_bundle)
+                args += f" --from-bundle={REMOTE_DIR}/{os.path.basename(group_bundle)}"
+            else:
+                roles[host] = "online, no bundle"  # the build of the group failed
+            if push(host, files):
+                run_installer(host, "install", args)
+        if bundle is None and wheelhouse is None:
+            roles.setdefault(host, "from the group bundle")
+        steps.append({'name': f"install:{host}", 'after': [f"build:{group}"], 'run': install})
+
+    print(f"Installing {len(steps)} hosts, {len(builders)} bundle builds, {jobs} at once:")
+    run_steps(steps, jobs)
+    return fleet_report(hosts, groups, roles)
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    install_args = ''
+    if '--' in argv:
+        install_args = ' '.join(shlex.quote(arg) for arg in argv[argv.index('--') + 1:])
+        argv = argv[:argv.index('--')]
+    options = argv
+    for opt in options:
+        if opt.split('=')[0] not in avaiable_options:
+            print("Option {} is not found.".format(opt))
+            print(usage)
+            sys.exit(0)
+    if "-h" in options or "--help" in options or get_option(options, "--inventory") is None:
+        print(usage)
+        sys.exit(0)
+    if "--export-bundle" in install_args or "--from-bundle" in install_args:
+        warn("fleet.py takes care of the bundles, use --bundle instead")
+        sys.exit(1)
+    check_number_options(options, usage, ['--jobs'])
+
+    jobs = int(get_option(options, "--jobs", 8))
+    work_dir = os.path.abspath(get_option(options, "--work-dir", "fleet-work"))
+    ssh = get_option(options, "--ssh", "ssh -o BatchMode=yes")
+    scp = get_option(options, "--scp", "scp -q -o BatchMode=yes")
+    sudo = get_option(options, "--sudo", "sudo -n")
+
+    installer_engine.plain_output()
+    hosts = read_inventory(get_option(options, "--inventory"))
+    try:
+        failed = provision(hosts, install_args)
+    except KeyboardInterrupt:
+        installer_engine.stop_commands()
+        print("\n\nCanceled.")
+        sys.exit(1)
+    if failed > 0:
+        sys.exit(1)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Install robot-hat, picrawler and vilib together, as one planned job
+
+    sudo python3 install_all.py [--robot-hat=DIR] [--picrawler=DIR] [--vilib=DIR] [option]
+
+Each component is installed from its checkout, by default ~/robot-hat,
+~/picrawler and ~/vilib of the user running sudo. Components without a
+checkout are left out.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+import installer_engine
+import components
+
+CHECKOUTS = {
+    'robot_hat': '--robot-hat',
+    'picrawler': '--picrawler',
+    'vilib': '--vilib',
+}
+
+extra_usage = '''               --robot-hat=DIR
+                           robot-hat checkout (default ~/robot-hat)
+               --picrawler=DIR
+                           picrawler checkout (default ~/picrawler)
+               --vilib=DIR vilib checkout (default ~/vilib)
+'''
+
+options = installer_engine.parse_options(sys.argv[1:], list(CHECKOUTS.values()), extra_usage)
+
+def home():
+    """Home of the user running sudo"""
+    import pwd
+    user = os.environ.get('SUDO_USER', pwd.getpwuid(os.getuid()).pw_name)
+    return pwd.getpwnam(user).pw_dir
+
+if __name__ == "__main__":
+    selected = []
+    for name, option in CHECKOUTS.items():
+        default = os.path.join(home(), option[2:])
+        source = installer_engine.get_option(options, option, default)
+        if os.path.isdir(source):
+            selected.append(components.component(name, source))
+        else:
+            installer_engine.warn(f"{source} not found, {name} is not installed")
+    if len(selected) == 0:
+        sys.exit(1)
+    print("Installing %s" % ', '.join(component['name'] for component in selected))
+    installer_engine.main(selected, options)
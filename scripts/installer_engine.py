@@ -0,0 +1,2028 @@
+#!/usr/bin/env python3
+"""
+Install engine shared by the robot-hat, picrawler and vilib installers
+
+A component is described by a manifest (see components.py): its apt and
+pip packages, the conditions they depend on and the steps to run after
+the packages are in. install() plans all the components given to it as
+one graph of steps, so apt-get update, the pip probe and the system
+detection happen once however many components are installed together.
+"""
+import os
+import sys
+import time
+import threading
+
+# define color print
+def warn(msg, end='\n', file=sys.stdout, flush=False):
+    print(f'\033[0;33m{msg}\033[0m', end=end, file=file, flush=flush)
+
+def error(msg, end='\n', file=sys.stdout, flush=False):
+    print(f'\033[0;31m{msg}\033[0m', end=end, file=file, flush=flush)
+
+avaiable_options = ["-h", "--help", "--no-dep", "--only-lib", "--no-build-isolation",
+                    "--reinstall", "--jobs", "--wheelhouse", "--build-wheelhouse",
+                    "--export-bundle", "--from-bundle", "--resume", "--profile",
+                    "--trace", "--log", "--step-timeout", "--plan",
+                    "--report", "--cache-proxy", "--verify", "--verify-only",
+                    "--apt-max-age", "--lazy-imports"]
+
+# options that take a number: its type and what it may be
+number_options = {'--jobs': (int, lambda n: n >= 1), '--profile': (int, lambda n: n >= 0),
+                  '--apt-max-age': (float, lambda n: n >= 0),
+                  '--step-timeout': (float, lambda n: n > 0)}
+
+usage = '''
+Usage:
+    sudo python3 {script} [option]
+
+Options:
+{extra}               --no-dep    Do not install dependencies
+               --only-lib  Only install the Python packages, no system setup
+               --no-build-isolation
+                           Build the Python packages without build isolation
+               --reinstall Reinstall dependencies that are already installed,
+                           and the components' packages even if unchanged
+               --resume    Skip the steps that succeeded in the last run
+               --apt-max-age=SECONDS
+                           Skip apt-get update if the package indexes were
+                           refreshed less than SECONDS ago (default 3600,
+                           0 always refreshes them)
+               --jobs=N    Run up to N install steps at once (default 4)
+               --build-wheelhouse
+                           Build wheels for all pip packages into the wheelhouse
+               --wheelhouse[=DIR]
+                           Install pip packages from the wheelhouse in DIR
+                           (default /var/cache/picrawler/wheelhouse)
+               --export-bundle=FILE
+                           Install, then add every .deb and wheel needed to the
+                           offline bundle FILE
+               --from-bundle=FILE
+                           Install offline from the bundle FILE
+               --cache-proxy[=URL]
+                           Download apt and pip packages through the caching
+                           proxy at URL (see cache_proxy.py), without URL start
+                           one on this machine for the install
+               --profile=N Show the N slowest steps and imports at the end
+                           (default 5)
+               --lazy-imports
+                           Import mediapipe, tflite, tensorflow and pygame only
+                           when a program uses them, see picrawler_lazy.py
+               --trace=FILE
+                           Write the timing of every step to FILE, as JSON in
+                           Chrome trace format
+               --log=FILE  Append the complete output of every step to FILE
+               --step-timeout=SECONDS
+                           Stop steps that run longer than SECONDS
+               --plan      Only show the commands an install would run, with
+                           the estimated download size and time of each
+               --report=FILE
+                           Write the result of every step and the errors to
+                           FILE as JSON, e.g. for fleet.py
+               --verify    After the install, check that the hardware and the
+                           Python packages work (I2C/SPI devices, modules,
+                           groups, imports, the Robot HAT at 0x14)
+               --verify-only
+                           Only run the checks of --verify, without installing
+    -h         --help      Show this help text and exit
+'''
+
+def parse_options(argv, extra_options=[], extra_usage=''):
+    """
+    Check the command line options and handle --help
+
+    Runs before anything else, so --help and typos answer right away,
+    without root and without probing the system.
+    """
+    script = os.path.basename(sys.argv[0])
+    text = usage.format(script=script, extra=extra_usage)
+    options = list(argv)
+    for opt in options:
+        if opt.split('=')[0] not in avaiable_options + extra_options:
+            print("Option {} is not found.".format(opt))
+            print(text)
+            sys.exit(0)
+    if "-h" in options or "--help" in options:
+        print(text)
+        sys.exit(0)
+    check_number_options(options, text)
+    return options
+
+def check_number_options(options, text, names=None):
+    """Exit with text if one of the number options names (default all) has a bad value"""
+    for name in names or number_options:
+        kind, valid = number_options[name]
+        value = get_option(options, name)
+        if value is None:
+            continue
+        try:
+            ok = valid(kind(value))
+        except ValueError:
+            ok = False
+        if not ok:
+            error(f"Option {name} doesn't take {value!r}.")
+            print(text)
+            sys.exit(1)
+
+# Root of the system files the installer reads and writes. bench.py points
+# it at a fake root directory, e.g. with an /etc/os-release of its own.
+ROOT = os.environ.get("PICRAWLER_ROOT", "/")
+
+def root_path(path):
+    """path inside ROOT"""
+    return os.path.join(ROOT, path.lstrip('/'))
+
+def check_root():
+    # a fake root is writable without root
+    if os.geteuid() != 0 and ROOT == "/":
+        warn(f"Script must be run as root. Try \"sudo python3 {os.path.basename(sys.argv[0])}\".")
+        sys.exit(1)
+
+# utils
+def run_command(cmd=""):
+    status, result, _ = spawn(cmd)
+    return status, result
+
+def spawn(cmd="", tail=None, on_line=None, timeout=None):
+    """
+    Run cmd in a shell and return its exit status, output and rusage
+
+    The combined stdout and stderr is read line by line as it comes, so
+    memory stays bounded: with tail only the last tail lines are kept
+    for the result, on_line gets every line (e.g. to write a log). A
+    command still running after timeout seconds is killed together with
+    everything it started.
+    """
+    import collections
+    import signal
+    import subprocess
+    # own process group, so a timeout or Ctrl+C can stop all of it
+    p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+                         stderr=subprocess.STDOUT, start_new_session=True)
+    running_commands.add(p.pid)
+    timer = None
+    if timeout is not None:
+        def kill():
+            try:
+                os.killpg(p.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        timer = threading.Timer(timeout, kill)
+        timer.daemon = True
+        timer.start()
+    lines = collections.deque(maxlen=tail)
+    for line in p.stdout:
+        line = line.decode('utf-8', 'replace')
+        lines.append(line)
+        if on_line is not None:
+            on_line(line)
+    p.stdout.close()
+    _, wait_status, rusage = os.wait4(p.pid, 0)
+    p.returncode = status = os.waitstatus_to_exitcode(wait_status)
+    running_commands.discard(p.pid)
+    if timer is not None:
+        timer.cancel()
+        if status == -signal.SIGKILL:
+            lines.append(f"killed after a timeout of {timeout}s\n")
+    return status, ''.join(lines), rusage
+
+def stop_commands():
+    """Stop the commands still running, e.g. after Ctrl+C"""
+    import signal
+    for pid in list(running_commands):
+        try:
+            os.killpg(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+errors = []
+
+# output handling of do(), see --log and --step-timeout
+OUTPUT_TAIL = 40  # lines of output kept for the error report
+running_commands = set()
+log_file = None
+log_lock = threading.Lock()
+step_timeout = None
+
+# Progress display. One renderer thread for the whole run keeps a status
+# line with the running steps below the output. It sleeps until a step
+# starts or finishes and only ticks twice a second, for the spinner and
+# the clocks, while steps are running. Without a terminal (e.g. a log
+# over ssh) there is no status line and no escape codes, only lines.
+progress_cond = threading.Condition()
+running_steps = {}  # id -> (msg, start time) of the steps running
+step_ids = iter(range(1 << 62))
+progress_thread = None
+progress_drawn = False  # whether the status line is on screen
+
+class PlainOutput:
+    """Stream wrapper dropping the color and cursor escape codes"""
+    def __init__(self, stream):
+        import re
+        self.stream = stream
+        self.escapes = re.compile(r'\033\[[0-9;?]*[A-Za-z]|\r')
+
+    def write(self, text):
+        return self.stream.write(self.escapes.sub('', text))
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def plain_output():
+    """Switch to plain line output if stdout isn't a terminal"""
+    if not sys.stdout.isatty() and not isinstance(sys.stdout, PlainOutput):
+        sys.stdout = PlainOutput(sys.stdout)
+
+def format_rate(rate):
+    if rate >= 1e6:
+        return "%.1fMB/s" % (rate / 1e6)
+    return "%.0fkB/s" % (rate / 1e3)
+
+def progress_renderer():
+    """Draw the status line, woken by step_started() and step_finished()"""
+    import shutil
+    global progress_drawn
+    char = ['/', '-', '\\', '|']
+    i = 0
+    last_rx, last_time = net_bytes()[0], time.time()
+    rate = 0
+    with progress_cond:
+        while True:
+            if len(running_steps) == 0:
+                progress_cond.wait()
+                last_rx, last_time = net_bytes()[0], time.time()
+                continue
+            now = time.time()
+            if now - last_time >= 0.5:
+                rx = net_bytes()[0]
+                rate = (rx - last_rx) / (now - last_time)
+                last_rx, last_time = rx, now
+            i = (i + 1) % 4
+            line = ' %s %s' % (char[i], ', '.join('%s %ds' % (msg, now - start)
+                                                  for msg, start in running_steps.values()))
+            if rate > 0:
+                line += '  down %s' % format_rate(rate)
+            width = shutil.get_terminal_size().columns
+            sys.stdout.write('\033[?25l\r\033[K' + line[:width - 1])
+            sys.stdout.flush()
+            progress_drawn = True
+            progress_cond.wait(0.5)
+
+def show(line):
+    """Print line above the status line"""
+    global progress_drawn
+    with progress_cond:
+        if progress_drawn:
+            sys.stdout.write('\r\033[K\033[?25h')
+            progress_drawn = False
+        print(line, flush=True)
+        progress_cond.notify()
+
+def step_started(msg):
+    """Add msg to the status line, returns the id for step_finished()"""
+    global progress_thread
+    with progress_cond:
+        step_id = next(step_ids)
+        running_steps[step_id] = (msg, time.time())
+        if progress_thread is None and sys.stdout.isatty():
+            progress_thread = threading.Thread(target=progress_renderer, daemon=True)
+            progress_thread.start()
+        progress_cond.notify()
+    return step_id
+
+def step_finished(step_id, line):
+    """Take the step off the status line and print line for it"""
+    with progress_cond:
+        running_steps.pop(step_id, None)
+        show(line)
+
+def log(msg):
+    """print() that doesn't collide with the status line"""
+    show(msg)
+
+# Step journal, every do() is recorded so --resume can skip what
+# already succeeded. One JSON object per line, appended and synced
+# right away so it survives a power cut. It is kept with the other
+# caches, not in the checkout, and shared by the installers: a step is
+# known by its command, so what install_all.py did counts for
+# install_ubuntu.py and the other way round.
+JOURNAL_FILE = root_path("/var/cache/picrawler/journal.jsonl")
+journal_file = None
+journal_done = set()
+journal_lock = threading.Lock()
+
+def step_hash(cmd):
+    import hashlib
+    return hashlib.sha256(cmd.encode('utf-8')).hexdigest()[:16]
+
+def journal_key(cmd, key=None):
+    """What the journal knows the step by: its command, and key if what it works on can change"""
+    return step_hash(cmd if key is None else f"{cmd}\n{key}")
+
+def open_journal(resume=False, file=JOURNAL_FILE):
+    """Start a new journal, with resume keep it and load the steps that succeeded"""
+    import json
+    global journal_file
+    journal_file = file
+    journal_done.clear()
+    if not resume:
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        open(file, 'w').close()
+        return
+    try:
+        with open(file) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # cut off by an interruption
+                if entry['status'] == 0:
+                    journal_done.add(entry['hash'])
+                else:
+                    journal_done.discard(entry['hash'])
+    except FileNotFoundError:
+        pass
+
+def write_journal(msg, key, status, duration):
+    """Record the step msg, key from journal_key()"""
+    import json
+    if journal_file is None:
+        return
+    entry = json.dumps({'msg': msg, 'hash': key, 'status': status,
+                        'duration': round(duration, 3), 'time': round(time.time(), 3)})
+    with journal_lock:
+        with open(journal_file, 'a') as f:
+            f.write(entry + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+# Per step measurements, see record_step(), print_profile() and write_trace()
+step_stats = []
+profile_start = time.time()
+current_step = threading.local()  # name of the run_steps() step of this thread
+
+def net_bytes():
+    """Bytes received and sent on all interfaces but lo, from /proc/net/dev"""
+    rx = tx = 0
+    try:
+        with open('/proc/net/dev') as f:
+            lines = f.readlines()[2:]
+    except OSError:
+        return 0, 0
+    for line in lines:
+        name, data = line.split(':', 1)
+        if name.strip() == 'lo':
+            continue
+        fields = data.split()
+        rx += int(fields[0])
+        tx += int(fields[8])
+    return rx, tx
+
+def record_step(msg, status, start, end, rusage, net_start, net_end, cmd=""):
+    """
+    Keep the measurements of one step
+
+    cpu, peak RSS and bytes written come from the rusage of the finished
+    command, so they cover only that step even when steps overlap. The
+    kernel counts the installer's own RSS at fork as well, so the peak
+    RSS never drops below that.
+    Network bytes are counted for the whole system and include the
+    traffic of anything running at the same time.
+    """
+    stat = {'msg': msg, 'hash': step_hash(cmd), 'status': status,
+            'start': round(start - profile_start, 3), 'wall': round(end - start, 3),
+            'thread': threading.current_thread().name,
+            'step': getattr(current_step, 'name', '')}
+    if rusage is not None:
+        stat['cpu'] = round(rusage.ru_utime + rusage.ru_stime, 3)
+        stat['max_rss_kb'] = rusage.ru_maxrss
+        stat['written'] = rusage.ru_oublock * 512
+    stat['net_rx'] = net_end[0] - net_start[0]
+    stat['net_tx'] = net_end[1] - net_start[1]
+    step_stats.append(stat)
+
+def print_profile(top=5):
+    """Print the top slowest steps"""
+    if len(step_stats) == 0 or top <= 0:
+        return
+    print(f"\nSlowest steps (of {len(step_stats)}, {time.time() - profile_start:.1f}s in total):")
+    print("  %8s %8s %9s %9s %9s  %s" % ('wall', 'cpu', 'peak rss', 'written', 'network', 'step'))
+    for stat in sorted(step_stats, key=lambda s: s['wall'], reverse=True)[:top]:
+        print("  %7.1fs %7.1fs %8.0fM %8.1fM %8.1fM  %s" % (
+            stat['wall'], stat.get('cpu', 0), stat.get('max_rss_kb', 0) / 1024,
+            stat.get('written', 0) / 1e6, (stat['net_rx'] + stat['net_tx']) / 1e6,
+            stat['msg']))
+
+def write_trace(file):
+    """
+    Write the steps to file as Chrome trace (chrome://tracing, Perfetto)
+
+    It is plain JSON as well, with the raw measurements under "steps".
+    """
+    import json
+    threads = sorted(set(stat['thread'] for stat in step_stats))
+    events = []
+    for stat in step_stats:
+        events.append({'name': stat['msg'], 'ph': 'X', 'pid': os.getpid(),
+                       'tid': threads.index(stat['thread']),
+                       'ts': int(stat['start'] * 1e6), 'dur': int(stat['wall'] * 1e6),
+                       'args': dict((k, v) for k, v in stat.items() if k != 'msg')})
+    with open(file, 'w') as f:
+        json.dump({'traceEvents': events, 'steps': step_stats}, f, indent=1)
+
+def do(msg="", cmd="", report=True, timeout=None, key=None):
+    """
+    Run the step msg, the shell command cmd
+
+    --resume skips it if it succeeded before with the same command and
+    key, e.g. the content hash of the checkout a command installs.
+    """
+    done_key = journal_key(cmd, key)
+    if planning:
+        planned.append({'msg': msg, 'cmd': cmd, 'done': done_key in journal_done})
+        return True
+    if done_key in journal_done:
+        show(" - %s ... Done before, skipped" % msg)
+        return True
+    step_id = step_started(msg)
+    start, net_start = time.time(), net_bytes()
+    def on_line(line):
+        if log_file is not None:
+            with log_lock:
+                log_file.write(f"[{msg}] {line}")
+    if timeout is None:
+        timeout = step_timeout
+    status, result, rusage = spawn(cmd, tail=OUTPUT_TAIL, on_line=on_line, timeout=timeout)
+    record_step(msg, status, start, time.time(), rusage, net_start, net_bytes(), cmd)
+    if status == 0:
+        tip, ok = 'Done', True
+    elif not report:
+        tip, ok = '\033[38;5;8mFailed\033[0m', False
+    else:
+        tip, ok = '\033[1;35mError\033[0m', False
+        errors.append("%s error:\n  Status:%s\n  Error:%s" % (msg, status, result))
+    write_journal(msg, done_key, 0 if ok else status, time.time() - start)
+    step_finished(step_id, " - %s ... %s \033[38;5;8m(%s)\033[0m" % (msg, tip, format_time(time.time() - start)))
+    return ok
+
+def skip(msg, cmd, reason):
+    """Leave out the step msg because there is nothing to do, with reason"""
+    if planning:
+        planned.append({'msg': msg, 'cmd': cmd, 'done': True, 'reason': reason})
+        return
+    show(f" - {msg} ... {reason[0].upper() + reason[1:]}, skipped")
+
+def run_step(step):
+    current_step.name = step['name']
+    try:
+        step['run']()
+    finally:
+        current_step.name = ''
+
+def run_steps(steps, jobs=4):
+    """
+    Run a graph of install steps on a pool of at most jobs workers
+
+    Each step is a dict with:
+        name:  unique name of the step
+        run:   function doing the work, normally through do()
+        after: names of steps that have to finish first, names that
+               are not part of the graph are ignored
+        locks: shared resources the step holds, steps holding the same
+               resource (e.g. "dpkg" or "pip") never run at the same time
+    Steps are started in list order as soon as they are ready.
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    names = set(step['name'] for step in steps)
+    pending = list(steps)
+    finished = set()
+    held = set()
+    futures = {}
+
+    jobs = max(jobs, 1)
+    pool = ThreadPoolExecutor(max_workers=jobs)
+    try:
+        while len(pending) > 0 or len(futures) > 0:
+            for step in list(pending):
+                if len(futures) >= jobs:
+                    break
+                after = [name for name in step.get('after', []) if name in names]
+                locks = step.get('locks', [])
+                if all(name in finished for name in after) and held.isdisjoint(locks):
+                    pending.remove(step)
+                    held.update(locks)
+                    futures[pool.submit(run_step, step)] = step
+            if len(futures) == 0:
+                raise RuntimeError("circular step dependencies: %s"
+                                   % ', '.join(step['name'] for step in pending))
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                step = futures.pop(future)
+                held.difference_update(step.get('locks', []))
+                finished.add(step['name'])
+                future.result()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+# System facts, probed once and cached in FACTS_FILE until the next
+# reboot or OS upgrade, see system_fact()
+FACTS_FILE = root_path("/var/cache/picrawler/facts.json")
+facts = None
+facts_lock = threading.RLock()  # probes may ask for other facts
+
+def read_file(file, default=""):
+    try:
+        with open(file) as f:
+            return f.read()
+    except OSError:
+        return default
+
+def boot_id():
+    """ID of the current boot, the fact and verify caches hold until the next one"""
+    return read_file(root_path('/proc/sys/kernel/random/boot_id')).strip()
+
+def facts_key():
+    """Cached facts hold for this boot, OS release and Python only"""
+    import hashlib
+    key = (boot_id() + read_file(root_path('/etc/os-release'))
+           + read_file(root_path('/etc/debian_version')) + sys.version)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+def system_fact(name, probe):
+    """Value of the fact name, probe() only runs if it isn't cached yet"""
+    import json
+    global facts
+    with facts_lock:
+        if facts is None:
+            facts = {}
+            try:
+                with open(FACTS_FILE) as f:
+                    cached = json.load(f)
+                if cached.get('key') == facts_key():
+                    facts = cached['facts']
+            except (OSError, ValueError):
+                pass
+        if name not in facts:
+            facts[name] = probe()
+            try:
+                os.makedirs(os.path.dirname(FACTS_FILE), exist_ok=True)
+                with open(FACTS_FILE + '.tmp', 'w') as f:
+                    json.dump({'key': facts_key(), 'facts': facts}, f)
+                os.replace(FACTS_FILE + '.tmp', FACTS_FILE)
+            except OSError:
+                pass  # keep it in memory only
+        return facts[name]
+
+# Probes whose answer only changes with what they probe, e.g. the pip3
+# version, cached in PROBE_FILE across reboots, see cached_probe()
+PROBE_FILE = root_path("/var/cache/picrawler/probes.json")
+probes = None
+probes_lock = threading.RLock()
+
+def load_probes():
+    import json
+    global probes
+    with probes_lock:
+        if probes is None:
+            try:
+                with open(PROBE_FILE) as f:
+                    probes = json.load(f)
+            except (OSError, ValueError):
+                probes = {}
+        return probes
+
+def store_probe(name, key, value):
+    import json
+    with probes_lock:
+        load_probes()[name] = {'key': key, 'value': value}
+        try:
+            os.makedirs(os.path.dirname(PROBE_FILE), exist_ok=True)
+            with open(PROBE_FILE + '.tmp', 'w') as f:
+                json.dump(probes, f)
+            os.replace(PROBE_FILE + '.tmp', PROBE_FILE)
+        except OSError:
+            pass  # probed again next time
+
+def cached_probe(name, key, probe):
+    """probe() cached under name for as long as key stays the same"""
+    with probes_lock:
+        entry = load_probes().get(name)
+        if entry is not None and entry['key'] == key:
+            return entry['value']
+        value = probe()
+        if key is not None:
+            store_probe(name, key, value)
+        return value
+
+def os_release():
+    """/etc/os-release as a dict"""
+    info = {}
+    for line in read_file(root_path('/etc/os-release')).splitlines():
+        key, sep, value = line.partition('=')
+        if sep:
+            info[key] = value.strip().strip('"')
+    return info
+
+def check_rpi_model():
+    """Check Pi model - works on both Raspbian and Ubuntu"""
+    def probe():
+        # e.g. "Raspberry Pi 5 Model B Rev 1.0"
+        model = read_file(root_path('/proc/device-tree/model')).strip('\x00').split()
+        if len(model) > 2 and model[2] in ('3', '4', '5'):
+            return int(model[2])
+        else:
+            # Default to 4 if unknown (safe assumption for modern Pi)
+            return int(4)
+    return system_fact('rpi_model', probe)
+
+def detect_os():
+    """Detect if running Ubuntu or Raspbian"""
+    def probe():
+        if "ubuntu" in os_release().get('ID', '').lower():
+            return "ubuntu"
+        else:
+            return "raspbian"
+    return system_fact('os_type', probe)
+
+def check_ubuntu_version():
+    """Get Ubuntu version (e.g., 24.04 returns 24)"""
+    try:
+        return int(os_release().get('VERSION_ID', '').split('.')[0])
+    except ValueError:
+        return 24  # Default to 24 if can't detect
+
+def check_raspbain_version():
+    """
+    Check OS version - works for both Raspbian and Ubuntu
+    For Ubuntu: returns equivalent Debian version
+    Ubuntu 24.04 = Debian 12+ equivalent
+    """
+    def probe():
+        if detect_os() == "ubuntu":
+            ubuntu_ver = check_ubuntu_version()
+            # Map Ubuntu to Debian equivalent
+            # Ubuntu 24.04 = Debian 12+ (bookworm)
+            # Ubuntu 22.04 = Debian 11 (bullseye)
+            if ubuntu_ver >= 24:
+                return 12
+            elif ubuntu_ver >= 22:
+                return 11
+            else:
+                return 11
+        else:
+            # Original Raspbian detection
+            try:
+                return int(read_file(root_path('/etc/debian_version')).split('.')[0])
+            except ValueError:
+                return 12
+    return system_fact('raspbain_version', probe)
+
+def check_python_version():
+    major = int(sys.version_info.major)
+    minor = int(sys.version_info.minor)
+    micro = int(sys.version_info.micro)
+    return major, minor, micro
+
+def check_os_bit():
+    # userland bits, like getconf LONG_BIT
+    import struct
+    return system_fact('os_bit', lambda: struct.calcsize('P') * 8)
+
+def print_system_info():
+    """print system and hardware information"""
+    python_version = check_python_version()
+    print(f"Detected OS: {detect_os()}")
+    print(f"Python version: {python_version[0]}.{python_version[1]}.{python_version[2]}")
+    print(f"OS version equivalent: Debian {check_raspbain_version()} ({check_os_bit()}bit)")
+    print(f"Raspberry Pi model: {check_rpi_model()}")
+    print("")
+
+def pip_key():
+    """The pip3 on PATH, its version and mtime, None without one"""
+    import shutil
+    from importlib import metadata
+    path = shutil.which('pip3')
+    if path is None:
+        return None
+    try:
+        version = metadata.version('pip')
+    except metadata.PackageNotFoundError:
+        version = ''
+    return f"{os.path.realpath(path)}:{mtime(path)}:{version}"
+
+def pip_bsps():
+    """"--break-system-packages" if pip3 has this option, else ''"""
+    def probe():
+        status, _ = run_command("pip3 help install|grep break-system-packages")
+        if status == 0:
+            return "--break-system-packages"
+        return ''
+    return cached_probe('pip_bsps', pip_key(), probe)
+
+def apt_missing(deps):
+    """Return the apt packages that are not installed, from one dpkg-query call"""
+    if len(deps) == 0:
+        return []
+    _, result = run_command("dpkg-query -W -f='${Package}\\t${Status}\\n' %s 2>/dev/null"
+                            % " ".join(deps))
+    installed = set()
+    for line in result.splitlines():
+        name, _, state = line.partition('\t')
+        # state is "install ok installed" for a fully installed package
+        if state.split(' ')[-1] == 'installed':
+            installed.add(name)
+    return [dep for dep in deps if dep not in installed]
+
+def _canonical_name(name):
+    import re
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+def pip_missing(deps):
+    """Return the pip requirements not satisfied yet, from one scan of installed distributions"""
+    try:
+        from packaging.requirements import Requirement
+    except ImportError:
+        try:
+            from pip._vendor.packaging.requirements import Requirement
+        except ImportError:
+            return list(deps)  # can't evaluate specifiers, install everything
+    from importlib import metadata
+
+    installed = {}
+    for dist in metadata.distributions():
+        name = dist.metadata['Name']
+        if name:
+            # the first match on sys.path is the one that gets imported
+            installed.setdefault(_canonical_name(name), dist)
+
+    def satisfied(dep):
+        if dep.endswith('.whl'):
+            # wheel file names are {name}-{version}-{tags}.whl
+            name, version = os.path.basename(dep).split('-')[:2]
+            dep = f"{name}=={version}"
+        try:
+            req = Requirement(dep)
+        except Exception:
+            return False
+        dist = installed.get(_canonical_name(req.name))
+        if dist is None:
+            return False
+        if not req.specifier.contains(dist.version, prereleases=True):
+            return False
+        # the requirements pulled in by extras, e.g. pyzbar[scripts]
+        for extra_dep in dist.requires or []:
+            extra_req = Requirement(extra_dep)
+            if extra_req.marker is None or extra_req.marker.evaluate({'extra': ''}):
+                continue
+            if not any(extra_req.marker.evaluate({'extra': e}) for e in req.extras):
+                continue
+            extra_dist = installed.get(_canonical_name(extra_req.name))
+            if extra_dist is None or not extra_req.specifier.contains(extra_dist.version, prereleases=True):
+                return False
+        return True
+
+    return [dep for dep in deps if not satisfied(dep)]
+
+def skip_installed(deps, missing, kind, force=False):
+    """Filter deps down to the missing ones, unless force is set (--reinstall)"""
+    if force:
+        return deps
+    todo = missing(deps)
+    if len(todo) < len(deps):
+        log(f"\033[38;5;8m {len(deps) - len(todo)} {kind} packages already installed, skipped\033[0m")
+    return todo
+
+def get_option(options, name, default=None):
+    """Value of a --name=value option, or default if it wasn't given"""
+    for opt in options:
+        if opt.startswith(name + "="):
+            return opt.split("=", 1)[1]
+    return default
+
+# Wheels built once and reused, see pip_install_cmd()
+WHEELHOUSE_ROOT = root_path("/var/cache/picrawler/wheelhouse")
+
+def wheelhouse_dir(root=WHEELHOUSE_ROOT):
+    """Wheelhouse for this Python version and architecture, e.g. cp312-aarch64"""
+    import platform
+    return os.path.join(root, "cp%d%d-%s" % (sys.version_info.major,
+                                             sys.version_info.minor,
+                                             platform.machine()))
+
+def pick_wheelhouse(options):
+    """
+    Wheelhouse to install from, or None to install from the index
+
+    --build-wheelhouse builds the wheels on the way, --wheelhouse[=ROOT]
+    uses an existing one, e.g. copied from another robot. A wheelhouse
+    built by an earlier run is picked up without asking.
+    """
+    root = get_option(options, "--wheelhouse", WHEELHOUSE_ROOT)
+    wheelhouse = wheelhouse_dir(root)
+    if "--build-wheelhouse" in options or "--wheelhouse" in options:
+        return wheelhouse
+    if root != WHEELHOUSE_ROOT:
+        return wheelhouse
+    if os.path.isdir(wheelhouse) and any(f.endswith('.whl') for f in os.listdir(wheelhouse)):
+        return wheelhouse
+    return None
+
+def pip_install_cmd(dep, args="", wheelhouse=None, build=False, offline=False):
+    """
+    pip3 command installing dep, from the wheelhouse when there is one
+
+    Installing from the wheelhouse needs neither a compiler nor the
+    network, anything missing from it falls back to the package index
+    unless offline is set. With build, dep and its dependencies are
+    built into the wheelhouse first.
+    """
+    cmd = f'pip3 install "{dep}" {args}'
+    if wheelhouse is None:
+        return cmd
+    from_wheelhouse = f'pip3 install --no-index --find-links {wheelhouse} "{dep}" {args}'
+    if build:
+        # local packages need their build backend offline as well
+        extra = ' setuptools wheel' if dep.startswith('.') else ''
+        return f'pip3 wheel -w {wheelhouse} "{dep}"{extra} && {from_wheelhouse}'
+    if offline:
+        return from_wheelhouse
+    return f'{from_wheelhouse} || {cmd}'
+
+# Content hashes of the component checkouts and of the files copied from
+# them, so an unchanged package isn't built again and only changed files
+# are copied, see source_hash() and sync_files(). A file is only read
+# again when its size or mtime changed. Kept in HASH_FILE.
+HASH_FILE = root_path("/var/cache/picrawler/hashes.json")
+HASH_SKIP = ('__pycache__', 'build', 'dist')  # build output in a checkout
+hashes = None
+hashes_lock = threading.RLock()
+
+def load_hashes():
+    import json
+    global hashes
+    with hashes_lock:
+        if hashes is None:
+            try:
+                with open(HASH_FILE) as f:
+                    hashes = json.load(f)
+            except (OSError, ValueError):
+                hashes = {}
+            hashes.setdefault('files', {})
+            hashes.setdefault('packages', {})
+        return hashes
+
+def save_hashes():
+    import json
+    with hashes_lock:
+        try:
+            os.makedirs(os.path.dirname(HASH_FILE), exist_ok=True)
+            with open(HASH_FILE + '.tmp', 'w') as f:
+                json.dump(load_hashes(), f)
+            os.replace(HASH_FILE + '.tmp', HASH_FILE)
+        except OSError:
+            pass  # hashed again next time
+
+def file_hash(path):
+    """sha256 of the content of path, from the cache while its size and mtime are the same"""
+    import hashlib
+    stat = os.stat(path)
+    with hashes_lock:
+        known = load_hashes()['files'].get(path)
+        if known is not None and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        hashes['files'][path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+def tree_hashes(top):
+    """{relative path: content hash} of the files under top, without dot files and build output"""
+    result = {}
+    for dirpath, dirnames, filenames in os.walk(top):
+        dirnames[:] = sorted(name for name in dirnames
+                             if not name.startswith('.') and name not in HASH_SKIP
+                             and not name.endswith('.egg-info'))
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            # e.g. the journal of an installer in the checkout
+            if name.startswith('.') or name.endswith('.pyc') or not os.path.isfile(path):
+                continue
+            result[os.path.relpath(path, top)] = file_hash(path)
+    return result
+
+def source_hash(top):
+    """One hash of all the files under top"""
+    import hashlib
+    digest = hashlib.sha256()
+    for path, file_digest in sorted(tree_hashes(top).items()):
+        digest.update(f"{path}\0{file_digest}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+def package_unchanged(component, digest):
+    """Whether the package of component is installed from a checkout with the content digest"""
+    installed = load_hashes()['packages'].get(component['name'])
+    return (installed == {'source': component['source'], 'hash': digest, 'python': sys.version}
+            and pip_missing([component['name']]) == [])
+
+def record_package(component, digest):
+    with hashes_lock:
+        load_hashes()['packages'][component['name']] = {
+            'source': component['source'], 'hash': digest, 'python': sys.version}
+    save_hashes()
+
+def sync_files(src, dest, msg, mode=None, user=None):
+    """
+    Copy the files under src to dest that differ from their copy there
+
+    Only the copied files and the directories created for them get mode
+    and the owner user. Returns False if the copy failed.
+    """
+    import shlex
+    changed = []
+    for path, digest in tree_hashes(src).items():
+        target = os.path.join(dest, path)
+        if not os.path.isfile(target) or file_hash(target) != digest:
+            changed.append(path)
+    save_hashes()
+    cmd = f"cd {shlex.quote(src)} && cp --parents %s {shlex.quote(dest)}"
+    if len(changed) == 0:
+        skip(msg, cmd % '*', "unchanged")
+        return True
+    files = ' '.join(shlex.quote(path) for path in changed)
+    cmd = cmd % files
+    dirs = set()
+    for path in changed:
+        while os.path.dirname(path) != '':
+            path = os.path.dirname(path)
+            dirs.add(path)
+    touched = ' '.join(shlex.quote(path) for path in sorted(dirs)) + ' ' + files
+    if mode is not None or user is not None:
+        cmd += f" && cd {shlex.quote(dest)}"
+    if mode is not None:
+        cmd += f" && chmod {mode} {touched}"
+    if user is not None:
+        cmd += f" && chown {user}:{user} {touched}"
+    return do(msg=f"{msg} ({len(changed)} changed)", cmd=cmd)
+
+# Offline provisioning bundle, see --export-bundle and --from-bundle.
+# A bundle is a tar of a flat apt repository (debs/), a wheelhouse
+# (wheels/), extra files of the components (e.g. dtoverlays/) and a
+# manifest.json of what went in.
+apt_get = "apt-get"  # points apt at the bundle's repository with --from-bundle
+bundle_stage = None  # the unpacked bundle of --from-bundle
+apt_proxy = ""  # apt-get options of --cache-proxy
+
+def open_bundle(bundle):
+    """Unpack bundle into a new staging directory, empty if it doesn't exist yet"""
+    import tarfile
+    import tempfile
+    stage = tempfile.mkdtemp(prefix="picrawler-bundle-", dir="/var/tmp")
+    os.chmod(stage, 0o755)  # apt reads the repository as the _apt user
+    if os.path.exists(bundle):
+        with tarfile.open(bundle) as tar:
+            if hasattr(tarfile, 'data_filter'):
+                tar.extractall(stage, filter='data')
+            else:
+                tar.extractall(stage)
+    for sub in ('debs', 'wheels'):
+        os.makedirs(os.path.join(stage, sub), exist_ok=True)
+    return stage
+
+def export_debs(deps, stage):
+    """Download deps and everything they depend on into the bundle"""
+    _, result = run_command("apt-cache depends --recurse --no-recommends --no-suggests"
+                            " --no-conflicts --no-breaks --no-replaces --no-enhances "
+                            + " ".join(deps))
+    # real packages start the line, dependencies are indented and
+    # virtual packages are shown as <name>
+    names = sorted(set(line.strip() for line in result.splitlines()
+                       if line[:1].isalnum()))
+    do(msg=f"download {len(names)} .deb files",
+       cmd=f'cd {stage}/debs && apt-get{apt_proxy} download {" ".join(names)}')
+
+def export_wheels(deps, stage):
+    """Build wheels for deps and their dependencies into the bundle"""
+    # the build backend lets the local packages install offline as well
+    for dep in ['setuptools', 'wheel'] + deps:
+        do(msg=f"build wheel {dep}", cmd=f'pip3 wheel -w {stage}/wheels "{dep}"')
+
+def close_bundle(stage, bundle, components):
+    """
+    Index the bundle's repository, record the components in the manifest and pack it
+
+    components maps each component name to its {'apt': [...], 'pip': [...]}.
+    """
+    import hashlib
+    import json
+    debs = os.path.join(stage, 'debs')
+    entries = []
+    for name in sorted(os.listdir(debs)):
+        if not name.endswith('.deb'):
+            continue
+        _, control = run_command(f'dpkg-deb -f {debs}/{name}')
+        if not control.startswith('Package:'):
+            continue  # not a valid package
+        md5, sha256, size = hashlib.md5(), hashlib.sha256(), 0
+        with open(os.path.join(debs, name), 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                md5.update(chunk)
+                sha256.update(chunk)
+                size += len(chunk)
+        entries.append(control.strip() + f"\nFilename: ./{name}\nSize: {size}"
+                       f"\nMD5sum: {md5.hexdigest()}\nSHA256: {sha256.hexdigest()}\n")
+    with open(os.path.join(debs, 'Packages'), 'w') as f:
+        f.write('\n'.join(entries))
+
+    manifest_file = os.path.join(stage, 'manifest.json')
+    manifest = {'components': {}}
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    manifest['python'] = os.path.basename(wheelhouse_dir()).split('-')[0]
+    manifest['arch'] = os.path.basename(wheelhouse_dir()).split('-', 1)[1]
+    manifest['components'].update(components)
+    with open(manifest_file, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    # .deb and .whl files are compressed already
+    bundle = os.path.abspath(bundle)
+    do(msg=f"pack bundle {bundle}",
+       cmd=f'tar -cf {bundle}.tmp -C {stage} . && mv {bundle}.tmp {bundle} && rm -rf {stage}')
+
+def use_bundle(bundle):
+    """Unpack bundle and make apt install from it, returns its staging directory"""
+    global apt_get, bundle_stage
+    stage = open_bundle(bundle)
+    source_list = os.path.join(stage, 'bundle.list')
+    with open(source_list, 'w') as f:
+        f.write(f"deb [trusted=yes] file:{stage}/debs ./\n")
+    # only the bundle is used as a source, the lists of the normal
+    # sources are kept for later
+    apt_get = (f"apt-get -o Dir::Etc::SourceList={source_list}"
+               " -o Dir::Etc::SourceParts=- -o APT::Get::List-Cleanup=0")
+    bundle_stage = stage
+    return stage
+
+def bundle_file(component, name):
+    """Path of the file or directory name of component, from the bundle if it has one"""
+    if bundle_stage is not None and os.path.exists(os.path.join(bundle_stage, name)):
+        return os.path.join(bundle_stage, name)
+    return os.path.join(component['source'], name)
+
+# Caching proxy for apt and pip, see cache_proxy.py
+CACHE_PROXY_PORT = 3142
+cache_proxy = None  # the proxy process started by --cache-proxy without a URL
+
+def proxy_running(url):
+    import urllib.request
+    try:
+        urllib.request.urlopen(f"{url}/stats", timeout=2).close()
+        return True
+    except OSError:
+        return False
+
+def start_cache_proxy():
+    """Start cache_proxy.py on this machine unless it runs already, returns its URL"""
+    global cache_proxy
+    import subprocess
+    url = f"http://127.0.0.1:{CACHE_PROXY_PORT}"
+    if planning or proxy_running(url):
+        return url
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache_proxy.py')
+    proxy_dir = root_path("/var/cache/picrawler/proxy")
+    os.makedirs(proxy_dir, exist_ok=True)
+    with open(os.path.join(proxy_dir, 'proxy.log'), 'a') as proxy_log:
+        cache_proxy = subprocess.Popen([sys.executable, script, "--listen=127.0.0.1",
+                                        f"--port={CACHE_PROXY_PORT}", f"--dir={proxy_dir}"],
+                                       stdout=proxy_log, stderr=subprocess.STDOUT,
+                                       start_new_session=True)
+    for _ in range(50):
+        if proxy_running(url):
+            break
+        if cache_proxy.poll() is not None:
+            warn(f"cache proxy failed to start, see {proxy_dir}/proxy.log")
+            cache_proxy = None
+            return None
+        time.sleep(0.1)
+    return url
+
+def stop_cache_proxy():
+    global cache_proxy
+    if cache_proxy is not None:
+        cache_proxy.terminate()
+        cache_proxy.wait()
+        cache_proxy = None
+
+def use_cache_proxy(url):
+    """Send the downloads of apt (http sources) and pip through the caching proxy at url"""
+    global apt_get, apt_proxy
+    from urllib.parse import urlsplit
+    url = url.rstrip('/')
+    apt_proxy = f" -o Acquire::http::Proxy={url}"
+    apt_get += apt_proxy
+    # the pip3 commands inherit these, including pip3 wheel and the fallbacks
+    os.environ['PIP_INDEX_URL'] = f"{url}/simple/"
+    os.environ['PIP_TRUSTED_HOST'] = urlsplit(url).netloc  # it serves plain http
+
+# apt-get update only when the package indexes are older than
+# --apt-max-age or were fetched for other sources, see apt_update()
+APT_MAX_AGE = 3600
+apt_update_skipped = False
+
+def apt_sources_key():
+    """Hash of the apt sources and the apt-get command, the indexes belong to them"""
+    import glob
+    import hashlib
+    digest = hashlib.sha256(apt_get.encode('utf-8'))
+    sources = [root_path('/etc/apt/sources.list')]
+    sources += sorted(glob.glob(root_path('/etc/apt/sources.list.d/*')))
+    for file in sources:
+        digest.update(f"{file}\0{read_file(file)}\0".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+def apt_lists_key():
+    """Changes whenever apt-get update brings new indexes"""
+    return str(mtime(root_path('/var/lib/apt/lists')))
+
+def apt_index_age():
+    """Seconds since apt-get update fetched the indexes of the current sources, None if unknown"""
+    try:
+        lists = os.listdir(root_path('/var/lib/apt/lists'))
+    except OSError:
+        return None
+    if not any('_Packages' in name for name in lists):
+        return None  # e.g. removed by a Docker image build
+    entry = load_probes().get('apt_update')
+    if entry is None or entry['key'] != apt_sources_key():
+        return None
+    return time.time() - entry['value']
+
+def apt_update(max_age=APT_MAX_AGE):
+    global apt_update_skipped
+    cmd = f'{apt_get} update'
+    age = apt_index_age()
+    if age is not None and 0 <= age < max_age:
+        apt_update_skipped = True
+        skip("update apt-get", cmd, f"indexes refreshed {format_time(age)} ago")
+        return
+    apt_update_skipped = False
+    if do(msg="update apt-get", cmd=cmd) and not planning:
+        store_probe('apt_update', apt_sources_key(), time.time())
+
+def dpkg_interrupted():
+    """Whether dpkg has work left, from an interrupted run or a package left unconfigured"""
+    try:
+        if len(os.listdir(root_path('/var/lib/dpkg/updates'))) > 0:
+            return True  # the journal of a dpkg run that didn't finish
+    except OSError:
+        pass
+    for line in read_file(root_path('/var/lib/dpkg/status')).splitlines():
+        if line.startswith('Status: ') and line.split(' ')[-1] not in (
+                'installed', 'not-installed', 'config-files'):
+            return True  # e.g. "install ok half-configured"
+    return False
+
+def dpkg_configure():
+    cmd = 'dpkg --configure -a'
+    if not dpkg_interrupted():
+        skip("dpkg configure", cmd, "no interrupted dpkg run")
+        return
+    do(msg="dpkg configure", cmd=cmd)
+
+def apt_install(deps):
+    """Install apt packages in one transaction, one by one if that fails"""
+    if len(deps) == 0:
+        return
+    # A single solve, dpkg lock cycle and trigger run for the whole list
+    if do(msg=f"install {len(deps)} packages in one transaction",
+          cmd=f'{apt_get} install -y {" ".join(deps)}', report=False):
+        return
+    if apt_update_skipped:
+        # the mirror may have dropped versions the old indexes point to
+        apt_update(0)
+        if do(msg=f"install {len(deps)} packages in one transaction",
+              cmd=f'{apt_get} install -y {" ".join(deps)}', report=False):
+            return
+    # Retry one by one so each failing package is reported in errors
+    for dep in deps:
+        do(msg=f"install {dep}", cmd=f'{apt_get} install {dep} -y')
+
+# Component manifests, see components.py. A manifest is a dict with:
+#     name:      package name, used in step names and messages
+#     source:    directory of the component's checkout, set by the installer
+#     requires:  components whose Python package has to be installed first
+#     apt, pip:  packages, each either a name or a dict with
+#                    name:      the name, or a function returning it
+#                    when:      function, the package is only used if it returns True
+#                    otherwise: warning printed if it doesn't
+#     optional:  pip packages allowed to conflict with the system ones,
+#                dicts with name, when and args (extra pip3 arguments)
+#     build_depends: pip package -> apt packages it needs to build
+#     dpkg_configure: finish an interrupted dpkg run before apt-get update
+#     min_debian: oldest supported Debian release (Ubuntu is mapped to one)
+#     actions:   steps after the packages, dicts with name, run (a function
+#                called with the manifest), and optional after, locks, when
+#     bundle:    files and directories of the checkout that go into a bundle
+#     verify:    checks of --verify, dicts with name, check (a function called
+#                with the manifest, returns ok and a detail) and optional
+#                timeout, when
+#     finish:    lines printed when everything went well
+#     error_note: lines printed after the errors
+
+def resolve(entries):
+    """Names of the packages in entries whose condition holds, in order and without duplicates"""
+    names = []
+    for entry in entries:
+        if isinstance(entry, dict):
+            if 'when' in entry and not entry['when']():
+                if 'otherwise' in entry:
+                    warn(entry['otherwise'])
+                continue
+            name = entry['name']
+            if callable(name):
+                name = name()
+        else:
+            name = entry
+        if name not in names:
+            names.append(name)
+    return names
+
+def component_user(component):
+    """Owner of the component's checkout, the user the files are set up for"""
+    import pwd
+    return pwd.getpwuid(os.stat(component['source']).st_uid).pw_name
+
+# Post-install stage: bytecode for everything in dist-packages, so the
+# first import on the robot doesn't compile, and an -X importtime
+# profile of each component's package, see print_import_profile()
+IMPORT_PROFILE_DIR = root_path("/var/cache/picrawler/importtime")
+import_profiles = {}  # module -> {'total': seconds, 'packages': {package: seconds}}
+
+def dist_packages():
+    """Where sudo pip3 installs to"""
+    python_version = check_python_version()
+    return root_path(f"/usr/local/lib/python{python_version[0]}.{python_version[1]}/dist-packages")
+
+def precompile():
+    path = dist_packages()
+    # -j 0: a process per core, files with an up to date .pyc are skipped
+    cmd = f"{sys.executable} -m compileall -q -j 0 {path}"
+    if not os.path.isdir(path):
+        skip("precompile bytecode", cmd, f"no {path}")
+        return
+    # some packages ship files that don't compile (e.g. templates), not an error
+    do(msg="precompile bytecode", cmd=cmd, report=False)
+
+def parse_importtime(text):
+    """{top-level package: seconds to import it with everything it imports}"""
+    packages = {}
+    for line in text.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            cumulative = int(fields[1]) / 1e6
+        except ValueError:
+            continue  # the header
+        package = fields[2].strip().split('.')[0]
+        if fields[2] == ' site':
+            packages.clear()  # the interpreter's startup ends with site
+            continue
+        packages[package] = max(packages.get(package, 0.0), cumulative)
+    return packages
+
+def import_profile(module):
+    """Import module with -X importtime in a new python3, the output goes to IMPORT_PROFILE_DIR"""
+    file = os.path.join(IMPORT_PROFILE_DIR, f"{module}.txt")
+    if not planning:
+        os.makedirs(IMPORT_PROFILE_DIR, exist_ok=True)
+    # from /, so the checkout in the current directory isn't imported instead
+    if not do(msg=f"profile import {module}",
+              cmd=f"cd / && {sys.executable} -X importtime -c 'import {module}' 2> {file}",
+              report=False) or planning:
+        return
+    packages = parse_importtime(read_file(file))
+    total = packages.pop(module, 0.0)
+    import_profiles[module] = {'total': round(total, 3),
+                               'packages': dict((name, round(seconds, 3)) for name, seconds
+                                                in packages.items())}
+
+def print_import_profile(top=5):
+    """Print the import time of each component's package and its slowest packages"""
+    if len(import_profiles) == 0 or top <= 0:
+        return
+    print("\nImport time (python3 -X importtime, %s):" % IMPORT_PROFILE_DIR)
+    for module, profile in import_profiles.items():
+        slowest = sorted(profile['packages'].items(), key=lambda item: item[1], reverse=True)
+        print("  %7.2fs  %s: %s" % (profile['total'], module, ', '.join(
+            "%s %.2fs" % (name, seconds) for name, seconds in slowest[:top])))
+
+# Lazy imports of the heavy optional packages, see --lazy-imports. Put
+# into dist-packages as picrawler_lazy.py and started by a .pth file.
+LAZY_IMPORT_SHIM = '''"""
+Import mediapipe, tflite_runtime, tensorflow and pygame only when they are used
+
+Installed by the PiCrawler installers (--lazy-imports) and loaded at
+startup by picrawler-lazy.pth. "import mediapipe" only finds the package;
+it runs when the program first uses something from it. Errors inside
+the package show up at that point, not at the import.
+
+PICRAWLER_EAGER_IMPORTS=1 turns it off, deleting picrawler-lazy.pth removes it.
+"""
+import importlib.abc
+import importlib.util
+import os
+import sys
+
+LAZY = {'mediapipe', 'tflite_runtime', 'tensorflow', 'pygame'}
+
+class LazyFinder(importlib.abc.MetaPathFinder):
+    def find_spec(self, name, path, target=None):
+        if name not in LAZY:
+            return None
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if hasattr(spec.loader, 'exec_module'):
+                    spec.loader = importlib.util.LazyLoader(spec.loader)
+                return spec
+        return None
+
+if os.environ.get('PICRAWLER_EAGER_IMPORTS') != '1':
+    sys.meta_path.insert(0, LazyFinder())
+'''
+
+def install_lazy_imports():
+    path = dist_packages()
+    msg = "install lazy imports"
+    if planning:
+        planned.append({'msg': msg, 'cmd': f"write {path}/picrawler_lazy.py and picrawler-lazy.pth",
+                        'done': False})
+        return
+    try:
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'picrawler_lazy.py'), 'w') as f:
+            f.write(LAZY_IMPORT_SHIM)
+        with open(os.path.join(path, 'picrawler-lazy.pth'), 'w') as f:
+            f.write("import picrawler_lazy\n")
+        show(f" - {msg} ... Done")
+    except OSError as e:
+        errors.append(f"{msg} error:\n  {e}")
+        show(f" - {msg} ... \033[1;35mError\033[0m")
+
+def post_install_steps(components, steps, options):
+    """Precompile and profile after every step so far, and the lazy import shim"""
+    after = [step['name'] for step in steps]
+    post = [{'name': 'precompile', 'after': after, 'locks': ['pip'], 'run': precompile}]
+    if "--lazy-imports" in options:
+        post.append({'name': 'lazy-imports', 'after': after, 'locks': ['pip'],
+                     'run': install_lazy_imports})
+    # one at a time, so the imports don't slow each other down
+    previous = ['precompile', 'lazy-imports']
+    for component in components:
+        name = f"{component['name']}:import-profile"
+        post.append({'name': name, 'after': list(previous), 'locks': ['import-profile'],
+                     'run': lambda component=component: import_profile(component['name'])})
+    return post
+
+# Checks after the install, see --verify. Each component lists its
+# checks under 'verify', they run side by side with a timeout each. The
+# checks that passed are cached in VERIFY_FILE for the current boot, so
+# checking again only runs the ones that failed. An install clears it.
+VERIFY_FILE = root_path("/var/cache/picrawler/verify.json")
+VERIFY_TIMEOUT = 10  # seconds per check, unless it sets its own
+verify_results = []
+
+def check_module(name):
+    """Whether the kernel module name is loaded, from /proc/modules"""
+    for line in read_file(root_path('/proc/modules')).splitlines():
+        if line.split(' ', 1)[0] == name:
+            return True, f"{name} loaded"
+    return False, f"{name} not loaded"
+
+def check_device(pattern):
+    """Whether device nodes matching pattern exist, e.g. /dev/i2c-*"""
+    import glob
+    found = sorted(glob.glob(root_path(pattern)))
+    if len(found) == 0:
+        return False, f"no {pattern}"
+    return True, ' '.join(path[len(root_path('/')) - 1:] for path in found)
+
+def check_group(user, group, required=True):
+    """Whether user is in group, from /etc/group and /etc/passwd, a missing group passes unless required"""
+    if user == 'root':
+        return True, "root needs no group"
+    gid = None
+    for line in read_file(root_path('/etc/group')).splitlines():
+        fields = line.split(':')
+        if len(fields) >= 4 and fields[0] == group:
+            if user in fields[3].split(','):
+                return True, f"{user} in {group}"
+            gid = fields[2]
+    if gid is None:
+        return not required, f"no group {group}"
+    for line in read_file(root_path('/etc/passwd')).splitlines():
+        fields = line.split(':')
+        if len(fields) >= 4 and fields[0] == user and fields[3] == gid:
+            return True, f"{group} is the group of {user}"
+    return False, f"{user} not in {group}, log in again after the install"
+
+def check_import(module, timeout=VERIFY_TIMEOUT):
+    """Whether python3 can import module, in a process of its own"""
+    # from /, so a checkout in the current directory doesn't count as installed
+    status, result, _ = spawn(f'cd / && {sys.executable} -c "import {module}"', tail=3,
+                              timeout=timeout)
+    if status == 0:
+        return True, f"import {module}"
+    lines = [line for line in result.splitlines() if line.strip() != '']
+    return False, lines[-1] if len(lines) > 0 else f"import {module} failed ({status})"
+
+def check_i2c_device(bus, address):
+    """Whether a device answers at address on /dev/i2c-bus"""
+    import re
+    status, result, _ = spawn(f"i2cdetect -y {bus} {address:#x} {address:#x}", tail=20,
+                              timeout=VERIFY_TIMEOUT)
+    if status != 0:
+        return False, f"i2cdetect failed: {result.strip().splitlines()[-1:]}"
+    # the row of the address shows it, or UU if a driver holds it
+    row = f"{address & 0xf0:02x}:"
+    if re.search(rf"^{row}.*\b({address:02x}|UU)\b", result, re.M):
+        return True, f"found at {address:#x} on /dev/i2c-{bus}"
+    return False, f"nothing at {address:#x} on /dev/i2c-{bus}"
+
+def check_command(cmd, expect, timeout=VERIFY_TIMEOUT):
+    """Whether cmd succeeds and prints expect"""
+    status, result, _ = spawn(cmd, tail=20, timeout=timeout)
+    if status == 0 and expect in result:
+        return True, expect
+    lines = [line for line in result.splitlines() if line.strip() != '']
+    return False, lines[-1] if len(lines) > 0 else f"{cmd.split()[0]} failed ({status})"
+
+def verify(components, jobs=8):
+    """Run the checks of components, print a report, returns True if all passed"""
+    import json
+    from concurrent.futures import ThreadPoolExecutor, wait
+    cached = {}
+    try:
+        with open(VERIFY_FILE) as f:
+            cache = json.load(f)
+        if cache.get('boot_id') == boot_id():
+            cached = cache['passed']
+    except (OSError, ValueError):
+        pass
+
+    checks = []
+    for component in components:
+        for check in component.get('verify', []):
+            if 'when' in check and not check['when']():
+                continue
+            checks.append((f"{component['name']}: {check['name']}", check, component))
+
+    results = {}
+    todo = [(name, check, component) for name, check, component in checks if name not in cached]
+    pool = ThreadPoolExecutor(max_workers=jobs)
+    try:
+        futures = {pool.submit(check['check'], component): (name, check)
+                   for name, check, component in todo}
+        # spawn() stops the commands at their timeout, this is for the rest
+        timeout = max([check.get('timeout', VERIFY_TIMEOUT) for _, check, _ in todo], default=0)
+        wait(futures, timeout=timeout + 1)
+        for future, (name, check) in futures.items():
+            if not future.done():
+                results[name] = (False, f"no answer after {timeout}s")
+            elif future.exception() is not None:
+                results[name] = (False, f"{type(future.exception()).__name__}: {future.exception()}")
+            else:
+                results[name] = future.result()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    passed = dict((name, detail) for name, (ok, detail) in results.items() if ok)
+    try:
+        os.makedirs(os.path.dirname(VERIFY_FILE), exist_ok=True)
+        with open(VERIFY_FILE + '.tmp', 'w') as f:
+            json.dump({'boot_id': boot_id(), 'passed': dict(cached, **passed)}, f)
+        os.replace(VERIFY_FILE + '.tmp', VERIFY_FILE)
+    except OSError:
+        pass
+
+    verify_results.clear()
+    print(f"\nVerify, {len(checks)} checks ({len(checks) - len(todo)} passed before on this boot):")
+    width = max([len(name) for name, _, _ in checks], default=0)
+    for name, _, _ in checks:
+        if name in cached:
+            ok, detail, was_cached = True, cached[name], True
+        else:
+            (ok, detail), was_cached = results[name], False
+        verify_results.append({'check': name, 'ok': ok, 'detail': detail, 'cached': was_cached})
+        mark = '\033[0;32m✓\033[0m' if ok else '\033[0;31m✗\033[0m'
+        print(f"  {mark} {name:<{width}}  \033[38;5;8m{detail}\033[0m")
+    failed = len([result for result in verify_results if not result['ok']])
+    if failed > 0:
+        warn(f"{failed} of {len(checks)} checks failed."
+             " Modules, devices and groups need a reboot after the first install.")
+    return failed == 0
+
+def clear_verify():
+    try:
+        os.remove(VERIFY_FILE)
+    except OSError:
+        pass
+
+# Dry run, see --plan. do() only records the commands, print_plan()
+# shows them with the download size from the apt and pip metadata and
+# the time they took in earlier runs. The metadata is cached in
+# PLAN_CACHE_FILE, so planning again is quick.
+planning = False
+planned = []
+PLAN_CACHE_FILE = root_path("/var/cache/picrawler/plan-cache.json")
+PLAN_CACHE_AGE = 7 * 24 * 3600  # PyPI metadata older than that is fetched again
+plan_cache = None
+plan_cache_lock = threading.Lock()
+
+def cached_metadata(key, fetch, max_age=None):
+    """fetch() cached in PLAN_CACHE_FILE under key, None results are not kept"""
+    import json
+    global plan_cache
+    with plan_cache_lock:
+        if plan_cache is None:
+            try:
+                with open(PLAN_CACHE_FILE) as f:
+                    plan_cache = json.load(f)
+            except (OSError, ValueError):
+                plan_cache = {}
+        entry = plan_cache.get(key)
+        if entry is not None and (max_age is None or time.time() - entry['time'] < max_age):
+            return entry['value']
+    value = fetch()
+    if value is not None:
+        with plan_cache_lock:
+            plan_cache[key] = {'value': value, 'time': round(time.time())}
+    return value
+
+def save_plan_cache():
+    import json
+    if plan_cache is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(PLAN_CACHE_FILE), exist_ok=True)
+        with open(PLAN_CACHE_FILE + '.tmp', 'w') as f:
+            json.dump(plan_cache, f)
+        os.replace(PLAN_CACHE_FILE + '.tmp', PLAN_CACHE_FILE)
+    except OSError:
+        pass  # e.g. planning without root
+
+def mtime(file):
+    try:
+        return os.stat(file).st_mtime
+    except OSError:
+        return 0
+
+def apt_download_size(cmd):
+    """Bytes the apt-get command cmd downloads, from apt-get --print-uris"""
+    # valid until the package lists or the installed packages change
+    key = 'apt:' + step_hash(f"{cmd} {apt_lists_key()} {mtime(root_path('/var/lib/dpkg/status'))}")
+    def fetch():
+        status, result = run_command(f"{cmd} --print-uris -qq 2>/dev/null")
+        if status != 0:
+            return None
+        size = 0
+        for line in result.splitlines():
+            # 'uri' file size checksum, a bundle's file: uris need no download
+            fields = line.split()
+            if len(fields) >= 3 and fields[0].startswith("'") and not fields[0].startswith("'file:"):
+                size += int(fields[2])
+        return size
+    return cached_metadata(key, fetch)
+
+def pypi_download_size(dep):
+    """
+    Bytes of the file pip3 would download for the requirement dep, from PyPI
+
+    The wheel of the newest matching release for this Python and
+    architecture, else its sdist. Dependencies of dep are not counted.
+    """
+    import platform
+    try:
+        from packaging.requirements import Requirement
+        from packaging.version import Version
+    except ImportError:
+        try:
+            from pip._vendor.packaging.requirements import Requirement
+            from pip._vendor.packaging.version import Version
+        except ImportError:
+            return None
+    try:
+        req = Requirement(dep)
+    except Exception:
+        return None
+    tag = "cp%d%d" % (sys.version_info.major, sys.version_info.minor)
+    arch = platform.machine()
+
+    def fetch():
+        import json
+        import urllib.request
+        try:
+            with urllib.request.urlopen(f"https://pypi.org/pypi/{req.name}/json", timeout=5) as r:
+                releases = json.load(r)['releases']
+        except Exception:
+            return None
+        versions = []
+        for version, files in releases.items():
+            try:
+                if len(files) > 0 and req.specifier.contains(version):
+                    versions.append(Version(version))
+            except Exception:
+                continue  # not a valid version
+        if len(versions) == 0:
+            return None
+        files = releases[str(max(versions))]
+        def score(file):
+            name = file['filename']
+            if not name.endswith('.whl'):
+                return 1
+            if (arch in name or 'any' in name) and (tag in name or 'py3' in name or 'abi3' in name):
+                return 2
+            return 0
+        best = max(files, key=score)
+        if score(best) == 0:
+            return None
+        return best['size']
+    return cached_metadata(f"pypi:{dep}:{tag}-{arch}", fetch, PLAN_CACHE_AGE)
+
+def download_size(cmd):
+    """Estimated bytes cmd downloads, None if unknown"""
+    import re
+    if cmd.startswith("apt-get") and (" install " in cmd or " upgrade " in cmd):
+        return apt_download_size(cmd)
+    if " pip3 install " not in f" {cmd}" and " pip3 wheel " not in f" {cmd}":
+        return 0
+    dep = re.search(r'"([^"]+)"', cmd)
+    if dep is None or dep.group(1).startswith('.'):
+        return 0  # a local package
+    dep = dep.group(1)
+    find_links = re.search(r'--find-links (\S+)', cmd)
+    if find_links is not None:
+        name = _canonical_name(re.split(r'[\[<>=!~; ]', dep)[0]).replace('-', '_')
+        try:
+            wheels = [f.lower() for f in os.listdir(find_links.group(1))]
+        except OSError:
+            wheels = []
+        if any(f.startswith(name + '-') for f in wheels) or "||" not in cmd:
+            return 0
+    return pypi_download_size(dep)
+
+def step_history(options):
+    """Durations of the steps of earlier runs, by command hash and by message"""
+    import json
+    by_hash, by_msg = {}, {}
+    try:
+        with open(JOURNAL_FILE) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry['status'] == 0:
+                    by_hash[entry['hash']] = entry['duration']
+                    by_msg[entry['msg']] = entry['duration']
+    except OSError:
+        pass
+    trace = get_option(options, "--trace")
+    if trace is not None and os.path.exists(trace):
+        with open(trace) as f:
+            for stat in json.load(f).get('steps', []):
+                if stat['status'] == 0:
+                    by_hash.setdefault(stat.get('hash'), stat['wall'])
+                    by_msg.setdefault(stat['msg'], stat['wall'])
+    return by_hash, by_msg
+
+def format_size(size):
+    if size is None:
+        return '?'
+    if size == 0:
+        return '-'
+    return "%.1fM" % (size / 1e6)
+
+def format_time(seconds):
+    if seconds is None:
+        return '?'
+    if seconds >= 60:
+        return "%dm%02ds" % (seconds // 60, seconds % 60)
+    return "%.1fs" % seconds
+
+def print_plan(options):
+    """Print the commands recorded by do() with their estimated download size and time"""
+    from concurrent.futures import ThreadPoolExecutor
+    by_hash, by_msg = step_history(options)
+    # the lookups wait for apt and PyPI, so they run side by side
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        sizes = list(pool.map(lambda step: 0 if step['done'] else download_size(step['cmd']),
+                              planned))
+    save_plan_cache()
+
+    print(f"\nPlan, {len([step for step in planned if not step['done']])} commands:")
+    print("  %9s %9s  %s" % ('download', 'time', 'step'))
+    total_size = total_time = 0
+    unknown = 0
+    for step, size in zip(planned, sizes):
+        if step['done']:
+            print(f"\033[38;5;8m  %9s %9s  %s (%s, skipped)\033[0m"
+                  % ('', '', step['msg'], step.get('reason', 'done before')))
+            continue
+        duration = by_hash.get(step_hash(step['cmd']), by_msg.get(step['msg']))
+        if size is None or duration is None:
+            unknown += 1
+        total_size += size or 0
+        total_time += duration or 0
+        print("  %9s %9s  %s" % (format_size(size), format_time(duration), step['msg']))
+        print(f"\033[38;5;8m  %19s  %s\033[0m" % ('', step['cmd']))
+    print(f"\nTotal: {format_size(total_size)} to download, about {format_time(total_time)}"
+          " one step after the other")
+    if unknown > 0:
+        print(f"\033[38;5;8m {unknown} steps without a size or time estimate, not counted\033[0m")
+
+def plan_steps(components, options):
+    """
+    Plan the install of components as one graph of steps, see run_steps()
+
+    apt and dpkg steps share the "dpkg" lock, pip steps share "pip" so
+    they never write site-packages at the same time, and everything
+    else runs alongside. The packages of all components go through one
+    apt-get update, one apt-get install and one pip3 run each.
+    Returns the steps and a function to call once they are done.
+    """
+    _is_bsps = pip_bsps()
+    _if_build_isolation = ""
+    if "--no-build-isolation" in options:
+        _if_build_isolation = "--no-build-isolation"
+    force = "--reinstall" in options
+
+    wheelhouse = pick_wheelhouse(options)
+    build = "--build-wheelhouse" in options
+    offline = False
+    bundle_in = get_option(options, "--from-bundle")
+    bundle_out = get_option(options, "--export-bundle")
+    if bundle_in is not None:
+        print(f"\033[38;5;8m install offline from bundle {bundle_in}\033[0m")
+        use_bundle(bundle_in)
+        wheelhouse, build, offline = f"{bundle_stage}/wheels", False, True
+    if wheelhouse is not None:
+        print(f"\033[38;5;8m pip3 install from wheelhouse {wheelhouse}\033[0m")
+    if "--cache-proxy" in options or get_option(options, "--cache-proxy") is not None:
+        if bundle_in is not None:
+            warn("--cache-proxy is not needed with --from-bundle, ignored")
+        else:
+            proxy = get_option(options, "--cache-proxy") or start_cache_proxy()
+            if proxy is not None:
+                print(f"\033[38;5;8m download through the cache proxy {proxy}\033[0m")
+                use_cache_proxy(proxy)
+
+    temp_dirs = []
+    def cleanup():
+        import shutil
+        stop_cache_proxy()
+        if bundle_stage is not None:
+            shutil.rmtree(bundle_stage, ignore_errors=True)
+        for temp_dir in temp_dirs:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def install_package(component):
+        msg = f"install {component['name']} package {_if_build_isolation}".strip()
+        cmd = (f"cd {component['source']} && "
+               + pip_install_cmd("./", f"{_is_bsps} {_if_build_isolation}",
+                                 wheelhouse, build, offline))
+        digest = source_hash(component['source'])
+        # building a wheelhouse or a bundle needs the package's wheel
+        if (not force and not build and bundle_out is None
+                and package_unchanged(component, digest)):
+            skip(msg, cmd, "unchanged since the last install")
+            return
+        # the same command after the checkout changed is another step
+        if do(msg=msg, cmd=cmd, key=digest) and not planning:
+            record_package(component, digest)
+
+    steps = []
+    for component in components:
+        name = component['name']
+        after = [f"{required}:lib" for required in component.get('requires', [])]
+        steps.append({'name': f'{name}:lib', 'after': after, 'locks': ['pip'],
+                      'run': lambda component=component: install_package(component)})
+    if "--only-lib" in options:
+        return steps + post_install_steps(components, steps, options), cleanup
+
+    if "--no-dep" not in options:
+        apt_list, pip_list, optional, build_depends = [], [], [], {}
+        contents = {}  # what each component needs here, for the bundle
+        for component in components:
+            contents[component['name']] = {'apt': resolve(component.get('apt', [])),
+                                           'pip': resolve(component.get('pip', []))}
+            apt_list += [dep for dep in contents[component['name']]['apt'] if dep not in apt_list]
+            pip_list += [dep for dep in contents[component['name']]['pip'] if dep not in pip_list]
+            for entry in component.get('optional', []):
+                if 'when' in entry and not entry['when']():
+                    if 'otherwise' in entry:
+                        warn(entry['otherwise'])
+                    continue
+                optional.append(entry)
+            build_depends.update(component.get('build_depends', {}))
+        apt_deps = skip_installed(apt_list, apt_missing, "apt", force=force)
+        pip_deps = skip_installed(pip_list, pip_missing, "pip", force=force)
+        if _is_bsps != '':
+            print("\033[38;5;8m pip3 install with --break-system-packages\033[0m")
+
+        if any(component.get('dpkg_configure') for component in components):
+            steps.append({'name': 'dpkg-configure', 'locks': ['dpkg'], 'run': dpkg_configure})
+        apt_max_age = float(get_option(options, "--apt-max-age", APT_MAX_AGE))
+        steps.append({'name': 'apt-update', 'after': ['dpkg-configure'], 'locks': ['dpkg'],
+                      'run': lambda: apt_update(apt_max_age)})
+        # pip itself is replaced here, so no pip3 may run meanwhile. It goes
+        # before apt-install, so the pip steps that need no headers from
+        # apt-install run during it
+        steps.append({'name': 'pip-update', 'after': ['apt-update'], 'locks': ['dpkg', 'pip'],
+                      'run': lambda: do(msg="update pip3", cmd=f'{apt_get} upgrade -y python3-pip')})
+        steps.append({'name': 'apt-install', 'after': ['apt-update', 'pip-update'],
+                      'locks': ['dpkg'], 'run': lambda: apt_install(apt_deps)})
+
+        for dep in pip_deps:
+            after = ['pip-update']
+            if not set(build_depends.get(dep, [])).isdisjoint(apt_deps):
+                after.append('apt-install')
+            if dep.endswith('.whl'):
+                dep_name = dep.split("/")[-1]
+            else:
+                dep_name = dep
+            steps.append({'name': f'pip:{dep}', 'after': after, 'locks': ['pip'],
+                          'run': lambda dep=dep, dep_name=dep_name: do(
+                              msg=f"install {dep_name}",
+                              cmd=pip_install_cmd(dep, _is_bsps, wheelhouse, build, offline))})
+
+        def install_optional():
+            todo = [entry['name'] for entry in optional]
+            if not force:
+                todo = pip_missing(todo)
+            for entry in optional:
+                if entry['name'] not in todo:
+                    log(f"\033[38;5;8m  {entry['name']} is already installed... Skip \033[0m")
+                    continue
+                log(f"  {entry['name']}: Installing with {entry.get('args', '')} to avoid conflicts...")
+                do(msg=f"install {entry['name']} (optional)",
+                   cmd=pip_install_cmd(entry['name'], f"{_is_bsps} {entry.get('args', '')}",
+                                       wheelhouse, build, offline))
+
+        if len(optional) > 0:
+            # after the core dependencies, so it sees what they installed
+            steps.append({'name': 'pip-optional', 'locks': ['pip'],
+                          'after': ['pip-update'] + [f'pip:{dep}' for dep in pip_deps],
+                          'run': install_optional})
+
+        if bundle_out is not None:
+            # the wheels build against the headers installed above
+            export_stage = open_bundle(bundle_out)
+            if planning:
+                temp_dirs.append(export_stage)  # packed and removed by a real run only
+            export_pip = pip_list + [entry['name'] for entry in optional
+                                     if entry['name'] not in pip_list]
+            steps.append({'name': 'bundle-debs', 'after': ['apt-update'],
+                          'run': lambda: export_debs(apt_list + ['python3-pip'], export_stage)})
+            steps.append({'name': 'bundle-wheels', 'after': ['apt-install', 'pip-update'],
+                          'run': lambda: export_wheels(export_pip, export_stage)})
+
+            def pack_bundle():
+                import shutil
+                for component in components:
+                    for name in component.get('bundle', []):
+                        shutil.copytree(os.path.join(component['source'], name),
+                                        os.path.join(export_stage, name), dirs_exist_ok=True)
+                close_bundle(export_stage, bundle_out, contents)
+            steps.append({'name': 'bundle', 'after': ['bundle-debs', 'bundle-wheels'],
+                          'run': pack_bundle})
+    elif bundle_out is not None:
+        warn("--export-bundle needs the dependencies, ignored with --no-dep")
+
+    for component in components:
+        name = component['name']
+        own = set(['lib'] + [action['name'] for action in component.get('actions', [])])
+        for action in component.get('actions', []):
+            if 'when' in action and not action['when']():
+                continue
+            after = [f"{name}:{step}" if step in own else step
+                     for step in action.get('after', [])]
+            steps.append({'name': f"{name}:{action['name']}", 'after': after,
+                          'locks': action.get('locks', []),
+                          'run': lambda action=action, component=component: action['run'](component)})
+    return steps + post_install_steps(components, steps, options), cleanup
+
+def write_report(file, components):
+    """Write the system, the steps and the errors of this install to file as JSON"""
+    import json
+    import platform
+    python_version = check_python_version()
+    report = {'host': platform.node(),
+              'os': f"{os_release().get('ID', detect_os())}-{os_release().get('VERSION_ID', '')}",
+              'python': "cp%d%d" % python_version[:2],
+              'arch': platform.machine(),
+              'components': [component['name'] for component in components],
+              'ok': len(errors) == 0,
+              'duration': round(time.time() - profile_start, 3),
+              'steps': step_stats,
+              'errors': errors}
+    if len(verify_results) > 0:
+        report['verify'] = verify_results
+    if len(import_profiles) > 0:
+        report['imports'] = import_profiles
+    with open(file + '.tmp', 'w') as f:
+        json.dump(report, f, indent=1)
+    os.replace(file + '.tmp', file)
+
+def print_errors():
+    print("\n\nError happened in install process:")
+    for err in errors:
+        print(err)
+    print("Try to fix it yourself, or contact service@sunfounder.com with this message")
+
+def install(components, options):
+    """Install components (manifests with their source set) together"""
+    global log_file, step_timeout, planning
+    planning = "--plan" in options
+    if "--verify-only" in options:
+        if not verify(components):
+            errors.append("verify error: some checks failed")
+        if get_option(options, "--report") is not None:
+            write_report(get_option(options, "--report"), components)
+        return
+    if not planning:
+        check_root()
+    print_system_info()
+    for component in components:
+        if check_raspbain_version() < component.get('min_debian', 0):
+            warn(f"System not be supported by {component['name']}."
+                 " Requires Debian 11 (bullseye) or Ubuntu 22.04+")
+            print('Please use newer system or use "legacy" branch.')
+            sys.exit(1)
+
+    jobs = int(get_option(options, "--jobs", 4))
+    if planning:
+        if "--resume" in options:
+            open_journal(resume=True)  # only to know what is done already
+        steps, cleanup = plan_steps(components, options)
+        try:
+            run_steps(steps, 1)
+        finally:
+            cleanup()
+        print_plan(options)
+        return
+
+    open_journal(resume="--resume" in options)
+    if get_option(options, "--log") is not None:
+        log_file = open(get_option(options, "--log"), 'a', buffering=1)
+    if get_option(options, "--step-timeout") is not None:
+        step_timeout = float(get_option(options, "--step-timeout"))
+
+    steps, cleanup = plan_steps(components, options)
+    clear_verify()  # the install may change what the checks find
+    print(f"Install with {jobs} parallel jobs:")
+    try:
+        run_steps(steps, jobs)
+    finally:
+        cleanup()
+
+    print_profile(int(get_option(options, "--profile", 5)))
+    print_import_profile(int(get_option(options, "--profile", 5)))
+    if "--verify" in options and not verify(components):
+        errors.append("verify error: some checks failed, see above")
+    if get_option(options, "--trace") is not None:
+        write_trace(get_option(options, "--trace"))
+    if get_option(options, "--report") is not None:
+        write_report(get_option(options, "--report"), components)
+
+    if len(errors) == 0:
+        for component in components:
+            for line in component.get('finish', []):
+                print(line)
+    else:
+        print_errors()
+        for component in components:
+            for line in component.get('error_note', []):
+                print(line)
+
+def main(components, options):
+    """install() with Ctrl+C handling, for the installer scripts, exits with 1 on errors"""
+    plain_output()
+    try:
+        install(components, options)
+    except KeyboardInterrupt:
+        stop_commands()
+        if len(errors) > 0:
+            print_errors()
+        print("\n\nCanceled.")
+        print("Run again with --resume to continue where it stopped.")
+    finally:
+        sys.stdout.write('\033[?25h')
+        sys.stdout.flush()
+    if len(errors) > 0:
+        sys.exit(1)
@@ -0,0 +1,92 @@
+"""
+Tests of cache_proxy.py, with http.server as the upstream mirror
+
+    python3 -m pytest scripts/test_cache_proxy.py
+"""
+import functools
+import http.server
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+import cache_proxy
+
+def start_server(handler):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+class CacheProxyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="cache-proxy-test-")
+        mirror = os.path.join(self.directory, 'mirror')
+        os.makedirs(os.path.join(mirror, 'ports.ubuntu.com', 'pool'))
+        os.makedirs(os.path.join(mirror, 'example.com'))
+        self.write(mirror, 'ports.ubuntu.com/pool/small.deb', 100)
+        self.write(mirror, 'ports.ubuntu.com/pool/big.deb', 5000)
+        self.write(mirror, 'example.com/file.deb', 100)
+        quiet = type('Quiet', (http.server.SimpleHTTPRequestHandler,),
+                     {'log_message': lambda self, *args: None})
+        self.upstream = start_server(functools.partial(quiet, directory=mirror))
+        cache_proxy.cache_dir = os.path.join(self.directory, 'cache')
+        cache_proxy.upstream = f"http://127.0.0.1:{self.upstream.server_port}"
+        cache_proxy.max_size = 1000
+        cache_proxy.entries.clear()
+        cache_proxy.cache_size = 0
+        for name in cache_proxy.stats:
+            cache_proxy.stats[name] = 0
+        handler = cache_proxy.make_handler()
+        handler.log_message = lambda self, *args: None
+        self.proxy = start_server(handler)
+
+    def tearDown(self):
+        self.proxy.shutdown()
+        self.upstream.shutdown()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def write(self, mirror, path, size):
+        with open(os.path.join(mirror, path), 'wb') as f:
+            f.write(bytes(range(256)) * (size // 256) + bytes(size % 256))
+
+    def get(self, url):
+        with urllib.request.urlopen(f"http://127.0.0.1:{self.proxy.server_port}/url/{url}") as response:
+            return response.read()
+
+    def test_cached(self):
+        self.assertEqual(len(self.get('http/ports.ubuntu.com/pool/small.deb')), 100)
+        self.assertEqual(len(self.get('http/ports.ubuntu.com/pool/small.deb')), 100)
+        self.assertEqual((cache_proxy.stats['misses'], cache_proxy.stats['hits']), (1, 1))
+        self.assertEqual(cache_proxy.cache_size, 100)
+
+    def test_too_big_passed_through(self):
+        data = self.get('http/ports.ubuntu.com/pool/big.deb')
+        with open(os.path.join(self.directory, 'mirror', 'ports.ubuntu.com/pool/big.deb'), 'rb') as f:
+            self.assertEqual(data, f.read())
+        self.assertEqual(cache_proxy.stats['passed_through'], 1)
+        self.assertEqual(cache_proxy.stats['evicted'], 0)
+        self.assertEqual(cache_proxy.cache_size, 0)
+        self.assertFalse(os.path.exists(cache_proxy.cache_path('http://ports.ubuntu.com/pool/big.deb')))
+        self.assertFalse(os.path.exists(cache_proxy.cache_path('http://ports.ubuntu.com/pool/big.deb')
+                                        + '.part'))
+
+    def test_other_hosts_denied(self):
+        with self.assertRaises(urllib.error.HTTPError) as error:
+            self.get('http/example.com/file.deb')
+        self.assertEqual(error.exception.code, 403)
+        self.assertEqual(cache_proxy.stats['denied'], 1)
+        cache_proxy.allowed_hosts.append('example.com')
+        try:
+            self.assertEqual(len(self.get('http/example.com/file.deb')), 100)
+        finally:
+            cache_proxy.allowed_hosts.remove('example.com')
+
+if __name__ == "__main__":
+    unittest.main()
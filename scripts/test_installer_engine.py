@@ -0,0 +1,80 @@
+"""
+Tests of the installer engine, on the fakes and fake root of bench.py
+
+    python3 -m pytest scripts/test_installer_engine.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+here = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, here)
+import bench
+import installer_engine
+
+class ScheduleTest(unittest.TestCase):
+
+    def test_pip_runs_during_apt_install(self):
+        sandbox = tempfile.mkdtemp(prefix="picrawler-test-")
+        try:
+            root = os.path.join(sandbox, 'root')
+            bench.make_root(root, 'ubuntu-24.04', '5')
+            cmd = bench.make_sandbox(sandbox, os.path.join(here, '..'), 'all',
+                                     {'apt-get': 1.0, 'pip3': 0.2}, {})
+            steps, total, ok = bench.install(sandbox, root, cmd, ["--reinstall", "--jobs=4"])
+        finally:
+            shutil.rmtree(sandbox, ignore_errors=True)
+        self.assertTrue(ok)
+        apt = [step for step in steps if step['step'] == 'apt-install']
+        self.assertGreater(len(apt), 0)
+        apt_start = min(step['start'] for step in apt)
+        apt_end = max(step['start'] + step['wall'] for step in apt)
+        pip = [step for step in steps if step['step'].startswith('pip:')
+               and step['start'] < apt_end and step['start'] + step['wall'] > apt_start]
+        self.assertGreater(len(pip), 0, "no pip step ran during apt-install")
+
+class VerifyTest(unittest.TestCase):
+
+    def test_import_check_ignores_the_checkout(self):
+        checkout = tempfile.mkdtemp(prefix="picrawler-test-")
+        cwd = os.getcwd()
+        try:
+            os.makedirs(os.path.join(checkout, 'picrawler_only_here'))
+            open(os.path.join(checkout, 'picrawler_only_here', '__init__.py'), 'w').close()
+            os.chdir(checkout)
+            ok, _ = installer_engine.check_import('picrawler_only_here')
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(checkout, ignore_errors=True)
+        self.assertFalse(ok)
+
+class OptionsTest(unittest.TestCase):
+
+    def test_number_options(self):
+        for jobs in ["0", "-2", "x", "2.5"]:
+            with self.assertRaises(SystemExit) as exit:
+                installer_engine.check_number_options([f"--jobs={jobs}"], "", ['--jobs'])
+            self.assertEqual(exit.exception.code, 1)
+        installer_engine.check_number_options(["--jobs=2", "--profile=-1"], "", ['--jobs'])
+
+class JournalTest(unittest.TestCase):
+
+    def test_resume_reruns_a_changed_checkout(self):
+        journal = os.path.join(tempfile.mkdtemp(prefix="picrawler-test-"), 'journal.jsonl')
+        try:
+            installer_engine.open_journal(file=journal)
+            self.assertTrue(installer_engine.do("install pkg", "true", key="digest-1"))
+            installer_engine.open_journal(resume=True, file=journal)
+            runs = len(installer_engine.step_stats)
+            installer_engine.do("install pkg", "true", key="digest-1")
+            self.assertEqual(len(installer_engine.step_stats), runs)  # skipped
+            installer_engine.do("install pkg", "true", key="digest-2")
+            self.assertEqual(len(installer_engine.step_stats), runs + 1)  # run again
+        finally:
+            installer_engine.journal_file = None
+            shutil.rmtree(os.path.dirname(journal), ignore_errors=True)
+
+if __name__ == "__main__":
+    unittest.main()